@@ -279,6 +279,7 @@ export function ImportDialog({ open, onOpenChange, onImported }: ImportDialogPro
           update_existing: updateExisting,
           download_photos: downloadPhotos,
           selected_rows: importAll ? null : Array.from(selectedRows),
+          total_rows: preview.total_rows,
         }),
       });
 
@@ -0,0 +1,121 @@
+"""Build manifest of generated cards: lets generation skip cards whose inputs did not change."""
+import os
+import sys
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Optional
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from src.file_utils import file_content_hash
+
+MANIFEST_NAME = ".build_manifest.json"
+
+
+def _settings_hash(template: dict) -> str:
+    """Hash of template settings (points, corner_radius, blend_strength, flags)."""
+    settings = {k: v for k, v in template.items() if k != 'path'}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _stat_signature(path: Path) -> str:
+    stat = path.stat()
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def unit_signature(unit: dict) -> str:
+    """Cheap stat-based signature of a unit's inputs (no file reads)."""
+    return "|".join((
+        _stat_signature(Path(unit['print_path'])),
+        _stat_signature(Path(unit['template']['path'])),
+        _settings_hash(unit['template'])
+    ))
+
+
+def unit_content_key(unit: dict) -> str:
+    """Content hash of a unit's inputs: print, template file and settings."""
+    key = "|".join((
+        file_content_hash(Path(unit['print_path'])),
+        file_content_hash(Path(unit['template']['path'])),
+        _settings_hash(unit['template'])
+    ))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def unit_inputs(unit: dict) -> dict:
+    """Signature and content key of a unit's inputs, as stored in the manifest.
+    
+    Pool workers take them before rendering, so hashing stays off the
+    dispatcher thread and describes exactly the files that were rendered.
+    """
+    return {"signature": unit_signature(unit), "key": unit_content_key(unit)}
+
+
+class BuildManifest:
+    """Manifest stored next to the generated cards of one output folder."""
+
+    def __init__(self, output_folder: Path):
+        self.path = Path(output_folder) / MANIFEST_NAME
+        self.cards: Dict[str, dict] = {}
+        self._dirty = False
+        if self.path.exists():
+            try:
+                self.cards = json.loads(self.path.read_text(encoding='utf-8')).get('cards', {})
+            except Exception:
+                self.cards = {}
+
+    def is_fresh(self, unit: dict) -> bool:
+        """True if the unit's output exists and was rendered from the same inputs."""
+        output_path = Path(unit['output_path'])
+        entry = self.cards.get(output_path.name)
+        if entry is None or not output_path.exists():
+            return False
+
+        try:
+            signature = unit_signature(unit)
+            if entry.get('signature') == signature:
+                return True
+            # mtime изменился (копирование, touch) - сверяем содержимое
+            if entry.get('key') != unit_content_key(unit):
+                return False
+        except OSError:
+            return False
+
+        entry['signature'] = signature
+        self._dirty = True
+        return True
+
+    def record(self, unit: dict, inputs: Optional[dict] = None):
+        """Remember the inputs of a successfully rendered unit (computed here if not given)."""
+        if inputs is None:
+            try:
+                inputs = unit_inputs(unit)
+            except OSError:
+                return
+        self.cards[Path(unit['output_path']).name] = {
+            "print": unit['print_path'],
+            "template": unit['template']['path'],
+            **inputs
+        }
+        self._dirty = True
+
+    def save(self):
+        """Write the manifest atomically if it changed."""
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({"cards": self.cards}, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def get_manifest(manifests: Dict[Path, BuildManifest], output_path: Path) -> BuildManifest:
+    """Manifest for the output folder of output_path, loaded once per mapping."""
+    folder = Path(output_path).parent
+    manifest: Optional[BuildManifest] = manifests.get(folder)
+    if manifest is None:
+        manifest = manifests[folder] = BuildManifest(folder)
+    return manifest
@@ -0,0 +1,84 @@
+"""SQLite store of marketplace cards: one row per card (filters are served from memory by Storage)."""
+import sys
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from backend.app.models import MarketplaceCard
+from backend.app.config import BASE_DIR
+
+CARDS_DB_FILE = BASE_DIR / "marketplace_cards.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+# Первая версия хранила article/marketplace/status отдельными колонками с индексами,
+# но фильтры читаются из памяти - переносим строки в таблицу без них (rowid сохраняет порядок)
+_DROP_FILTER_COLUMNS = """
+DROP INDEX IF EXISTS cards_article;
+DROP INDEX IF EXISTS cards_marketplace_status;
+DROP INDEX IF EXISTS cards_status;
+CREATE TABLE cards_new (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+INSERT INTO cards_new (rowid, id, data) SELECT rowid, id, data FROM cards;
+DROP TABLE cards;
+ALTER TABLE cards_new RENAME TO cards;
+"""
+
+
+def _row(card: MarketplaceCard) -> tuple:
+    return (card.id, json.dumps(card.model_dump(mode='json'), ensure_ascii=False))
+
+
+class CardDatabase:
+    """Cards persisted row by row, so a mutation writes only the cards it touches."""
+
+    def __init__(self, path: Path = CARDS_DB_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(cards)")]
+        if 'article' in columns:
+            self._conn.executescript(f"BEGIN;\n{_DROP_FILTER_COLUMNS}COMMIT;")
+        self._conn.commit()
+
+    def load_all(self) -> Dict[str, MarketplaceCard]:
+        """All cards in insertion order."""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM cards ORDER BY rowid").fetchall()
+        cards = {}
+        for (data,) in rows:
+            card = MarketplaceCard(**json.loads(data))
+            cards[card.id] = card
+        return cards
+
+    def write(self, upserted: Iterable[MarketplaceCard] = (), deleted: Iterable[str] = ()):
+        """Insert or replace and delete cards in one transaction."""
+        with self._lock, self._conn:
+            # UPSERT сохраняет rowid, поэтому порядок карточек не меняется при обновлении
+            self._conn.executemany(
+                "INSERT INTO cards (id, data) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                [_row(card) for card in upserted]
+            )
+            self._conn.executemany("DELETE FROM cards WHERE id = ?", [(card_id,) for card_id in deleted])
+
+    def insert_missing(self, cards: Iterable[MarketplaceCard]):
+        """Insert cards whose id is not in the database yet (existing rows are kept)."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO cards (id, data) VALUES (?, ?) ON CONFLICT(id) DO NOTHING",
+                [_row(card) for card in cards]
+            )
@@ -2,8 +2,6 @@
 Parser for WB/Ozon category Excel templates
 Extracts characteristics from Excel files and Google Sheets
 """
-import zipfile
-import xml.etree.ElementTree as ET
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 import re
@@ -12,6 +10,8 @@ import os
 import tempfile
 import httpx
 
+from backend.app.xlsx_reader import iter_sheet_rows
+
 class CategoryCharacteristic(BaseModel):
     id: str
     name: str
@@ -40,64 +40,23 @@ def parse_excel_template(file_path: str) -> Dict[str, Any]:
     headers = {}
     descriptions = {}
     
-    with zipfile.ZipFile(file_path, 'r') as z:
-        # Read shared strings
-        shared_strings = []
-        try:
-            with z.open('xl/sharedStrings.xml') as f:
-                tree = ET.parse(f)
-                root = tree.getroot()
-                ns = {'ns': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
-                for si in root.findall('.//ns:si', ns):
-                    text = ''.join(t.text or '' for t in si.findall('.//ns:t', ns))
-                    shared_strings.append(text)
-        except:
-            pass
-        
-        # Read first sheet
-        with z.open('xl/worksheets/sheet1.xml') as f:
-            tree = ET.parse(f)
-            root = tree.getroot()
-            ns = {'ns': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+    # Нужны только первые строки - остальной лист не читаем
+    for row_num, row_data in iter_sheet_rows(file_path, max_row=5):
+        for col_letter, value in row_data.items():
+            if not value:
+                continue
+            
+            # Row 1: Group names
+            if row_num == 1:
+                groups[col_letter] = value.strip()
             
-            rows = root.findall('.//ns:row', ns)[:5]  # First 5 rows
+            # Row 3: Field names (headers)
+            elif row_num == 3:
+                headers[col_letter] = value.strip()
             
-            for row in rows:
-                row_num = int(row.get('r', 0))
-                
-                for cell in row.findall('ns:c', ns):
-                    cell_ref = cell.get('r', '')
-                    cell_type = cell.get('t')
-                    value_elem = cell.find('ns:v', ns)
-                    value = value_elem.text if value_elem is not None else ''
-                    
-                    # Get column letter
-                    col = re.match(r'([A-Z]+)', cell_ref)
-                    if not col:
-                        continue
-                    col_letter = col.group(1)
-                    
-                    # If shared string, get actual value
-                    if cell_type == 's' and value:
-                        try:
-                            value = shared_strings[int(value)]
-                        except:
-                            pass
-                    
-                    if not value:
-                        continue
-                    
-                    # Row 1: Group names
-                    if row_num == 1:
-                        groups[col_letter] = value.strip()
-                    
-                    # Row 3: Field names (headers)
-                    elif row_num == 3:
-                        headers[col_letter] = value.strip()
-                    
-                    # Row 4: Descriptions
-                    elif row_num == 4:
-                        descriptions[col_letter] = value.strip()
+            # Row 4: Descriptions
+            elif row_num == 4:
+                descriptions[col_letter] = value.strip()
     
     # Build characteristics list
     current_group = "Основная информация"
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Paths
@@ -8,12 +9,73 @@ PRINTS_DIR = UPLOADS_DIR / "prints"
 OUTPUT_DIR = BASE_DIR / "output"
 EDITOR_OUTPUT_DIR = OUTPUT_DIR / "editor"
 THUMBNAILS_DIR = UPLOADS_DIR / "thumbnails"
+COLOR_INDEX_DIR = UPLOADS_DIR / "color_index"
+PREVIEW_CACHE_DIR = UPLOADS_DIR / "preview_cache"
+TEMPLATE_PYRAMID_DIR = UPLOADS_DIR / "template_pyramid"
+DECODED_STORE_DIR = UPLOADS_DIR / "decoded"
+MEDIA_STORE_DIR = UPLOADS_DIR / "media"
 
 # Create directories
-for d in [UPLOADS_DIR, TEMPLATES_DIR, PRINTS_DIR, OUTPUT_DIR, EDITOR_OUTPUT_DIR, THUMBNAILS_DIR]:
+for d in [UPLOADS_DIR, TEMPLATES_DIR, PRINTS_DIR, OUTPUT_DIR, EDITOR_OUTPUT_DIR, THUMBNAILS_DIR, COLOR_INDEX_DIR, PREVIEW_CACHE_DIR, TEMPLATE_PYRAMID_DIR]:
     d.mkdir(parents=True, exist_ok=True)
 
 # Image settings
 THUMBNAIL_SIZE = (300, 300)
 PREVIEW_MAX_SIZE = 800
+# Размер быстрого превью (quality=draft): шаблон, слои PSD и точки уменьшаются до него перед рендером
+PREVIEW_DRAFT_MAX_SIZE = 600
+# Лимит дискового кэша превью (JPEG), старые записи вытесняются
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024
 SUPPORTED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.psd', '.webp'}
+# Уровни пирамиды шаблона (доли оригинала); плюс полный размер и миниатюра
+TEMPLATE_PYRAMID_SCALES = (0.5, 0.25)
+
+# PSD processing
+# Склеивать подряд идущие не-фото слои PSD в одну плоскость перед перекрашиванием
+# (одно перекрашивание на плоскость вместо слоя; цвет может немного отличаться)
+PSD_FLATTEN_LAYERS = False
+# Движок перекрашивания PSD: 'float' (эталонный) или 'lut' (быстрее, отличие <= 1 уровня)
+PSD_RECOLOR_ENGINE = 'lut'
+
+# Color analysis
+# Движок доминантного цвета: 'histogram' (3D гистограмма, без sklearn) или 'kmeans' (эталонный)
+COLOR_ANALYZER_ENGINE = 'histogram'
+# Потоки декодирования при пакетном анализе цветов папки
+COLOR_INDEX_DECODE_WORKERS = min(8, os.cpu_count() or 1)
+
+# Batch generation
+# Количество процессов пула генерации (каждый держит свой кэш шаблонов)
+GENERATION_WORKERS = os.cpu_count() or 1
+# Сколько заданий держать в очереди на воркер (ограничивает память и ускоряет остановку)
+GENERATION_MAX_IN_FLIGHT_PER_WORKER = 2
+# Хранилище декодированных принтов и шаблонов (.npy + memmap): декодирование один раз на файл,
+# воркеры пула читают пиксели без копирования. Лимит проверяется при каждой записи
+# (старые массивы удаляются до 90% лимита), в том числе для превью и редактора
+DECODED_STORE_ENABLED = True
+DECODED_STORE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+# Product import
+# Одновременных загрузок фото на весь импорт (один общий HTTP-клиент с пулом соединений)
+IMPORT_DOWNLOAD_CONCURRENCY = 20
+# На сколько строк разбор файла может опережать создание карточек (пока качаются их фото)
+IMPORT_PIPELINE_WINDOW = 100
+# Карточки сохраняются в хранилище пачками такого размера
+IMPORT_STORAGE_BATCH_SIZE = 200
+# Фото скачиваются потоком во временный файл; ответы больше лимита или не-картинки прерываются
+MEDIA_MAX_DOWNLOAD_BYTES = 50 * 1024 * 1024
+MEDIA_DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Marketplace cards
+# Хранилище карточек: 'sqlite' (строка на карточку, индексы по артикулу/маркетплейсу/статусу;
+# marketplace_cards.json переносится при первом запуске) или 'json' (весь файл переписывается при каждом изменении)
+CARDS_STORAGE_BACKEND = 'sqlite'
+
+# Storage persistence (templates, folders, presets, cards, settings)
+# Отложенная запись: изменения помечают хранилище "грязным", фоновый поток сохраняет их
+# одной атомарной записью раз в STORAGE_FLUSH_INTERVAL_MS или после STORAGE_FLUSH_MAX_MUTATIONS изменений.
+# False - синхронная запись на каждое изменение, как раньше
+STORAGE_WRITE_BEHIND = True
+STORAGE_FLUSH_INTERVAL_MS = 200
+STORAGE_FLUSH_MAX_MUTATIONS = 500
+# Неудачная запись повторяется с удвоением паузы (от STORAGE_FLUSH_INTERVAL_MS) до этого предела
+STORAGE_FLUSH_RETRY_MAX_MS = 10000
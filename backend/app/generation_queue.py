@@ -0,0 +1,220 @@
+"""Durable SQLite queue of generation jobs and their (folder, print, template) units."""
+import sys
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from backend.app.models import GenerationStatus
+from backend.app.config import BASE_DIR
+
+QUEUE_FILE = BASE_DIR / "generation_queue.db"
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'
+
+# Unit states
+UNIT_PENDING = 'pending'
+UNIT_DONE = 'done'
+UNIT_ERROR = 'error'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    total INTEGER NOT NULL,
+    errors TEXT NOT NULL DEFAULT '[]',
+    force INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    label TEXT NOT NULL,
+    print_path TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    template TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS units_job_status ON units(job_id, status);
+"""
+
+
+class GenerationQueue:
+    """Generation jobs persisted in SQLite so interrupted runs can resume."""
+
+    def __init__(self, path: Path = QUEUE_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+        # Очередь, созданная до появления флага force
+        columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if 'force' not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN force INTEGER NOT NULL DEFAULT 0")
+        self._conn.commit()
+
+    def add_job(self, job_id: str, units: List[dict], errors: Optional[List[dict]] = None, force: bool = False):
+        """Record a job with all of its units as pending."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, created_at, total, errors, force) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, time.time(), len(units), json.dumps(errors or []), int(force))
+            )
+            self._conn.executemany(
+                "INSERT INTO units (job_id, label, print_path, output_path, template, status) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, u['label'], u['print_path'], u['output_path'],
+                  json.dumps(u['template']), UNIT_PENDING) for u in units]
+            )
+
+    def next_job(self) -> Optional[str]:
+        """Oldest unfinished job: interrupted (running) jobs first, then queued."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) "
+                "ORDER BY status = ? DESC, created_at LIMIT 1",
+                (JOB_RUNNING, JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()
+        return row['id'] if row else None
+
+    def iter_pending_units(self, job_id: str) -> Iterator[dict]:
+        """Yield pending units of a job in insertion order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, label, print_path, output_path, template FROM units "
+                "WHERE job_id = ? AND status = ? ORDER BY id",
+                (job_id, UNIT_PENDING)
+            ).fetchall()
+        for row in rows:
+            yield {
+                "id": row['id'],
+                "label": row['label'],
+                "print_path": row['print_path'],
+                "output_path": row['output_path'],
+                "template": json.loads(row['template'])
+            }
+
+    def finish_unit(self, unit_id: int, error: Optional[str] = None):
+        """Mark a unit as done or failed."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE units SET status = ?, error = ? WHERE id = ?",
+                (UNIT_ERROR if error is not None else UNIT_DONE, error, unit_id)
+            )
+
+    def is_forced(self, job_id: str) -> bool:
+        """True if the job re-renders cards regardless of the build manifest."""
+        with self._lock:
+            row = self._conn.execute("SELECT force FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row['force'])
+
+    def finish_units(self, unit_ids: List[int]):
+        """Mark several units as done in one transaction (e.g. cards found up to date)."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE units SET status = ?, error = NULL WHERE id = ?",
+                [(UNIT_DONE, unit_id) for unit_id in unit_ids]
+            )
+
+    def start_job(self, job_id: str) -> bool:
+        """Mark a queued (or interrupted running) job as running; False if it was cancelled meanwhile."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE id = ? AND status IN (?, ?)",
+                (JOB_RUNNING, job_id, JOB_QUEUED, JOB_RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    def cancel_queued_job(self, job_id: str) -> bool:
+        """Cancel a job that has not started; False if it is no longer queued."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE id = ? AND status = ?",
+                (JOB_CANCELLED, job_id, JOB_QUEUED)
+            )
+        return cursor.rowcount > 0
+
+    def set_job_status(self, job_id: str, status: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+
+    def add_job_error(self, job_id: str, error: dict):
+        """Attach a job-level error (not tied to a unit)."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT errors FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None:
+                errors = json.loads(row['errors']) + [error]
+                self._conn.execute("UPDATE jobs SET errors = ? WHERE id = ?", (json.dumps(errors), job_id))
+
+    def get_job_state(self, job_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row['status'] if row else None
+
+    def latest_job(self) -> Optional[str]:
+        """Running job if any, otherwise the most recently created one."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs ORDER BY status = ? DESC, created_at DESC LIMIT 1",
+                (JOB_RUNNING,)
+            ).fetchone()
+        return row['id'] if row else None
+
+    def get_status(self, job_id: str) -> Optional[GenerationStatus]:
+        """Job progress in the /api/generate/status shape."""
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT status, total, errors FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts: Dict[str, int] = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM units WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            unit_errors = self._conn.execute(
+                "SELECT label, error FROM units WHERE job_id = ? AND status = ? ORDER BY id",
+                (job_id, UNIT_ERROR)
+            ).fetchall()
+
+        errors = json.loads(job['errors']) + [{"file": r['label'], "error": r['error']} for r in unit_errors]
+        return GenerationStatus(
+            is_running=job['status'] in (JOB_QUEUED, JOB_RUNNING),
+            current=counts.get(UNIT_DONE, 0) + counts.get(UNIT_ERROR, 0),
+            total=job['total'],
+            errors=errors,
+            task_id=job_id
+        )
+
+    def list_statuses(self) -> List[GenerationStatus]:
+        with self._lock:
+            job_ids = [r['id'] for r in self._conn.execute(
+                "SELECT id FROM jobs ORDER BY created_at"
+            ).fetchall()]
+        return [s for s in (self.get_status(job_id) for job_id in job_ids) if s is not None]
+
+    def has_unfinished_jobs(self) -> bool:
+        return self.next_job() is not None
+
+    def delete_finished(self):
+        """Drop completed, cancelled and failed jobs together with their units."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?)", (JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED)
+            )
+
+
+generation_queue = GenerationQueue()
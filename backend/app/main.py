@@ -28,7 +28,9 @@ from fastapi.responses import FileResponse
 from backend.app.routers import templates_router, folders_router, generate_router, inpaint_router, save_image_router, cards_router, marketplace_router
 from backend.app.routers.categories import router as categories_router
 from backend.app.routers.import_products import router as import_router
+from backend.app.routers.generate import ensure_dispatcher
 from backend.app.config import OUTPUT_DIR, UPLOADS_DIR, SUPPORTED_EXTENSIONS
+from backend.app.storage import storage
 
 app = FastAPI(
     title="Card Generator API",
@@ -65,6 +67,18 @@ app.include_router(categories_router)
 app.include_router(import_router)
 
 
+@app.on_event("startup")
+async def resume_generation():
+    """Resume generation jobs interrupted by a restart."""
+    ensure_dispatcher()
+
+
+@app.on_event("shutdown")
+async def flush_storage():
+    """Write pending storage changes before exit."""
+    storage.flush()
+
+
 @app.get("/")
 async def root():
     logger.info("Root endpoint called")
@@ -64,6 +64,7 @@ class PrintFolder(BaseModel):
 class GenerationRequest(BaseModel):
     template_ids: List[str]
     folder_ids: List[str]
+    force: bool = False  # Re-render cards even if the build manifest says they are up to date
 
 
 class GenerationStatus(BaseModel):
@@ -24,14 +24,7 @@ async def get_cards(
     status: Optional[str] = None
 ):
     """Get all marketplace cards with optional filtering."""
-    cards = storage.get_all_cards()
-    
-    if marketplace:
-        cards = [c for c in cards if c.marketplace == marketplace]
-    if status:
-        cards = [c for c in cards if c.status == status]
-    
-    return cards
+    return storage.find_cards(marketplace=marketplace, status=status)
 
 
 async def generate_ndjson_stream(
@@ -82,7 +75,7 @@ async def get_cards_stream(
     This enables chunked loading on the frontend for faster initial display.
     Requirements: 1.2, 1.4
     """
-    cards = storage.get_all_cards()
+    cards = storage.find_cards(marketplace=marketplace, status=status)
     
     return StreamingResponse(
         generate_ndjson_stream(cards, marketplace, status),
@@ -174,7 +167,7 @@ async def delete_card(card_id: str):
 
 
 @router.post("/batch-delete")
-async def batch_delete_cards(ids: List[str]):
+def batch_delete_cards(ids: List[str]):
     """Delete multiple cards at once.
     
     More efficient than multiple individual DELETE requests.
@@ -183,13 +176,15 @@ async def batch_delete_cards(ids: List[str]):
     deleted = 0
     not_found = []
     
-    for card_id in ids:
-        card = storage.get_card(card_id)
-        if card:
-            storage.delete_card(card_id)
-            deleted += 1
-        else:
-            not_found.append(card_id)
+    # All deletions are saved with a single write
+    with storage.batch():
+        for card_id in ids:
+            card = storage.get_card(card_id)
+            if card:
+                storage.delete_card(card_id)
+                deleted += 1
+            else:
+                not_found.append(card_id)
     
     return {
         "status": "ok",
@@ -6,12 +6,13 @@ from typing import List
 # Add project root to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
 
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, BackgroundTasks
 from fastapi.responses import FileResponse
 
 from backend.app.models import PrintFolder
 from backend.app.storage import storage
 from backend.app.config import SUPPORTED_EXTENSIONS
+from backend.app.services import image_service
 
 router = APIRouter(prefix="/api/folders", tags=["folders"])
 
@@ -40,7 +41,7 @@ async def get_folders():
 
 
 @router.post("", response_model=PrintFolder)
-async def add_folder(path: str = Body(..., embed=True)):
+async def add_folder(background_tasks: BackgroundTasks, path: str = Body(..., embed=True)):
     """Add a print folder by path."""
     folder_path = Path(path)
     
@@ -62,6 +63,9 @@ async def add_folder(path: str = Body(..., embed=True)):
         file_count=count_images(folder_path)
     )
     
+    # Dominant colors of all prints are indexed in the background
+    background_tasks.add_task(image_service.analyze_folder_colors, Path(folder.path))
+    
     return storage.add_folder(folder)
 
 
@@ -82,6 +86,17 @@ async def delete_folder(folder_id: str):
     return {"status": "deleted"}
 
 
+@router.post("/{folder_id}/analyze-colors")
+def analyze_folder_colors(folder_id: str):
+    """Index dominant colors of all prints in the folder."""
+    folder = storage.get_folder(folder_id)
+    if not folder:
+        raise HTTPException(404, "Folder not found")
+    
+    analyzed = image_service.analyze_folder_colors(Path(folder.path))
+    return {"status": "ok", "analyzed": analyzed}
+
+
 @router.get("/{folder_id}/files")
 async def get_folder_files(folder_id: str):
     """Get list of image files in folder."""
@@ -153,7 +168,7 @@ async def browse_folder():
 
 
 @router.post("/add-multiple")
-async def add_multiple_folders(paths: List[str] = Body(...)):
+async def add_multiple_folders(background_tasks: BackgroundTasks, paths: List[str] = Body(...)):
     """Add multiple folders at once.
     
     Returns added folders and skipped folders with reasons.
@@ -192,6 +207,7 @@ async def add_multiple_folders(paths: List[str] = Body(...)):
             )
             storage.add_folder(folder)
             added.append(folder)
+            background_tasks.add_task(image_service.analyze_folder_colors, Path(folder.path))
     
     return {
         "added": added,
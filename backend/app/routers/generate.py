@@ -1,27 +1,37 @@
 import sys
+import json
 import uuid
+import logging
+import threading
 from pathlib import Path
-from typing import List
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Set
 
 # Add project root to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException
 
 from backend.app.models import GenerationRequest, GenerationStatus
 from backend.app.storage import storage
 from backend.app.config import OUTPUT_DIR, SUPPORTED_EXTENSIONS
+from backend.app.generation_queue import (
+    generation_queue, JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED
+)
+from backend.app.build_manifest import get_manifest
+from backend.app.services.generation_pool import GenerationPool
 from backend.app.services import image_service
 
 router = APIRouter(prefix="/api/generate", tags=["generate"])
+logger = logging.getLogger(__name__)
 
-# Thread pool for parallel processing - use more workers for I/O bound tasks
-executor = ThreadPoolExecutor(max_workers=6)
+# Dispatcher thread running queued jobs one after another on the process pool
+_dispatcher: Optional[threading.Thread] = None
+_dispatcher_lock = threading.Lock()
+# Jobs cancelled while running (checked between pool submissions)
+_cancelled_jobs: Set[str] = set()
 
-# Active generation task
-_current_task_id: str = None
-_cancel_flag: bool = False
+# Build manifest is written every N rendered cards (and at the end of a job)
+MANIFEST_SAVE_INTERVAL = 100
 
 
 def get_image_files(folder_path: Path) -> List[Path]:
@@ -33,155 +43,233 @@ def get_image_files(folder_path: Path) -> List[Path]:
                   key=lambda p: p.name.lower())
 
 
-def process_generation(task_id: str, template_ids: List[str], folder_ids: List[str]):
-    """Background task for generation."""
-    global _cancel_flag
-    
-    templates = [storage.get_template(tid) for tid in template_ids]
-    templates = [t for t in templates if t]
+def _template_job_data(template) -> dict:
+    """Picklable template settings for pool workers."""
+    # Handle both Point objects and dicts
+    points = [(p.x, p.y) if hasattr(p, 'x') else (p['x'], p['y']) for p in template.points]
+    return {
+        "path": template.path,
+        "points": points,
+        "corner_radius": template.corner_radius,
+        "blend_strength": template.blend_strength,
+        "change_background_color": template.change_background_color,
+        "add_product": template.add_product
+    }
+
+
+def build_units(folders, templates, force: bool = False) -> List[dict]:
+    """(print, template) units in folder / print / template order.
     
-    folders = [storage.get_folder(fid) for fid in folder_ids]
-    folders = [f for f in folders if f]
+    Unless force is set, units whose card is up to date according to the
+    build manifest of the output folder are skipped.
+    """
+    template_data = [_template_job_data(t) for t in templates]
+    manifests = {}
+    units = []
+    for folder in folders:
+        output_folder = OUTPUT_DIR / folder.name
+        
+        for print_file in get_image_files(Path(folder.path)):
+            for t_idx, template in enumerate(template_data):
+                # Output filename
+                if len(template_data) > 1:
+                    out_name = f"{print_file.stem}_{t_idx + 1}.png"
+                else:
+                    out_name = f"{print_file.stem}.png"
+                
+                unit = {
+                    "label": f"{folder.name}/{print_file.name}",
+                    "print_path": str(print_file),
+                    "output_path": str(output_folder / out_name),
+                    "template": template
+                }
+                if force or not get_manifest(manifests, output_folder / out_name).is_fresh(unit):
+                    units.append(unit)
     
-    if not templates or not folders:
-        storage.generation_status = GenerationStatus(
-            is_running=False,
-            errors=[{"file": "config", "error": "No templates or folders"}]
-        )
+    # Сохраняем обновлённые сигнатуры (файлы с новым mtime, но прежним содержимым)
+    for manifest in manifests.values():
+        manifest.save()
+    return units
+
+
+def process_generation(task_id: str):
+    """Run pending units of a queued job (also resumes an interrupted one)."""
+    # Проверка и смена статуса одним UPDATE - отмена из /stop не может потеряться
+    if not generation_queue.start_job(task_id):
         return
     
-    # Count total
-    total = 0
-    for folder in folders:
-        files = get_image_files(Path(folder.path))
-        total += len(files) * len(templates)
+    manifests = {}
+    units = list(generation_queue.iter_pending_units(task_id))
+    if not generation_queue.is_forced(task_id):
+        # Задание могло ждать в очереди за другим по тем же папкам - карточки,
+        # собранные тем заданием, уже свежие и повторно не рендерятся
+        fresh_ids = {u['id'] for u in units if get_manifest(manifests, Path(u['output_path'])).is_fresh(u)}
+        generation_queue.finish_units(list(fresh_ids))
+        units = [u for u in units if u['id'] not in fresh_ids]
     
-    storage.generation_status = GenerationStatus(
-        is_running=True,
-        current=0,
-        total=total,
-        task_id=task_id
-    )
+    for output_folder in {Path(u['output_path']).parent for u in units}:
+        output_folder.mkdir(parents=True, exist_ok=True)
     
-    current = 0
-    errors = []
+    # Distinct templates of the job - to warm pool workers
+    templates = list({json.dumps(u['template'], sort_keys=True): u['template'] for u in units}.values())
     
-    for folder in folders:
-        if _cancel_flag:
-            break
-            
-        folder_path = Path(folder.path)
-        output_folder = OUTPUT_DIR / folder.name
-        output_folder.mkdir(parents=True, exist_ok=True)
-        
-        files = get_image_files(folder_path)
-        
-        for print_file in files:
-            if _cancel_flag:
-                break
-                
-            for t_idx, template in enumerate(templates):
-                if _cancel_flag:
-                    break
-                    
-                try:
-                    # Handle both Point objects and dicts
-                    points = [(p.x, p.y) if hasattr(p, 'x') else (p['x'], p['y']) for p in template.points]
-                    
-                    # Output filename
-                    if len(templates) > 1:
-                        out_name = f"{print_file.stem}_{t_idx + 1}.png"
-                    else:
-                        out_name = f"{print_file.stem}.png"
-                    
-                    output_path = output_folder / out_name
-                    
-                    image_service.generate_card(
-                        Path(template.path),
-                        points,
-                        print_file,
-                        output_path,
-                        template.corner_radius,
-                        template.blend_strength,
-                        template.change_background_color,
-                        template.add_product
-                    )
-                    
-                except Exception as e:
-                    errors.append({
-                        "file": f"{folder.name}/{print_file.name}",
-                        "error": str(e)
-                    })
-                
-                current += 1
-                storage.generation_status = GenerationStatus(
-                    is_running=True,
-                    current=current,
-                    total=total,
-                    errors=errors,
-                    task_id=task_id
-                )
-    
-    storage.generation_status = GenerationStatus(
-        is_running=False,
-        current=current,
-        total=total,
-        errors=errors,
-        task_id=task_id
-    )
-    _cancel_flag = False
+    # Цвета принтов индексируем здесь одним проходом: иначе каждый воркер считал бы
+    # и сохранял их сам, по одному принту
+    color_folders = {Path(u['print_path']).parent for u in units if u['template']['change_background_color']}
+    for folder in sorted(color_folders):
+        try:
+            image_service.analyze_folder_colors(folder)
+        except Exception as e:
+            generation_queue.add_job_error(task_id, {"file": str(folder), "error": f"color index: {e}"})
+    
+    rendered = 0
+    
+    def on_result(unit: dict, result: dict):
+        nonlocal rendered
+        generation_queue.finish_unit(unit['id'], result["error"])
+        if result["error"] is None:
+            get_manifest(manifests, Path(unit['output_path'])).record(unit, result.get("inputs"))
+            rendered += 1
+            if rendered % MANIFEST_SAVE_INTERVAL == 0:
+                for manifest in manifests.values():
+                    manifest.save()
+    
+    try:
+        GenerationPool().run(
+            units,
+            templates,
+            on_result,
+            should_cancel=lambda: task_id in _cancelled_jobs
+        )
+    except Exception as e:
+        generation_queue.add_job_error(task_id, {"file": "pool", "error": str(e)})
+    
+    for manifest in manifests.values():
+        manifest.save()
+    
+    if task_id in _cancelled_jobs:
+        generation_queue.set_job_status(task_id, JOB_CANCELLED)
+    else:
+        generation_queue.set_job_status(task_id, JOB_COMPLETED)
+    # /stop мог прийти после проверки выше - id уже не нужен в любом случае
+    _cancelled_jobs.discard(task_id)
+
+
+def _fail_job(task_id: str, error: Exception):
+    """Record a job-level error and take the job out of the queue."""
+    generation_queue.add_job_error(task_id, {"file": "job", "error": str(error)})
+    generation_queue.set_job_status(task_id, JOB_FAILED)
+    _cancelled_jobs.discard(task_id)
+
+
+def _dispatch_jobs():
+    """Run queued jobs until the queue is empty."""
+    global _dispatcher
+    try:
+        while True:
+            with _dispatcher_lock:
+                task_id = generation_queue.next_job()
+                if task_id is None:
+                    # Сбрасываем под тем же локом: иначе /start между проверкой и сбросом
+                    # увидел бы живой диспетчер, и его задание ждало бы следующего /start
+                    _dispatcher = None
+                    return
+            try:
+                process_generation(task_id)
+            except Exception as e:
+                logger.error(f"Generation job {task_id} failed: {e}")
+                # Если и это не удалось (база недоступна), выходим - иначе тот же job выбирался бы снова
+                _fail_job(task_id, e)
+    except Exception as e:
+        logger.error(f"Generation dispatcher stopped: {e}")
+    finally:
+        # Штатный выход уже сбросил _dispatcher; здесь - только падение потока
+        with _dispatcher_lock:
+            if _dispatcher is threading.current_thread():
+                _dispatcher = None
+
+
+def ensure_dispatcher():
+    """Start the dispatcher thread if there is unfinished work."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None and generation_queue.has_unfinished_jobs():
+            _dispatcher = threading.Thread(target=_dispatch_jobs, name="generation-dispatcher", daemon=True)
+            _dispatcher.start()
 
 
 @router.post("/start")
-async def start_generation(request: GenerationRequest, background_tasks: BackgroundTasks):
-    """Start generation process."""
-    global _current_task_id, _cancel_flag
-    
-    if storage.generation_status.is_running:
-        raise HTTPException(400, "Generation already in progress")
-    
+def start_generation(request: GenerationRequest):
+    """Queue a generation job for cards that are missing or out of date."""
     if not request.template_ids:
         raise HTTPException(400, "No templates selected")
     
     if not request.folder_ids:
         raise HTTPException(400, "No folders selected")
     
-    _cancel_flag = False
-    _current_task_id = str(uuid.uuid4())
+    templates = [storage.get_template(tid) for tid in request.template_ids]
+    templates = [t for t in templates if t]
+    
+    folders = [storage.get_folder(fid) for fid in request.folder_ids]
+    folders = [f for f in folders if f]
     
-    background_tasks.add_task(
-        process_generation,
-        _current_task_id,
-        request.template_ids,
-        request.folder_ids
-    )
+    task_id = str(uuid.uuid4())
+    if not templates or not folders:
+        generation_queue.add_job(task_id, [], errors=[{"file": "config", "error": "No templates or folders"}])
+        generation_queue.set_job_status(task_id, JOB_COMPLETED)
+        return {"status": "started", "task_id": task_id}
     
-    return {"status": "started", "task_id": _current_task_id}
+    generation_queue.add_job(task_id, build_units(folders, templates, request.force), force=request.force)
+    ensure_dispatcher()
+    
+    return {"status": "started", "task_id": task_id}
 
 
 @router.post("/stop")
-async def stop_generation():
-    """Stop current generation."""
-    global _cancel_flag
+async def stop_generation(task_id: Optional[str] = None):
+    """Stop a job (the running one by default)."""
+    task_id = task_id or generation_queue.latest_job()
+    state = generation_queue.get_job_state(task_id) if task_id else None
     
-    if not storage.generation_status.is_running:
+    if state not in (JOB_QUEUED, JOB_RUNNING):
         raise HTTPException(400, "No generation in progress")
     
-    _cancel_flag = True
+    # Not started yet - just drop it from the queue; a running job (or one that
+    # started after the check above) is stopped between pool submissions
+    if not generation_queue.cancel_queued_job(task_id):
+        _cancelled_jobs.add(task_id)
+        # Job finished meanwhile - its final status is written, nobody will discard the id
+        if generation_queue.get_job_state(task_id) not in (JOB_QUEUED, JOB_RUNNING):
+            _cancelled_jobs.discard(task_id)
+    
     return {"status": "stopping"}
 
 
 @router.get("/status", response_model=GenerationStatus)
-async def get_status():
-    """Get current generation status."""
-    return storage.generation_status
+async def get_status(task_id: Optional[str] = None):
+    """Get job status (the running or latest job by default)."""
+    if task_id is None:
+        task_id = generation_queue.latest_job()
+        if task_id is None:
+            return GenerationStatus()
+    
+    status = generation_queue.get_status(task_id)
+    if status is None:
+        raise HTTPException(404, "Job not found")
+    return status
+
+
+@router.get("/jobs", response_model=List[GenerationStatus])
+async def list_jobs():
+    """Get status of all recorded jobs."""
+    return generation_queue.list_statuses()
 
 
 @router.post("/reset")
 async def reset_status():
-    """Reset generation status."""
-    if storage.generation_status.is_running:
+    """Forget finished jobs."""
+    if generation_queue.has_unfinished_jobs():
         raise HTTPException(400, "Cannot reset while running")
     
-    storage.generation_status = GenerationStatus()
+    generation_queue.delete_finished()
     return {"status": "reset"}
@@ -8,8 +8,10 @@ import shutil
 import os
 import re
 import logging
+from collections import deque
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from itertools import islice
+from typing import AsyncIterator, List, Dict, Any, Optional
 from pathlib import Path
 
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
@@ -22,7 +24,11 @@ import httpx
 
 from backend.app.storage import storage
 from backend.app.models import MarketplaceCard, CardStatus, MarketplaceType
-from backend.app.config import UPLOADS_DIR
+from backend.app.services.media_store import media_store
+from backend.app.config import (
+    UPLOADS_DIR, IMPORT_DOWNLOAD_CONCURRENCY, IMPORT_PIPELINE_WINDOW, IMPORT_STORAGE_BATCH_SIZE
+)
+from backend.app.xlsx_reader import iter_sheet_rows, load_shared_strings, column_sort_key
 
 logger = logging.getLogger(__name__)
 
@@ -83,6 +89,7 @@ class ImportRequest(BaseModel):
     update_existing: bool = True
     download_photos: bool = True
     selected_rows: Optional[List[int]] = None  # Row numbers to import (None = all valid)
+    total_rows: Optional[int] = None  # Row count from /preview (progress total without re-reading the file)
 
 
 class ImportResultRow(BaseModel):
@@ -107,75 +114,77 @@ class ImportResponse(BaseModel):
 
 # ==================== Excel Parser ====================
 
-def parse_excel_products(file_path: str) -> Dict[str, Any]:
+# Сколько первых строк листа просматривается при поиске заголовка и строк-подсказок
+HEADER_SCAN_ROWS = 50
+
+
+class ExcelRows:
     """
-    Parse Excel file with WB/Ozon product template structure.
+    Data rows of an import file, read lazily.
     
-    Auto-detects header row by looking for "Артикул" column.
-    Supports various WB/Ozon template formats.
+    Every iteration streams the sheet again (constant memory apart from the
+    shared strings table, which is parsed once and kept); the row count is
+    remembered after the first full pass, so len() is free after a loop.
     """
-    import zipfile
-    import xml.etree.ElementTree as ET
     
-    columns = []
-    rows = []
-    all_row_data = []
+    def __init__(self, file_path: str, data_start_row: int, sorted_cols: List[str],
+                 shared_strings: Optional[List[str]] = None):
+        self.file_path = file_path
+        self.data_start_row = data_start_row
+        self.sorted_cols = sorted_cols
+        self._shared_strings = shared_strings
+        self._count: Optional[int] = None
     
-    with zipfile.ZipFile(file_path, 'r') as z:
-        # Read shared strings
-        shared_strings = []
-        try:
-            with z.open('xl/sharedStrings.xml') as f:
-                tree = ET.parse(f)
-                root = tree.getroot()
-                ns = {'ns': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
-                for si in root.findall('.//ns:si', ns):
-                    text = ''.join(t.text or '' for t in si.findall('.//ns:t', ns))
-                    shared_strings.append(text)
-        except:
-            pass
-        
-        # Read first sheet
-        with z.open('xl/worksheets/sheet1.xml') as f:
-            tree = ET.parse(f)
-            root = tree.getroot()
-            ns = {'ns': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+    def __iter__(self):
+        if self._shared_strings is None:
+            self._shared_strings = load_shared_strings(self.file_path)
+        count = 0
+        for row_num, row_data in iter_sheet_rows(self.file_path, shared_strings=self._shared_strings):
+            if row_num < self.data_start_row:
+                continue
             
-            all_rows = root.findall('.//ns:row', ns)
+            # Skip empty rows (check if any meaningful data)
+            non_empty = sum(1 for v in row_data.values() if v and str(v).strip())
+            if non_empty < 2:  # Need at least 2 non-empty cells
+                continue
             
-            # Parse all rows first
-            for row in all_rows:
-                row_num = int(row.get('r', 0))
-                row_data = {}
-                
-                for cell in row.findall('ns:c', ns):
-                    cell_ref = cell.get('r', '')
-                    cell_type = cell.get('t')
-                    value_elem = cell.find('ns:v', ns)
-                    value = value_elem.text if value_elem is not None else ''
-                    
-                    # Get column letter
-                    col_match = re.match(r'([A-Z]+)', cell_ref)
-                    if not col_match:
-                        continue
-                    col_letter = col_match.group(1)
-                    
-                    # If shared string, get actual value
-                    if cell_type == 's' and value:
-                        try:
-                            value = shared_strings[int(value)]
-                        except:
-                            pass
-                    
-                    row_data[col_letter] = value
-                
-                all_row_data.append({'row_num': row_num, 'data': row_data})
+            count += 1
+            yield {
+                'row_number': row_num,
+                'values': [row_data.get(col, '') for col in self.sorted_cols],
+                'raw': row_data
+            }
+        self._count = count
+    
+    def __len__(self) -> int:
+        if self._count is None:
+            for _ in self:
+                pass
+        return self._count
+
+
+def parse_excel_products(file_path: str) -> Dict[str, Any]:
+    """
+    Parse Excel file with WB/Ozon product template structure.
+    
+    Auto-detects header row by looking for "Артикул" column.
+    Supports various WB/Ozon template formats.
+    
+    Only the first HEADER_SCAN_ROWS rows are read here (header and hint
+    detection); 'rows' is an ExcelRows that streams the data rows on iteration.
+    """
+    # Таблица строк разбирается один раз - для заголовка и для всех проходов по данным
+    shared_strings = load_shared_strings(file_path)
+    head = [
+        {'row_num': row_num, 'data': row_data}
+        for row_num, row_data in islice(iter_sheet_rows(file_path, shared_strings=shared_strings), HEADER_SCAN_ROWS)
+    ]
     
     # Auto-detect header row (look for "Артикул" in any cell)
     header_row_idx = None
     header_keywords = ['артикул продавца', 'артикул', 'наименование', 'название товара']
     
-    for idx, row_info in enumerate(all_row_data):
+    for idx, row_info in enumerate(head):
         row_data = row_info['data']
         values_lower = [str(v).lower().strip() for v in row_data.values()]
         
@@ -188,21 +197,21 @@ def parse_excel_products(file_path: str) -> Dict[str, Any]:
     if header_row_idx is None:
         # Fallback: try row 2 or row 3 (0-indexed: 1 or 2)
         for try_idx in [1, 2, 0]:
-            if try_idx < len(all_row_data):
+            if try_idx < len(head):
                 header_row_idx = try_idx
                 break
     
-    if header_row_idx is None or header_row_idx >= len(all_row_data):
+    if header_row_idx is None or header_row_idx >= len(head):
         return {'columns': [], 'rows': []}
     
     # Extract columns from header row
-    header_data = all_row_data[header_row_idx]['data']
+    header_data = head[header_row_idx]['data']
     
-    # Get all column letters used in the file
+    # Column letters used in the scanned rows (columns without a header can't be mapped anyway)
     all_cols = set()
-    for row_info in all_row_data:
+    for row_info in head:
         all_cols.update(row_info['data'].keys())
-    sorted_cols = sorted(all_cols, key=lambda x: (len(x), x))
+    sorted_cols = sorted(all_cols, key=column_sort_key)
     
     columns = [header_data.get(col, '') for col in sorted_cols]
     
@@ -211,8 +220,8 @@ def parse_excel_products(file_path: str) -> Dict[str, Any]:
     data_start_idx = header_row_idx + 1
     
     # Skip hint rows (usually 1-2 rows after header with long descriptions)
-    while data_start_idx < len(all_row_data):
-        row_data = all_row_data[data_start_idx]['data']
+    while data_start_idx < len(head):
+        row_data = head[data_start_idx]['data']
         # Check if this looks like a hint row (very long text in cells)
         values = list(row_data.values())
         if values:
@@ -222,26 +231,14 @@ def parse_excel_products(file_path: str) -> Dict[str, Any]:
                 continue
         break
     
-    # Extract data rows
-    for row_info in all_row_data[data_start_idx:]:
-        row_num = row_info['row_num']
-        row_data = row_info['data']
-        
-        # Skip empty rows (check if any meaningful data)
-        non_empty = sum(1 for v in row_data.values() if v and str(v).strip())
-        if non_empty < 2:  # Need at least 2 non-empty cells
-            continue
-        
-        row_values = [row_data.get(col, '') for col in sorted_cols]
-        rows.append({
-            'row_number': row_num,
-            'values': row_values,
-            'raw': row_data
-        })
+    if data_start_idx < len(head):
+        data_start_row = head[data_start_idx]['row_num']
+    else:
+        data_start_row = head[-1]['row_num'] + 1
     
     return {
         'columns': columns,
-        'rows': rows
+        'rows': ExcelRows(file_path, data_start_row, sorted_cols, shared_strings)
     }
 
 
@@ -326,53 +323,19 @@ def parse_price(price_str: str) -> float:
 
 # ==================== Photo Downloader ====================
 
-async def download_photo(url: str, save_dir: Path, client: Optional[httpx.AsyncClient] = None) -> Optional[str]:
-    """Download photo from URL and save to local directory"""
+async def download_photo(url: str, client: Optional[httpx.AsyncClient] = None) -> Optional[str]:
+    """Download photo from URL into the media store (reused if already stored)"""
     try:
         should_close = client is None
         if client is None:
             client = httpx.AsyncClient(follow_redirects=True, timeout=15.0)
         
         try:
-            response = await client.get(url)
-            
-            if response.status_code != 200:
-                logger.warning(f"Failed to download photo: {url}, status: {response.status_code}")
+            path = await media_store.fetch(url, client)
+            if path is None:
+                logger.warning(f"Failed to download photo: {url}")
                 return None
-            
-            # Determine filename from URL or content-disposition
-            filename = None
-            
-            # Try content-disposition header
-            cd = response.headers.get('content-disposition')
-            if cd:
-                match = re.search(r'filename="?([^";\n]+)"?', cd)
-                if match:
-                    filename = match.group(1)
-            
-            # Fallback to URL path
-            if not filename:
-                url_path = url.split('?')[0]
-                filename = url_path.split('/')[-1]
-            
-            # Ensure valid extension
-            if not any(filename.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp']):
-                # Try to detect from content-type
-                content_type = response.headers.get('content-type', '')
-                if 'jpeg' in content_type or 'jpg' in content_type:
-                    filename = f"{uuid.uuid4()}.jpg"
-                elif 'png' in content_type:
-                    filename = f"{uuid.uuid4()}.png"
-                elif 'webp' in content_type:
-                    filename = f"{uuid.uuid4()}.webp"
-                else:
-                    filename = f"{uuid.uuid4()}.jpg"
-            
-            # Save file
-            save_path = save_dir / filename
-            save_path.write_bytes(response.content)
-            
-            return str(save_path)
+            return str(path)
         finally:
             if should_close:
                 await client.aclose()
@@ -382,29 +345,292 @@ async def download_photo(url: str, save_dir: Path, client: Optional[httpx.AsyncC
         return None
 
 
-async def download_photos_batch(urls: List[str], save_dir: Path, max_concurrent: int = 5) -> List[str]:
-    """Download multiple photos concurrently with limit"""
-    import asyncio
+class PhotoDownloader:
+    """
+    Photo downloads of one import run.
     
-    if not urls:
-        return []
+    All rows share one pooled client (keep-alive connections are reused across
+    rows) and one global limit on concurrent requests. Each URL is fetched once
+    per run, however many rows list it.
+    """
+    
+    def __init__(self, max_concurrent: int = IMPORT_DOWNLOAD_CONCURRENCY):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=15.0,
+            limits=httpx.Limits(max_connections=max_concurrent, max_keepalive_connections=max_concurrent)
+        )
+        self._fetches: Dict[str, asyncio.Task] = {}  # url -> загрузка в этом запуске
     
-    semaphore = asyncio.Semaphore(max_concurrent)
-    results = []
+    async def __aenter__(self) -> "PhotoDownloader":
+        return self
     
-    async def download_with_semaphore(url: str, client: httpx.AsyncClient) -> Optional[str]:
-        async with semaphore:
-            return await download_photo(url, save_dir, client)
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+        media_store.flush()
     
-    async with httpx.AsyncClient(follow_redirects=True, timeout=15.0) as client:
-        tasks = [download_with_semaphore(url, client) for url in urls]
+    async def _download_one(self, url: str) -> Optional[str]:
+        async with self._semaphore:
+            return await download_photo(url, self._client)
+    
+    async def download(self, urls: List[str]) -> List[str]:
+        """Download photos of one row; failed downloads are dropped, order is kept."""
+        tasks = []
+        for url in urls:
+            if url not in self._fetches:
+                self._fetches[url] = asyncio.ensure_future(self._download_one(url))
+            tasks.append(self._fetches[url])
         downloaded = await asyncio.gather(*tasks, return_exceptions=True)
         
+        images = []
         for result in downloaded:
-            if isinstance(result, str):
-                results.append(result)
+            # Разные URL одной картинки дают один файл - в карточку он попадает один раз
+            if isinstance(result, str) and result not in images:
+                images.append(result)
+        return images
+
+
+async def download_photos_batch(urls: List[str], max_concurrent: int = 5) -> List[str]:
+    """Download multiple photos concurrently with limit"""
+    if not urls:
+        return []
     
-    return results
+    async with PhotoDownloader(max_concurrent) as downloader:
+        return await downloader.download(urls)
+
+
+# ==================== Import Pipeline ====================
+
+def _prepare_import_row(row: dict, columns: List[str], mapping: ColumnMapping) -> dict:
+    """Extract and validate card fields of one row (no I/O)."""
+    row_values = row['values']
+    
+    # Extract fields using mapping
+    article = get_cell_value(row_values, columns, mapping.article)
+    name = get_cell_value(row_values, columns, mapping.name)
+    
+    # Validate required fields
+    if not article:
+        return {'row_number': row['row_number'], 'article': "", 'name': name, 'error': "Отсутствует артикул"}
+    if not name:
+        return {'row_number': row['row_number'], 'article': article, 'name': "", 'error': "Отсутствует наименование"}
+    
+    length_str = get_cell_value(row_values, columns, mapping.length)
+    width_str = get_cell_value(row_values, columns, mapping.width)
+    height_str = get_cell_value(row_values, columns, mapping.height)
+    weight_str = get_cell_value(row_values, columns, mapping.weight)
+    
+    return {
+        'row_number': row['row_number'],
+        'article': article,
+        'name': name,
+        'brand': get_cell_value(row_values, columns, mapping.brand),
+        'description': get_cell_value(row_values, columns, mapping.description),
+        'barcode': get_cell_value(row_values, columns, mapping.barcode),
+        'price': parse_price(get_cell_value(row_values, columns, mapping.price)),
+        'old_price': parse_price(get_cell_value(row_values, columns, mapping.old_price)),
+        'photos_urls': parse_photos(get_cell_value(row_values, columns, mapping.photos)),
+        # Parse dimensions
+        'length': int(float(length_str)) if length_str else 0,
+        'width': int(float(width_str)) if width_str else 0,
+        'height': int(float(height_str)) if height_str else 0,
+        'weight': int(float(weight_str)) if weight_str else 0,
+    }
+
+
+class _CardWriter:
+    """Buffers created and updated cards and saves them to storage in batches."""
+    
+    def __init__(self, batch_size: int = IMPORT_STORAGE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._new_cards: List[MarketplaceCard] = []
+        self._updates: List[tuple] = []  # (card_id, updates), в порядке строк
+    
+    def add(self, card: MarketplaceCard):
+        self._new_cards.append(card)
+        self._flush_if_full()
+    
+    def update(self, card_id: str, updates: dict):
+        self._updates.append((card_id, updates))
+        self._flush_if_full()
+    
+    def _flush_if_full(self):
+        if len(self._new_cards) + len(self._updates) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        # Новые и обновленные карточки пачки сохраняются одной записью
+        with storage.batch():
+            if self._new_cards:
+                storage.add_cards(self._new_cards)
+                self._new_cards = []
+            if self._updates:
+                storage.update_cards(self._updates)
+                self._updates = []
+
+
+def _finish_import_row(
+    prepared: dict,
+    images: List[str],
+    request: ImportRequest,
+    existing_by_article: Dict[str, MarketplaceCard],
+    writer: _CardWriter
+) -> ImportResultRow:
+    """Create or update the card of a prepared row (rows are finished in file order)."""
+    row_num = prepared['row_number']
+    article = prepared['article']
+    name = prepared['name']
+    
+    if 'error' in prepared:
+        return ImportResultRow(row_number=row_num, article=article, name=name, status="error", message=prepared['error'])
+    
+    price = prepared['price']
+    old_price = prepared['old_price']
+    length, width, height, weight = prepared['length'], prepared['width'], prepared['height'], prepared['weight']
+    
+    # Check if exists
+    existing = existing_by_article.get(article.lower())
+    
+    if existing:
+        if not request.update_existing:
+            return ImportResultRow(
+                row_number=row_num, article=article, name=name,
+                status="skipped", message="Товар уже существует", card_id=existing.id
+            )
+        
+        # Update existing card
+        update_data = {
+            'name': name, 'description': prepared['description'],
+            'brand': prepared['brand'], 'barcode': prepared['barcode'],
+        }
+        
+        if price > 0:
+            update_data['price'] = price
+        if old_price > 0:
+            update_data['old_price'] = old_price
+        existing_images = existing.images or []
+        new_images = [image for image in images if image not in existing_images]
+        if new_images:
+            # Append new images to existing (re-imported photos resolve to the same stored file)
+            update_data['images'] = existing_images + new_images
+        if length or width or height:
+            update_data['dimensions'] = {
+                'length': length or (existing.dimensions.length if existing.dimensions else 0),
+                'width': width or (existing.dimensions.width if existing.dimensions else 0),
+                'height': height or (existing.dimensions.height if existing.dimensions else 0),
+                'weight': weight or (existing.dimensions.weight if existing.dimensions else 0),
+            }
+        if weight:
+            update_data['weight'] = weight
+        
+        writer.update(existing.id, update_data)
+        
+        return ImportResultRow(
+            row_number=row_num, article=article, name=name,
+            status="updated", message="Товар обновлен", card_id=existing.id
+        )
+    
+    # Create new card
+    now = datetime.utcnow().isoformat()
+    
+    # Determine marketplace type
+    marketplace = MarketplaceType.WILDBERRIES
+    if request.marketplace.lower() == 'ozon':
+        marketplace = MarketplaceType.OZON
+    
+    card = MarketplaceCard(
+        id=str(uuid.uuid4()),
+        marketplace=marketplace,
+        status=CardStatus.DRAFT,
+        name=name,
+        description=prepared['description'],
+        brand=prepared['brand'],
+        article=article,
+        barcode=prepared['barcode'],
+        category_id=request.category_id,
+        category_name=request.category_name,
+        images=images,
+        price=price if price > 0 else 1,  # Default price
+        old_price=old_price if old_price > 0 else None,
+        weight=weight if weight > 0 else None,
+        dimensions={'length': length, 'width': width, 'height': height, 'weight': weight} if any([length, width, height]) else None,
+        created_at=now,
+        updated_at=now,
+    )
+    
+    writer.add(card)
+    existing_by_article[article.lower()] = card  # Add to cache
+    
+    return ImportResultRow(
+        row_number=row_num, article=article, name=name,
+        status="created", message="Товар создан", card_id=card.id
+    )
+
+
+async def run_import(request: ImportRequest, columns: List[str], rows) -> AsyncIterator[ImportResultRow]:
+    """
+    Import rows as a pipeline, yielding one result per selected row in file order.
+    
+    Rows are parsed up to IMPORT_PIPELINE_WINDOW rows ahead of card creation;
+    their photos download meanwhile through one shared PhotoDownloader.
+    Cards are written to storage in batches of IMPORT_STORAGE_BATCH_SIZE.
+    """
+    mapping = request.mapping
+    
+    # Get existing cards by article
+    existing_by_article = {c.article.lower(): c for c in storage.get_all_cards()}
+    
+    # Filter rows by selection if provided
+    selected_set = set(request.selected_rows) if request.selected_rows else None
+    
+    writer = _CardWriter()
+    pending = deque()  # (prepared row, photo download task or None)
+    
+    async def finish_oldest() -> ImportResultRow:
+        prepared, task = pending.popleft()
+        try:
+            images = await task if task is not None else []
+            return _finish_import_row(prepared, images, request, existing_by_article, writer)
+        except Exception as e:
+            logger.error(f"Error importing row {prepared['row_number']}: {e}")
+            return ImportResultRow(
+                row_number=prepared['row_number'], article=prepared.get('article', ""),
+                name=prepared.get('name', ""), status="error", message=str(e)
+            )
+    
+    async with PhotoDownloader() as downloader:
+        try:
+            for row in rows:
+                # Skip if not in selected rows
+                if selected_set is not None and row['row_number'] not in selected_set:
+                    continue
+                
+                try:
+                    prepared = _prepare_import_row(row, columns, mapping)
+                except Exception as e:
+                    logger.error(f"Error importing row {row['row_number']}: {e}")
+                    prepared = {'row_number': row['row_number'], 'article': "", 'name': "", 'error': str(e)}
+                
+                task = None
+                article = prepared['article']
+                # Строки, которые будут пропущены, не скачивают фото
+                will_skip = article.lower() in existing_by_article and not request.update_existing
+                if 'error' not in prepared and request.download_photos and prepared['photos_urls'] and not will_skip:
+                    task = asyncio.ensure_future(downloader.download(prepared['photos_urls']))
+                pending.append((prepared, task))
+                
+                if len(pending) >= IMPORT_PIPELINE_WINDOW:
+                    yield await finish_oldest()
+            
+            while pending:
+                yield await finish_oldest()
+        finally:
+            # Остановленный импорт не должен оставлять загрузки в фоне
+            for _, task in pending:
+                if task is not None:
+                    task.cancel()
+            writer.flush()
 
 
 # ==================== API Endpoints ====================
@@ -643,196 +869,12 @@ async def execute_import(request: ImportRequest):
         columns = data['columns']
         rows = data['rows']
         
-        mapping = request.mapping
-        
-        # Get existing cards by article
-        existing_cards = storage.get_all_cards()
-        existing_by_article = {c.article.lower(): c for c in existing_cards}
-        
-        # Prepare photo directory
-        photos_dir = UPLOADS_DIR / "imported_photos"
-        photos_dir.mkdir(exist_ok=True)
-        
         results = []
-        created = 0
-        updated = 0
-        skipped = 0
-        errors = 0
-        
-        # Filter rows by selection if provided
-        selected_set = set(request.selected_rows) if request.selected_rows else None
+        counts = {'created': 0, 'updated': 0, 'skipped': 0, 'error': 0}
         
-        for row in rows:
-            row_values = row['values']
-            row_num = row['row_number']
-            
-            # Skip if not in selected rows
-            if selected_set is not None and row_num not in selected_set:
-                continue
-            
-            try:
-                # Extract fields using mapping
-                article = get_cell_value(row_values, columns, mapping.article)
-                name = get_cell_value(row_values, columns, mapping.name)
-                brand = get_cell_value(row_values, columns, mapping.brand)
-                description = get_cell_value(row_values, columns, mapping.description)
-                price_str = get_cell_value(row_values, columns, mapping.price)
-                old_price_str = get_cell_value(row_values, columns, mapping.old_price)
-                barcode = get_cell_value(row_values, columns, mapping.barcode)
-                photos_str = get_cell_value(row_values, columns, mapping.photos)
-                length_str = get_cell_value(row_values, columns, mapping.length)
-                width_str = get_cell_value(row_values, columns, mapping.width)
-                height_str = get_cell_value(row_values, columns, mapping.height)
-                weight_str = get_cell_value(row_values, columns, mapping.weight)
-                
-                # Validate required fields
-                if not article:
-                    results.append(ImportResultRow(
-                        row_number=row_num,
-                        article="",
-                        name=name,
-                        status="error",
-                        message="Отсутствует артикул"
-                    ))
-                    errors += 1
-                    continue
-                
-                if not name:
-                    results.append(ImportResultRow(
-                        row_number=row_num,
-                        article=article,
-                        name="",
-                        status="error",
-                        message="Отсутствует наименование"
-                    ))
-                    errors += 1
-                    continue
-                
-                # Parse values
-                price = parse_price(price_str)
-                old_price = parse_price(old_price_str)
-                photos_urls = parse_photos(photos_str)
-                
-                # Parse dimensions
-                length = int(float(length_str)) if length_str else 0
-                width = int(float(width_str)) if width_str else 0
-                height = int(float(height_str)) if height_str else 0
-                weight = int(float(weight_str)) if weight_str else 0
-                
-                # Download photos if enabled (batch download for speed)
-                images = []
-                if request.download_photos and photos_urls:
-                    article_photos_dir = photos_dir / article.replace('/', '_').replace('\\', '_')
-                    article_photos_dir.mkdir(exist_ok=True)
-                    
-                    # Use batch download for better performance
-                    images = await download_photos_batch(photos_urls, article_photos_dir, max_concurrent=5)
-                
-                # Check if exists
-                existing = existing_by_article.get(article.lower())
-                
-                if existing:
-                    if not request.update_existing:
-                        results.append(ImportResultRow(
-                            row_number=row_num,
-                            article=article,
-                            name=name,
-                            status="skipped",
-                            message="Товар уже существует",
-                            card_id=existing.id
-                        ))
-                        skipped += 1
-                        continue
-                    
-                    # Update existing card
-                    update_data = {
-                        'name': name,
-                        'description': description,
-                        'brand': brand,
-                        'barcode': barcode,
-                    }
-                    
-                    if price > 0:
-                        update_data['price'] = price
-                    if old_price > 0:
-                        update_data['old_price'] = old_price
-                    if images:
-                        # Append new images to existing
-                        update_data['images'] = (existing.images or []) + images
-                    if length or width or height:
-                        update_data['dimensions'] = {
-                            'length': length or (existing.dimensions.length if existing.dimensions else 0),
-                            'width': width or (existing.dimensions.width if existing.dimensions else 0),
-                            'height': height or (existing.dimensions.height if existing.dimensions else 0),
-                            'weight': weight or (existing.dimensions.weight if existing.dimensions else 0),
-                        }
-                    if weight:
-                        update_data['weight'] = weight
-                    
-                    storage.update_card(existing.id, update_data)
-                    
-                    results.append(ImportResultRow(
-                        row_number=row_num,
-                        article=article,
-                        name=name,
-                        status="updated",
-                        message="Товар обновлен",
-                        card_id=existing.id
-                    ))
-                    updated += 1
-                
-                else:
-                    # Create new card
-                    now = datetime.utcnow().isoformat()
-                    
-                    # Determine marketplace type
-                    marketplace = MarketplaceType.WILDBERRIES
-                    if request.marketplace.lower() == 'ozon':
-                        marketplace = MarketplaceType.OZON
-                    
-                    card = MarketplaceCard(
-                        id=str(uuid.uuid4()),
-                        marketplace=marketplace,
-                        status=CardStatus.DRAFT,
-                        name=name,
-                        description=description,
-                        brand=brand,
-                        article=article,
-                        barcode=barcode,
-                        category_id=request.category_id,
-                        category_name=request.category_name,
-                        images=images,
-                        price=price if price > 0 else 1,  # Default price
-                        old_price=old_price if old_price > 0 else None,
-                        weight=weight if weight > 0 else None,
-                        dimensions={'length': length, 'width': width, 'height': height, 'weight': weight} if any([length, width, height]) else None,
-                        created_at=now,
-                        updated_at=now,
-                    )
-                    
-                    storage.add_card(card)
-                    existing_by_article[article.lower()] = card  # Add to cache
-                    
-                    results.append(ImportResultRow(
-                        row_number=row_num,
-                        article=article,
-                        name=name,
-                        status="created",
-                        message="Товар создан",
-                        card_id=card.id
-                    ))
-                    created += 1
-            
-            except Exception as e:
-                logger.error(f"Error importing row {row_num}: {e}")
-                results.append(ImportResultRow(
-                    row_number=row_num,
-                    article=article if 'article' in dir() else "",
-                    name=name if 'name' in dir() else "",
-                    status="error",
-                    message=str(e)
-                ))
-                errors += 1
+        async for result in run_import(request, columns, rows):
+            results.append(result)
+            counts[result.status] += 1
         
         # Clean up import file
         try:
@@ -842,10 +884,10 @@ async def execute_import(request: ImportRequest):
         
         return ImportResponse(
             total=len(rows),
-            created=created,
-            updated=updated,
-            skipped=skipped,
-            errors=errors,
+            created=counts['created'],
+            updated=counts['updated'],
+            skipped=counts['skipped'],
+            errors=counts['error'],
             results=results
         )
     
@@ -877,174 +919,31 @@ async def execute_import_stream(request: ImportRequest):
             columns = data['columns']
             rows = data['rows']
             
-            mapping = request.mapping
-            
-            # Get existing cards by article
-            existing_cards = storage.get_all_cards()
-            existing_by_article = {c.article.lower(): c for c in existing_cards}
-            
-            # Prepare photo directory
-            photos_dir = UPLOADS_DIR / "imported_photos"
-            photos_dir.mkdir(exist_ok=True)
-            
             results = []
-            created = 0
-            updated = 0
-            skipped = 0
-            errors = 0
+            counts = {'created': 0, 'updated': 0, 'skipped': 0, 'error': 0}
             
             # Filter rows by selection if provided
             selected_set = set(request.selected_rows) if request.selected_rows else None
-            rows_to_process = [r for r in rows if selected_set is None or r['row_number'] in selected_set]
-            total_rows = len(rows_to_process)
+            
+            # Итог для прогресса: выбранные строки или число строк из /preview;
+            # отдельный проход по файлу - только если клиент его не прислал
+            if selected_set is not None:
+                total_rows = len(selected_set)
+            elif request.total_rows is not None:
+                total_rows = request.total_rows
+            else:
+                total_rows = len(rows)
             
             yield f"data: {json.dumps({'type': 'start', 'total': total_rows})}\n\n"
             
-            for idx, row in enumerate(rows_to_process):
-                row_values = row['values']
-                row_num = row['row_number']
+            async for result in run_import(request, columns, rows):
+                results.append(result)
+                counts[result.status] += 1
                 
                 # Send progress every row
-                progress = int((idx / total_rows) * 100) if total_rows > 0 else 0
-                yield f"data: {json.dumps({'type': 'progress', 'current': idx, 'total': total_rows, 'percent': progress})}\n\n"
-                
-                try:
-                    # Extract fields using mapping
-                    article = get_cell_value(row_values, columns, mapping.article)
-                    name = get_cell_value(row_values, columns, mapping.name)
-                    brand = get_cell_value(row_values, columns, mapping.brand)
-                    description = get_cell_value(row_values, columns, mapping.description)
-                    price_str = get_cell_value(row_values, columns, mapping.price)
-                    old_price_str = get_cell_value(row_values, columns, mapping.old_price)
-                    barcode = get_cell_value(row_values, columns, mapping.barcode)
-                    photos_str = get_cell_value(row_values, columns, mapping.photos)
-                    length_str = get_cell_value(row_values, columns, mapping.length)
-                    width_str = get_cell_value(row_values, columns, mapping.width)
-                    height_str = get_cell_value(row_values, columns, mapping.height)
-                    weight_str = get_cell_value(row_values, columns, mapping.weight)
-                    
-                    # Validate required fields
-                    if not article:
-                        results.append(ImportResultRow(
-                            row_number=row_num, article="", name=name,
-                            status="error", message="Отсутствует артикул"
-                        ))
-                        errors += 1
-                        continue
-                    
-                    if not name:
-                        results.append(ImportResultRow(
-                            row_number=row_num, article=article, name="",
-                            status="error", message="Отсутствует наименование"
-                        ))
-                        errors += 1
-                        continue
-                    
-                    # Parse values
-                    price = parse_price(price_str)
-                    old_price = parse_price(old_price_str)
-                    photos_urls = parse_photos(photos_str)
-                    
-                    # Parse dimensions
-                    length = int(float(length_str)) if length_str else 0
-                    width = int(float(width_str)) if width_str else 0
-                    height = int(float(height_str)) if height_str else 0
-                    weight = int(float(weight_str)) if weight_str else 0
-                    
-                    # Download photos if enabled (batch download)
-                    images = []
-                    if request.download_photos and photos_urls:
-                        article_photos_dir = photos_dir / article.replace('/', '_').replace('\\', '_')
-                        article_photos_dir.mkdir(exist_ok=True)
-                        images = await download_photos_batch(photos_urls, article_photos_dir, max_concurrent=5)
-                    
-                    # Check if exists
-                    existing = existing_by_article.get(article.lower())
-                    
-                    if existing:
-                        if not request.update_existing:
-                            results.append(ImportResultRow(
-                                row_number=row_num, article=article, name=name,
-                                status="skipped", message="Товар уже существует", card_id=existing.id
-                            ))
-                            skipped += 1
-                            continue
-                        
-                        # Update existing card
-                        update_data = {
-                            'name': name, 'description': description,
-                            'brand': brand, 'barcode': barcode,
-                        }
-                        
-                        if price > 0:
-                            update_data['price'] = price
-                        if old_price > 0:
-                            update_data['old_price'] = old_price
-                        if images:
-                            update_data['images'] = (existing.images or []) + images
-                        if length or width or height:
-                            update_data['dimensions'] = {
-                                'length': length or (existing.dimensions.length if existing.dimensions else 0),
-                                'width': width or (existing.dimensions.width if existing.dimensions else 0),
-                                'height': height or (existing.dimensions.height if existing.dimensions else 0),
-                                'weight': weight or (existing.dimensions.weight if existing.dimensions else 0),
-                            }
-                        if weight:
-                            update_data['weight'] = weight
-                        
-                        storage.update_card(existing.id, update_data)
-                        
-                        results.append(ImportResultRow(
-                            row_number=row_num, article=article, name=name,
-                            status="updated", message="Товар обновлен", card_id=existing.id
-                        ))
-                        updated += 1
-                    
-                    else:
-                        # Create new card
-                        now = datetime.utcnow().isoformat()
-                        
-                        marketplace_type = MarketplaceType.WILDBERRIES
-                        if request.marketplace.lower() == 'ozon':
-                            marketplace_type = MarketplaceType.OZON
-                        
-                        card = MarketplaceCard(
-                            id=str(uuid.uuid4()),
-                            marketplace=marketplace_type,
-                            status=CardStatus.DRAFT,
-                            name=name, description=description, brand=brand,
-                            article=article, barcode=barcode,
-                            category_id=request.category_id,
-                            category_name=request.category_name,
-                            images=images,
-                            price=price if price > 0 else 1,
-                            old_price=old_price if old_price > 0 else None,
-                            weight=weight if weight > 0 else None,
-                            dimensions={'length': length, 'width': width, 'height': height, 'weight': weight} if any([length, width, height]) else None,
-                            created_at=now, updated_at=now,
-                        )
-                        
-                        storage.add_card(card)
-                        existing_by_article[article.lower()] = card
-                        
-                        results.append(ImportResultRow(
-                            row_number=row_num, article=article, name=name,
-                            status="created", message="Товар создан", card_id=card.id
-                        ))
-                        created += 1
-                
-                except Exception as e:
-                    logger.error(f"Error importing row {row_num}: {e}")
-                    results.append(ImportResultRow(
-                        row_number=row_num,
-                        article=article if 'article' in dir() else "",
-                        name=name if 'name' in dir() else "",
-                        status="error", message=str(e)
-                    ))
-                    errors += 1
-                
-                # Small delay to allow SSE to flush
-                await asyncio.sleep(0.01)
+                done = len(results)
+                progress = min(int((done / total_rows) * 100), 100) if total_rows > 0 else 0
+                yield f"data: {json.dumps({'type': 'progress', 'current': done, 'total': total_rows, 'percent': progress})}\n\n"
             
             # Clean up import file
             try:
@@ -1056,10 +955,10 @@ async def execute_import_stream(request: ImportRequest):
             final_result = {
                 'type': 'complete',
                 'total': len(rows),
-                'created': created,
-                'updated': updated,
-                'skipped': skipped,
-                'errors': errors,
+                'created': counts['created'],
+                'updated': counts['updated'],
+                'skipped': counts['skipped'],
+                'errors': counts['error'],
                 'results': [r.model_dump() for r in results]
             }
             yield f"data: {json.dumps(final_result)}\n\n"
@@ -7,13 +7,14 @@ from typing import List, Optional
 # Add project root to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Header
 from fastapi.responses import FileResponse, Response
 
 from backend.app.models import Template, TemplateUpdate, Point
 from backend.app.storage import storage
 from backend.app.config import TEMPLATES_DIR, THUMBNAILS_DIR, SUPPORTED_EXTENSIONS
 from backend.app.services import image_service
+from backend.app.services.template_pyramid import get_pyramid, delete_pyramid
 
 router = APIRouter(prefix="/api/templates", tags=["templates"])
 
@@ -63,19 +64,17 @@ async def upload_template(file: UploadFile = File(...)):
     with open(file_path, "wb") as f:
         shutil.copyfileobj(file.file, f)
     
-    # Create thumbnail (use template_id for thumbnail name)
+    # Build the resolution pyramid (PSD is composited once here) and the thumbnail from it
     thumb_path = THUMBNAILS_DIR / f"{template_id}.jpg"
     try:
+        pyramid = get_pyramid(file_path)
         image_service.create_thumbnail(file_path, thumb_path)
     except Exception as e:
         file_path.unlink(missing_ok=True)
         raise HTTPException(400, f"Failed to process image: {e}")
     
     # Default points based on image size
-    from PIL import Image
-    from src.file_utils import load_image
-    img = load_image(file_path)
-    w, h = img.size
+    w, h = pyramid.size
     
     default_points = [
         Point(x=int(w * 0.1), y=int(h * 0.35)),
@@ -173,9 +172,10 @@ async def delete_template(template_id: str):
     # Delete original file
     Path(template.path).unlink(missing_ok=True)
     
-    # Delete thumbnail
+    # Delete thumbnail and pyramid
     thumb_path = THUMBNAILS_DIR / f"{template_id}.jpg"
     thumb_path.unlink(missing_ok=True)
+    delete_pyramid(Path(template.path))
     
     storage.delete_template(template_id)
     return {"status": "deleted"}
@@ -202,13 +202,11 @@ async def get_editor_image(template_id: str):
         raise HTTPException(404, "Template not found")
     
     from PIL import Image
-    from src.file_utils import load_image
     import io
     
-    img = load_image(Path(template.path))
-    
-    # Resize to max 1200px for editor (high quality)
+    # Resize to max 1200px for editor (high quality) from the nearest pyramid level
     max_size = 1200
+    img = get_pyramid(Path(template.path)).image_for(max_size)
     if img.width > max_size or img.height > max_size:
         ratio = min(max_size / img.width, max_size / img.height)
         new_size = (int(img.width * ratio), int(img.height * ratio))
@@ -323,7 +321,9 @@ async def get_preview(
     corner_radius: int = None,
     blend_strength: float = None,
     change_color: str = None,
-    add_product: str = None
+    add_product: str = None,
+    quality: str = 'full',
+    if_none_match: Optional[str] = Header(None)
 ):
     """Get preview with optional print overlay and settings override.
     
@@ -334,6 +334,9 @@ async def get_preview(
     Args:
         print_file: Single print file path (for single mode or fallback)
         print_files: Comma-separated list of print file paths (for multi-area mode)
+        quality: 'full' (default) or 'draft' - a fast low-resolution render for
+            interactive editing; request 'draft' first and 'full' after it to refine
+        if_none_match: ETag from the client; answered with 304 if the preview is unchanged
     
     Requirements: 6.5
     """
@@ -341,6 +344,10 @@ async def get_preview(
     if not template:
         raise HTTPException(404, "Template not found")
     
+    from backend.app.services.image_service import PREVIEW_QUALITIES
+    if quality not in PREVIEW_QUALITIES:
+        raise HTTPException(400, f"Unknown preview quality: {quality}")
+    
     # Handle both Point objects and dicts for primary points (backward compatibility)
     points = [(p.x, p.y) if hasattr(p, 'x') else (p['x'], p['y']) for p in template.points]
     
@@ -401,21 +408,26 @@ async def get_preview(
         print_path = resolve_path(print_file)
     
     try:
+        preview_args = (Path(template.path), points, print_path, radius, blend, change_bg, add_prod)
+        preview_key = image_service.preview_cache_key(
+            *preview_args, point_sets=point_sets, print_paths=print_paths, quality=quality
+        )
+        etag = f'"{preview_key}"'
+        # Браузер проверяет актуальность превью по ETag (Cache-Control: no-cache)
+        headers = {"Cache-Control": "no-cache", "ETag": etag}
+        if if_none_match and etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+            return Response(status_code=304, headers=headers)
+        
         preview_bytes = image_service.generate_preview(
-            Path(template.path),
-            points,
-            print_path,
-            radius,
-            blend,
-            change_bg,
-            add_prod,
+            *preview_args,
             point_sets=point_sets,
-            print_paths=print_paths
+            print_paths=print_paths,
+            quality=quality
         )
         return Response(
             content=preview_bytes, 
             media_type="image/jpeg",
-            headers={"Cache-Control": "no-cache"}  # Don't cache previews
+            headers=headers
         )
     except Exception as e:
         raise HTTPException(500, f"Preview generation failed: {e}")
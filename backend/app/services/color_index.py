@@ -0,0 +1,243 @@
+"""
+Persistent per-folder index of dominant print colors.
+
+Colors are keyed by file content hash, so renamed or copied prints are not
+re-analyzed; a stat (mtime, size) memo per file name avoids re-hashing.
+"""
+import os
+import sys
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+from PIL import Image
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
+
+from src.color_analyzer import ColorAnalyzer
+from src.file_utils import load_image_reduced, file_content_hash
+from backend.app.config import COLOR_INDEX_DIR, COLOR_INDEX_DECODE_WORKERS, SUPPORTED_EXTENSIONS
+
+# Prints analyzed per vectorized batch
+_BATCH_SIZE = 64
+
+# Loaded indexes: resolved folder path -> index
+_indexes: Dict[str, "FolderColorIndex"] = {}
+_indexes_lock = threading.Lock()
+
+
+@contextmanager
+def _file_lock(lock_path: Path):
+    """Exclusive lock between processes (API and pool workers) for the duration of the block."""
+    with open(lock_path, 'a+b') as f:
+        if os.name == 'nt':
+            f.seek(0)
+            # LK_LOCK повторяет попытку 10 раз по секунде - ждём дольше, если индекс пишет другой процесс
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class FolderColorIndex:
+    """Dominant colors of the prints in one folder, stored as JSON in COLOR_INDEX_DIR."""
+
+    def __init__(self, folder_path: Path, engine: str):
+        self.folder_path = Path(folder_path)
+        folder_key = hashlib.sha1(str(self.folder_path).encode('utf-8')).hexdigest()[:16]
+        self.path = COLOR_INDEX_DIR / f"{folder_key}.json"
+        self.engine = engine
+        self.colors: Dict[str, Tuple[int, int, int]] = {}  # content hash -> RGB
+        self.files: Dict[str, List] = {}  # file name -> [mtime_ns, size, content hash]
+        self._lock = threading.Lock()
+        self._loaded_mtime: Optional[int] = None
+        self._load()
+
+    def _read(self) -> Optional[dict]:
+        """Index data on disk (None if missing, unreadable or built by another engine)."""
+        if not self.path.exists():
+            return None
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except Exception:
+            return None
+        # Цвета другого движка не переиспользуем
+        if data.get('engine') != self.engine:
+            return None
+        return data
+
+    def _load(self):
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            return
+        data = self._read()
+        if data is None:
+            return
+        self.colors = {k: tuple(v) for k, v in data.get('colors', {}).items()}
+        self.files = data.get('files', {})
+        self._loaded_mtime = mtime
+
+    def reload_if_changed(self):
+        """Pick up entries written by another process (e.g. a folder pass)."""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._loaded_mtime:
+            with self._lock:
+                self._load()
+
+    def content_hash(self, file_path: Path) -> str:
+        """Content hash of a print, reusing the stored one while mtime and size match."""
+        stat = file_path.stat()
+        entry = self.files.get(file_path.name)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2]
+        content_hash = file_content_hash(file_path)
+        with self._lock:
+            self.files[file_path.name] = [stat.st_mtime_ns, stat.st_size, content_hash]
+        return content_hash
+
+    def get(self, file_path: Path) -> Optional[Tuple[int, int, int]]:
+        return self.colors.get(self.content_hash(file_path))
+
+    def add(self, content_hash: str, color: Tuple[int, int, int]):
+        with self._lock:
+            self.colors[content_hash] = tuple(int(c) for c in color)
+
+    def save(self):
+        """
+        Merge with the index on disk and write it atomically.
+
+        Other processes (pool workers, the folder pass) write the same file,
+        so entries they added since our load are kept, not overwritten.
+        """
+        with _file_lock(self.path.with_suffix('.lock')), self._lock:
+            on_disk = self._read()
+            if on_disk is not None:
+                self.colors = {**{k: tuple(v) for k, v in on_disk.get('colors', {}).items()}, **self.colors}
+                self.files = {**on_disk.get('files', {}), **self.files}
+            data = {
+                "folder": str(self.folder_path),
+                "engine": self.engine,
+                "colors": self.colors,
+                "files": self.files
+            }
+            tmp_path = self.path.with_name(f"{self.path.stem}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = self.path.stat().st_mtime_ns
+
+
+def get_folder_index(folder_path: Path, engine: str) -> FolderColorIndex:
+    """Loaded index of a folder (one instance per folder and process)."""
+    key = str(Path(folder_path))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None or index.engine != engine:
+            index = _indexes[key] = FolderColorIndex(Path(folder_path), engine)
+        return index
+
+
+def clear_color_indexes():
+    """Drop loaded indexes (files on disk are kept)."""
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def get_print_color(print_path: Path, analyzer: ColorAnalyzer) -> Tuple[int, int, int]:
+    """Dominant color of a print from the folder index, computed and stored if unknown."""
+    print_path = Path(print_path)
+    index = get_folder_index(print_path.parent, analyzer.engine)
+
+    color = index.get(print_path)
+    if color is None:
+        index.reload_if_changed()
+        color = index.get(print_path)
+    if color is None:
+        color = analyzer.get_dominant_color(load_image_reduced(print_path, analyzer._max_analysis_size))
+        index.add(index.content_hash(print_path), color)
+        index.save()
+    return color
+
+
+def _load_for_analysis(analyzer: ColorAnalyzer, file_path: Path) -> Optional[Image.Image]:
+    """Decode a print at reduced size and downscale it to the analysis size (runs in a worker thread)."""
+    try:
+        reduced = load_image_reduced(file_path, analyzer._max_analysis_size)
+        return analyzer._resize_for_analysis(reduced, analyzer._max_analysis_size)
+    except Exception:
+        return None
+
+
+def analyze_folder(folder_path: Path, analyzer: ColorAnalyzer,
+                   workers: int = COLOR_INDEX_DECODE_WORKERS) -> int:
+    """
+    Compute dominant colors for all prints of a folder that are not indexed yet.
+
+    Prints are decoded and downscaled in parallel threads and analyzed in
+    vectorized batches (ColorAnalyzer.get_dominant_colors).
+
+    Returns:
+        Number of newly analyzed prints
+    """
+    folder_path = Path(folder_path)
+    if not folder_path.is_dir():
+        return 0
+
+    index = get_folder_index(folder_path, analyzer.engine)
+    index.reload_if_changed()
+
+    pending: List[Tuple[Path, str]] = []
+    seen_hashes = set()
+    for file_path in sorted(folder_path.iterdir(), key=lambda p: p.name.lower()):
+        if not file_path.is_file() or file_path.suffix.lower() not in SUPPORTED_EXTENSIONS:
+            continue
+        try:
+            content_hash = index.content_hash(file_path)
+        except OSError:
+            continue
+        if content_hash not in index.colors and content_hash not in seen_hashes:
+            seen_hashes.add(content_hash)
+            pending.append((file_path, content_hash))
+
+    analyzed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for start in range(0, len(pending), _BATCH_SIZE):
+            batch = pending[start:start + _BATCH_SIZE]
+            images = list(pool.map(lambda item: _load_for_analysis(analyzer, item[0]), batch))
+            decoded = [(item, img) for item, img in zip(batch, images) if img is not None]
+            colors = analyzer.get_dominant_colors([img for _, img in decoded])
+            for ((_, content_hash), _), color in zip(decoded, colors):
+                index.add(content_hash, color)
+            analyzed += len(decoded)
+            index.save()
+
+    # Сохраняем обновлённые хэши файлов, даже если новых цветов нет
+    if not pending:
+        index.save()
+    return analyzed
@@ -0,0 +1,134 @@
+"""
+Multi-process batch generation engine.
+
+Each worker process keeps its own warmed state (PerspectiveTransformer cache
+and prepared PSD templates in its `image_service`), so a template is parsed
+once per worker instead of once per card.
+"""
+import sys
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+
+import cv2
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
+
+from backend.app.config import GENERATION_WORKERS, GENERATION_MAX_IN_FLIGHT_PER_WORKER
+
+
+def _init_worker(templates: List[dict]):
+    """Warm worker state: transformers and prepared PSD templates."""
+    # Параллелизм даёт пул процессов - внутренние потоки OpenCV только мешают
+    cv2.setNumThreads(1)
+
+    from src.psd_processor import is_psd_available
+    from backend.app.services.image_service import image_service, get_transformer_cached
+
+    for template in templates:
+        template_path = Path(template['path'])
+        try:
+            get_transformer_cached(
+                template_path,
+                template['points'],
+                template['corner_radius'],
+                template['blend_strength']
+            )
+            if template_path.suffix.lower() == '.psd' and is_psd_available():
+                image_service.psd_processor.prepare_template(template_path)
+        except Exception:
+            # Ошибка шаблона будет возвращена из render_job для каждой карточки
+            pass
+
+
+def render_job(job: dict) -> dict:
+    """Render one (print, template) card inside a worker process."""
+    from backend.app.services.image_service import image_service
+    from backend.app.build_manifest import unit_inputs
+
+    template = job['template']
+    # Входы для манифеста снимаются здесь и до рендера - диспетчер не ждёт хэширования
+    try:
+        inputs = unit_inputs(job)
+    except OSError:
+        inputs = None
+    try:
+        image_service.generate_card(
+            Path(template['path']),
+            template['points'],
+            Path(job['print_path']),
+            Path(job['output_path']),
+            template['corner_radius'],
+            template['blend_strength'],
+            template['change_background_color'],
+            template['add_product']
+        )
+        return {"file": job['label'], "error": None, "inputs": inputs}
+    except Exception as e:
+        return {"file": job['label'], "error": str(e)}
+
+
+class GenerationPool:
+    """Process pool dispatching generation jobs with bounded in-flight work."""
+
+    def __init__(self, workers: int = GENERATION_WORKERS,
+                 max_in_flight_per_worker: int = GENERATION_MAX_IN_FLIGHT_PER_WORKER):
+        self.workers = max(1, workers)
+        self.max_in_flight = self.workers * max(1, max_in_flight_per_worker)
+
+    def run(
+        self,
+        jobs: Iterable[dict],
+        templates: List[dict],
+        on_result: Callable[[dict, dict], None],
+        should_cancel: Optional[Callable[[], bool]] = None
+    ) -> int:
+        """
+        Run jobs on the pool, calling on_result(job, result) for every completed job.
+
+        Jobs are submitted lazily: at most max_in_flight are queued at once,
+        so cancellation takes effect after the in-flight jobs finish.
+
+        Returns:
+            Number of completed jobs
+        """
+        jobs = iter(jobs)
+        in_flight: Dict[Future, dict] = {}
+        completed = 0
+
+        # spawn: не наследуем потоки и состояние FastAPI процесса
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(templates,)
+        ) as pool:
+            exhausted = False
+            while True:
+                cancelled = should_cancel is not None and should_cancel()
+
+                while not exhausted and not cancelled and len(in_flight) < self.max_in_flight:
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                        break
+                    in_flight[pool.submit(render_job, job)] = job
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # Падение процесса воркера (например, нехватка памяти)
+                        result = {"file": job['label'], "error": str(e)}
+                    completed += 1
+                    on_result(job, result)
+
+        return completed
@@ -12,35 +12,51 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
 from src.perspective_transformer import PerspectiveTransformer
 from src.color_analyzer import ColorAnalyzer
 from src.psd_processor import PSDProcessor, is_psd_available
-from src.file_utils import load_image, load_image_cv2
-from backend.app.config import THUMBNAIL_SIZE, PREVIEW_MAX_SIZE
+from src.file_utils import load_image_cv2, set_decoded_store, clear_decoded_store
+from backend.app.services.color_index import get_print_color, analyze_folder, clear_color_indexes
+from backend.app.services.preview_cache import preview_cache, preview_key
+from backend.app.services.template_pyramid import get_pyramid
+from backend.app.config import (
+    THUMBNAIL_SIZE, PREVIEW_MAX_SIZE, PREVIEW_DRAFT_MAX_SIZE, PSD_FLATTEN_LAYERS, PSD_RECOLOR_ENGINE,
+    COLOR_ANALYZER_ENGINE, DECODED_STORE_ENABLED, DECODED_STORE_DIR, DECODED_STORE_MAX_BYTES
+)
+
+# Процессы пула импортируют этот модуль - хранилище включается и в них
+if DECODED_STORE_ENABLED:
+    set_decoded_store(DECODED_STORE_DIR, DECODED_STORE_MAX_BYTES)
+
+# Режимы превью: 'full' - полный рендер с уменьшением результата,
+# 'draft' - рендер сразу в размере PREVIEW_DRAFT_MAX_SIZE
+PREVIEW_QUALITIES = ('full', 'draft')
 
 
 # Optimized caches with size limits
 _transformer_cache: Dict[str, PerspectiveTransformer] = {}
-_preview_cache: Dict[str, bytes] = {}
-_color_cache: Dict[str, tuple] = {}
 
 # Cache size limits
 _TRANSFORMER_CACHE_MAX = 15
-_PREVIEW_CACHE_MAX = 30
-_COLOR_CACHE_MAX = 50
 
 
 def clear_all_caches():
     """Очистить все кэши изображений."""
-    global _transformer_cache, _preview_cache, _color_cache
+    global _transformer_cache
     _transformer_cache.clear()
-    _preview_cache.clear()
-    _color_cache.clear()
+    preview_cache.clear()
+    # Индексы цветов остаются на диске - сбрасываем только загруженные
+    clear_color_indexes()
     # Также очищаем кэш в file_utils
     from src.file_utils import clear_image_cache
     clear_image_cache()
+    clear_decoded_store()
+    # И подготовленные PSD шаблоны
+    if image_service._psd_processor is not None:
+        image_service._psd_processor.clear_prepared_templates()
 
 
 def get_transformer_cached(template_path: Path, points: List[Tuple[int, int]], 
                            corner_radius: int, blend_strength: float,
-                           point_sets: Optional[List[List[Tuple[int, int]]]] = None) -> PerspectiveTransformer:
+                           point_sets: Optional[List[List[Tuple[int, int]]]] = None,
+                           scale: float = 1.0) -> PerspectiveTransformer:
     """Get cached transformer or create new one.
     
     Args:
@@ -49,34 +65,45 @@ def get_transformer_cached(template_path: Path, points: List[Tuple[int, int]],
         corner_radius: Radius for rounded corners
         blend_strength: Strength of color blending
         point_sets: Optional list of point sets for multi-area transformation
+        scale: Render scale (< 1 for draft previews)
     """
-    key = f"{template_path}:{points}:{corner_radius}:{blend_strength}:{point_sets}"
+    key = f"{template_path}:{points}:{corner_radius}:{blend_strength}:{point_sets}:{scale}"
     if key not in _transformer_cache:
         if len(_transformer_cache) >= _TRANSFORMER_CACHE_MAX:
             # Remove oldest entries (first 5)
             keys_to_remove = list(_transformer_cache.keys())[:5]
             for k in keys_to_remove:
                 del _transformer_cache[k]
+        template_image = None
+        if scale < 1.0:
+            # Уменьшенный шаблон берём из ближайшего уровня пирамиды, а не из оригинала
+            pyramid = get_pyramid(template_path)
+            size = tuple(max(1, round(d * scale)) for d in pyramid.size)
+            template_image = cv2.resize(pyramid.array_for(max(size)), size, interpolation=cv2.INTER_AREA)
         _transformer_cache[key] = PerspectiveTransformer(
-            template_path, points, corner_radius, blend_strength, point_sets=point_sets
+            template_path, points, corner_radius, blend_strength, point_sets=point_sets,
+            scale=scale, template_image=template_image
         )
     return _transformer_cache[key]
 
 
 class ImageService:
     def __init__(self):
-        self.color_analyzer = ColorAnalyzer(n_clusters=3)  # Reduced for speed
+        self.color_analyzer = ColorAnalyzer(n_clusters=3, engine=COLOR_ANALYZER_ENGINE)  # Reduced for speed
         self._psd_processor: Optional[PSDProcessor] = None
     
     @property
     def psd_processor(self) -> PSDProcessor:
         if self._psd_processor is None:
-            self._psd_processor = PSDProcessor()
+            self._psd_processor = PSDProcessor(
+                flatten_layers=PSD_FLATTEN_LAYERS,
+                recolor_engine=PSD_RECOLOR_ENGINE
+            )
         return self._psd_processor
     
     def create_thumbnail(self, image_path: Path, output_path: Path) -> Path:
-        """Create thumbnail for template."""
-        img = load_image(image_path)
+        """Create thumbnail for template from the nearest level of its pyramid."""
+        img = get_pyramid(image_path).image_for(max(THUMBNAIL_SIZE))
         img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
         
         if img.mode == 'RGBA':
@@ -88,20 +115,12 @@ class ImageService:
         return output_path
     
     def _get_cached_color(self, print_path: Path) -> tuple:
-        """Get cached dominant color or compute it."""
-        key = str(print_path)
-        if key not in _color_cache:
-            if len(_color_cache) >= _COLOR_CACHE_MAX:
-                # Remove oldest entries
-                keys_to_remove = list(_color_cache.keys())[:10]
-                for k in keys_to_remove:
-                    del _color_cache[k]
-            orig = load_image(print_path)
-            # Resize for faster color analysis - use smaller size
-            if orig.width > 150 or orig.height > 150:
-                orig.thumbnail((150, 150), Image.Resampling.NEAREST)
-            _color_cache[key] = self.color_analyzer.get_dominant_color(orig)
-        return _color_cache[key]
+        """Get dominant color from the folder color index (computed once per print)."""
+        return get_print_color(print_path, self.color_analyzer)
+    
+    def analyze_folder_colors(self, folder_path: Path) -> int:
+        """Index dominant colors of all prints in a folder in one batched pass."""
+        return analyze_folder(folder_path, self.color_analyzer)
 
     def _create_combined_warped_for_psd(
         self,
@@ -158,23 +177,16 @@ class ImageService:
                 elif product.shape[2] == 3:
                     product = cv2.cvtColor(product, cv2.COLOR_BGR2BGRA)
                 
-                # Warp to this point set's destination
+                # Warp to this point set's destination (bounding box only)
                 dst_points = np.float32(point_set)
-                warped = transformer._warp_product_to_points(product, dst_points)
+                warped, offset = transformer._warp_product_roi(product, dst_points)
                 
                 # Apply color blend if configured
                 if transformer._blend_strength > 0:
                     warped = transformer._apply_color_blend(warped, transformer._template, transformer._blend_strength)
                 
-                # Composite onto combined image
-                alpha = warped[:, :, 3].astype(np.float32) / 255.0
-                for c in range(3):
-                    combined[:, :, c] = (
-                        alpha * warped[:, :, c].astype(np.float32) + 
-                        (1 - alpha) * combined[:, :, c].astype(np.float32)
-                    ).astype(np.uint8)
-                # Update alpha channel
-                combined[:, :, 3] = np.maximum(combined[:, :, 3], warped[:, :, 3])
+                # Composite onto combined image and update alpha channel
+                PerspectiveTransformer.alpha_blend(combined, warped, offset, update_alpha=True)
                 
             except Exception as e:
                 import logging
@@ -184,6 +196,31 @@ class ImageService:
         
         return combined
 
+    def preview_cache_key(
+        self,
+        template_path: Path,
+        points: List[Tuple[int, int]],
+        print_path: Optional[Path] = None,
+        corner_radius: int = 0,
+        blend_strength: float = 0.25,
+        change_color: bool = True,
+        add_product: bool = True,
+        point_sets: Optional[List[List[Tuple[int, int]]]] = None,
+        print_paths: Optional[List[Path]] = None,
+        quality: str = 'full'
+    ) -> str:
+        """Content-addressed key of a preview (also used as its ETag)."""
+        params = {
+            "quality": quality,
+            "points": points,
+            "corner_radius": corner_radius,
+            "blend_strength": blend_strength,
+            "change_color": change_color,
+            "add_product": add_product,
+            "point_sets": point_sets,
+        }
+        return preview_key(template_path, [print_path] + list(print_paths or []), params)
+    
     def generate_preview(
         self,
         template_path: Path,
@@ -194,7 +231,8 @@ class ImageService:
         change_color: bool = True,
         add_product: bool = True,
         point_sets: Optional[List[List[Tuple[int, int]]]] = None,
-        print_paths: Optional[List[Path]] = None
+        print_paths: Optional[List[Path]] = None,
+        quality: str = 'full'
     ) -> bytes:
         """Generate preview image and return as bytes.
         
@@ -210,13 +248,20 @@ class ImageService:
             add_product: Whether to add product image
             point_sets: Optional list of point sets for multi-area transformation
             print_paths: Optional list of print paths for multi-area (cycles if fewer than point_sets)
+            quality: 'full' renders at template size and downsizes the result;
+                'draft' downsizes the template, PSD layers and points first
+                and renders at PREVIEW_DRAFT_MAX_SIZE
             
         Requirements: 6.5
         """
         # Check cache first
-        cache_key = f"{template_path}:{points}:{print_path}:{corner_radius}:{blend_strength}:{change_color}:{add_product}:{point_sets}:{print_paths}"
-        if cache_key in _preview_cache:
-            return _preview_cache[cache_key]
+        cache_key = self.preview_cache_key(
+            template_path, points, print_path, corner_radius, blend_strength,
+            change_color, add_product, point_sets, print_paths, quality
+        )
+        cached = preview_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         is_psd = template_path.suffix.lower() == '.psd' and is_psd_available()
         
@@ -227,9 +272,13 @@ class ImageService:
         
         # Use cached transformer with point_sets if available
         # Always pass point_sets when in multi-mode to ensure correct transformation
+        scale = 1.0
+        if quality == 'draft':
+            scale = min(1.0, PREVIEW_DRAFT_MAX_SIZE / max(get_pyramid(template_path).size))
         transformer = get_transformer_cached(
             template_path, points, corner_radius, blend_strength, 
-            point_sets=point_sets if (use_multi_mode and point_sets) else None
+            point_sets=point_sets if (use_multi_mode and point_sets) else None,
+            scale=scale
         )
         
         if is_psd:
@@ -264,7 +313,7 @@ class ImageService:
             if change_color and effective_print_path:
                 color = self._get_cached_color(effective_print_path)
             
-            img = self.psd_processor.process_with_warped_product(template_path, warped, color)
+            img = self.psd_processor.process_with_warped_product(template_path, warped, color, scale)
         else:
             # Non-PSD processing
             if add_product:
@@ -316,12 +365,7 @@ class ImageService:
         img.save(buffer, format='JPEG', quality=92)
         result = buffer.getvalue()
         
-        # Cache result with size limit
-        if len(_preview_cache) >= _PREVIEW_CACHE_MAX:
-            keys_to_remove = list(_preview_cache.keys())[:10]
-            for k in keys_to_remove:
-                del _preview_cache[k]
-        _preview_cache[cache_key] = result
+        preview_cache.put(cache_key, result)
         
         return result
     
@@ -352,7 +396,7 @@ class ImageService:
             
             color = None
             if change_color:
-                color = self.color_analyzer.get_dominant_color(load_image(print_path))
+                color = self._get_cached_color(print_path)
             
             img = self.psd_processor.process_with_warped_product(template_path, warped, color)
         else:
@@ -0,0 +1,185 @@
+"""
+Content-addressed store of downloaded product photos.
+
+Every distinct image is stored once as <sha256[:2]>/<sha256><ext>, however
+many URLs and cards refer to it; card images are paths of these files.
+A URL index remembers the file and the ETag / Last-Modified of each fetched
+URL, so re-imports send conditional requests and reuse the file on 304.
+Bodies are streamed to a temp file and renamed into place.
+"""
+import os
+import re
+import sys
+import json
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import aiofiles
+import httpx
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
+
+from backend.app.config import MEDIA_STORE_DIR, MEDIA_MAX_DOWNLOAD_BYTES, MEDIA_DOWNLOAD_CHUNK_SIZE
+
+INDEX_NAME = "url_index.json"
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# Хранилища часто отдают картинки без точного типа - такие ответы не отклоняем
+GENERIC_CONTENT_TYPES = ('application/octet-stream', 'binary/octet-stream')
+# Байт начала файла, достаточных для определения формата по сигнатуре
+SIGNATURE_SIZE = 12
+
+
+def _photo_extension(url: str, head: bytes, headers: httpx.Headers) -> str:
+    """Extension of a downloaded photo: by content signature, then file name, then content-type."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+
+    # Determine filename from content-disposition or URL
+    filename = None
+    cd = headers.get('content-disposition')
+    if cd:
+        match = re.search(r'filename="?([^";\n]+)"?', cd)
+        if match:
+            filename = match.group(1)
+    if not filename:
+        filename = url.split('?')[0].split('/')[-1]
+
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in PHOTO_EXTENSIONS:
+        return ext
+
+    # Try to detect from content-type
+    content_type = headers.get('content-type', '')
+    if 'png' in content_type:
+        return '.png'
+    if 'webp' in content_type:
+        return '.webp'
+    return '.jpg'
+
+
+def _check_photo_response(headers: httpx.Headers):
+    """Reject non-image and oversized responses before reading the body."""
+    content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type and not content_type.startswith('image/') and content_type not in GENERIC_CONTENT_TYPES:
+        raise ValueError(f"not an image: {content_type}")
+
+    content_length = headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > MEDIA_MAX_DOWNLOAD_BYTES:
+        raise ValueError(f"photo is larger than {MEDIA_MAX_DOWNLOAD_BYTES} bytes: {content_length}")
+
+
+class MediaStore:
+    """Photo files under MEDIA_STORE_DIR plus the URL index (saved by flush())."""
+
+    def __init__(self, directory: Path = MEDIA_STORE_DIR):
+        self.directory = Path(directory)
+        self._index_path = self.directory / INDEX_NAME
+        self._index: Optional[Dict[str, dict]] = None  # url -> {"file", "etag", "last_modified"}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _entries(self) -> Dict[str, dict]:
+        if self._index is None:
+            try:
+                self._index = json.loads(self._index_path.read_text(encoding='utf-8'))
+            except Exception:
+                self._index = {}
+        return self._index
+
+    def _lookup(self, url: str) -> Optional[dict]:
+        """Index entry of a URL whose file is still on disk."""
+        with self._lock:
+            entry = self._entries().get(url)
+        if entry is None or not (self.directory / entry['file']).exists():
+            return None
+        return entry
+
+    def _remember(self, url: str, file: str, headers: httpx.Headers):
+        with self._lock:
+            self._entries()[url] = {
+                "file": file,
+                "etag": headers.get('etag'),
+                "last_modified": headers.get('last-modified'),
+            }
+            self._dirty = True
+
+    def _commit(self, tmp_path: Path, digest: str, ext: str) -> str:
+        """Move a downloaded temp file to its content path; returns the path relative to the store."""
+        file = f"{digest[:2]}/{digest}{ext}"
+        path = self.directory / file
+        if path.exists():
+            # Такая картинка уже есть (другой URL) - второй копии не держим
+            tmp_path.unlink()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, path)
+        return file
+
+    async def fetch(self, url: str, client: httpx.AsyncClient) -> Optional[Path]:
+        """
+        Path of the stored photo for a URL, downloading it if needed.
+
+        A URL fetched before is revalidated with If-None-Match / If-Modified-Since.
+        The body is streamed to a temp file in chunks; responses that are not
+        images or exceed MEDIA_MAX_DOWNLOAD_BYTES are aborted (ValueError).
+        Returns None if the server answers with an error status.
+        """
+        entry = self._lookup(url)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        async with client.stream('GET', url, headers=headers) as response:
+            if response.status_code == 304 and entry is not None:
+                return self.directory / entry['file']
+            if response.status_code != 200:
+                return None
+            _check_photo_response(response.headers)
+
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.directory / f".{uuid.uuid4().hex}.part"
+            try:
+                digest = hashlib.sha256()
+                head = b''
+                size = 0
+                async with aiofiles.open(tmp_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(MEDIA_DOWNLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > MEDIA_MAX_DOWNLOAD_BYTES:
+                            raise ValueError(f"photo is larger than {MEDIA_MAX_DOWNLOAD_BYTES} bytes")
+                        if len(head) < SIGNATURE_SIZE:
+                            head += chunk[:SIGNATURE_SIZE - len(head)]
+                        digest.update(chunk)
+                        await f.write(chunk)
+                file = self._commit(tmp_path, digest.hexdigest(), _photo_extension(url, head, response.headers))
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+        self._remember(url, file, response.headers)
+        return self.directory / file
+
+    def flush(self):
+        """Write the URL index if it changed (atomically)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._index_path.with_name(f"{INDEX_NAME}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(self._index, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp_path, self._index_path)
+            self._dirty = False
+
+
+media_store = MediaStore()
@@ -0,0 +1,133 @@
+"""
+Disk-backed cache of rendered preview JPEGs.
+
+Entries are keyed by a hash of the input file contents and the render
+parameters, so they survive restarts and are invalidated by file edits.
+The key doubles as the HTTP ETag of the preview.
+"""
+import os
+import sys
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
+
+from src.file_utils import file_content_hash
+from backend.app.config import (
+    PREVIEW_CACHE_DIR, PREVIEW_CACHE_MAX_BYTES, PSD_FLATTEN_LAYERS, PSD_RECOLOR_ENGINE, COLOR_ANALYZER_ENGINE
+)
+
+# Увеличить при изменении рендера превью, чтобы не отдавать старые файлы
+PREVIEW_CACHE_VERSION = 1
+
+
+def _file_key(path: Optional[Path]) -> Optional[str]:
+    if path is None:
+        return None
+    try:
+        return file_content_hash(Path(path))
+    except OSError:
+        return None
+
+
+def preview_key(template_path: Path, print_paths: list, params: dict) -> str:
+    """Hash of template and print contents plus render parameters."""
+    key = {
+        "version": PREVIEW_CACHE_VERSION,
+        "template": _file_key(template_path),
+        "prints": [_file_key(p) for p in print_paths],
+        "params": params,
+        "engines": [PSD_FLATTEN_LAYERS, PSD_RECOLOR_ENGINE, COLOR_ANALYZER_ENGINE],
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class PreviewCache:
+    """JPEG files under PREVIEW_CACHE_DIR, evicted least recently used first when over max_bytes."""
+
+    def __init__(self, directory: Path = PREVIEW_CACHE_DIR, max_bytes: int = PREVIEW_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None  # считается при первой записи
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.jpg"
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        # mtime служит временем последнего обращения для вытеснения
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Write an entry atomically and evict old entries if over budget."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+
+        with self._lock:
+            # Перезапись ключа заменяет старый файл - его размер из счётчика вычитаем
+            try:
+                old_size = path.stat().st_size
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._entries())
+            else:
+                self._total_bytes += len(data) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """(mtime, path, size) of all cached files."""
+        entries = []
+        if not self.directory.exists():
+            return entries
+        for path in self.directory.glob("*/*.jpg"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        # Освобождаем до 90% лимита, чтобы не сканировать каталог на каждой записи
+        entries = sorted(self._entries(), key=lambda e: e[0])
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        self._total_bytes = total
+
+    def clear(self):
+        with self._lock:
+            for _, path, _ in self._entries():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self._total_bytes = 0
+
+
+preview_cache = PreviewCache()
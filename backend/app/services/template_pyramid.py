@@ -0,0 +1,149 @@
+"""
+Persistent multi-resolution pyramid of template renders.
+
+Levels (full, 1/2, 1/4, thumbnail) are written once per template file, so
+the editor image, thumbnails and draft previews read a small pre-rendered
+level instead of decoding - or compositing, for PSD - the original.
+The pyramid is rebuilt when the template file's mtime or size changes.
+"""
+import os
+import sys
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
+
+from src.file_utils import load_image, load_image_cv2
+from backend.app.config import TEMPLATE_PYRAMID_DIR, TEMPLATE_PYRAMID_SCALES, THUMBNAIL_SIZE
+
+MANIFEST_NAME = "pyramid.json"
+
+# Loaded pyramids: template path -> pyramid
+_pyramids: Dict[str, "TemplatePyramid"] = {}
+_pyramids_lock = threading.Lock()
+
+
+class TemplatePyramid:
+    """Downscaled renders of one template file, stored in TEMPLATE_PYRAMID_DIR."""
+
+    def __init__(self, template_path: Path):
+        self.template_path = Path(template_path)
+        folder_key = hashlib.sha1(str(self.template_path).encode('utf-8')).hexdigest()[:16]
+        self.directory = TEMPLATE_PYRAMID_DIR / folder_key
+        self.size: Tuple[int, int] = (0, 0)  # (width, height) of the original
+        self.levels: List[dict] = []  # {"file", "width", "height"}, largest first
+        self._signature: Optional[List[int]] = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _source_signature(self) -> List[int]:
+        stat = self.template_path.stat()
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _load(self):
+        try:
+            data = json.loads((self.directory / MANIFEST_NAME).read_text(encoding='utf-8'))
+        except Exception:
+            return
+        self.size = tuple(data['size'])
+        self.levels = data['levels']
+        self._signature = data['source']
+
+    def is_fresh(self) -> bool:
+        try:
+            return bool(self.levels) and self._signature == self._source_signature()
+        except OSError:
+            return False
+
+    def _level_path(self, level: dict) -> Path:
+        # Полный уровень для не-PSD - сам исходный файл
+        return self.template_path if level['file'] is None else self.directory / level['file']
+
+    def build(self):
+        """Render all levels from the original (PSD is composited once here)."""
+        with self._lock:
+            signature = self._source_signature()
+            img = load_image(self.template_path)
+            if img.mode not in ('RGB', 'RGBA'):
+                has_alpha = 'A' in img.mode or 'transparency' in img.info
+                img = img.convert('RGBA' if has_alpha else 'RGB')
+
+            self.directory.mkdir(parents=True, exist_ok=True)
+            is_psd = self.template_path.suffix.lower() == '.psd'
+            levels = []
+
+            def save_level(level_img: Image.Image, name: str):
+                level_img.save(self.directory / name, 'PNG', compress_level=1)
+                levels.append({"file": name, "width": level_img.width, "height": level_img.height})
+
+            if is_psd:
+                save_level(img, "full.png")
+            else:
+                levels.append({"file": None, "width": img.width, "height": img.height})
+
+            level_img = img
+            for scale in TEMPLATE_PYRAMID_SCALES:
+                size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+                if max(size) <= max(THUMBNAIL_SIZE):
+                    break
+                # Каждый уровень уменьшается из предыдущего - дешевле, чем из оригинала
+                level_img = level_img.resize(size, Image.Resampling.LANCZOS)
+                save_level(level_img, f"{scale:g}.png")
+
+            thumb = level_img.copy()
+            thumb.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+            save_level(thumb, "thumbnail.png")
+
+            manifest = {"source": signature, "size": [img.width, img.height], "levels": levels}
+            tmp_path = self.directory / f"{MANIFEST_NAME}.{os.getpid()}.tmp"
+            tmp_path.write_text(json.dumps(manifest), encoding='utf-8')
+            os.replace(tmp_path, self.directory / MANIFEST_NAME)
+
+            self.size = (img.width, img.height)
+            self.levels = levels
+            self._signature = signature
+
+    def _nearest_level(self, max_size: int) -> dict:
+        """Smallest level whose longer side is at least max_size (the largest one otherwise)."""
+        for level in reversed(self.levels):
+            if max(level['width'], level['height']) >= max_size:
+                return level
+        return self.levels[0]
+
+    def image_for(self, max_size: int) -> Image.Image:
+        """PIL image of the nearest level for a target size (not resized to it)."""
+        return load_image(self._level_path(self._nearest_level(max_size)))
+
+    def array_for(self, max_size: int):
+        """BGR(A) array of the nearest level for a target size (read-only, shared cache)."""
+        return load_image_cv2(self._level_path(self._nearest_level(max_size)))
+
+
+def get_pyramid(template_path: Path) -> TemplatePyramid:
+    """Pyramid of a template, (re)built if missing or stale."""
+    key = str(Path(template_path))
+    with _pyramids_lock:
+        pyramid = _pyramids.get(key)
+        if pyramid is None:
+            pyramid = _pyramids[key] = TemplatePyramid(Path(template_path))
+    if not pyramid.is_fresh():
+        pyramid.build()
+    return pyramid
+
+
+def delete_pyramid(template_path: Path):
+    """Remove the stored pyramid of a deleted template."""
+    with _pyramids_lock:
+        pyramid = _pyramids.pop(str(Path(template_path)), None)
+    if pyramid is None:
+        pyramid = TemplatePyramid(Path(template_path))
+    if pyramid.directory.exists():
+        for f in pyramid.directory.iterdir():
+            f.unlink(missing_ok=True)
+        pyramid.directory.rmdir()
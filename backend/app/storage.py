@@ -1,21 +1,39 @@
 """In-memory storage for templates and folders with optimized I/O."""
+import os
 import sys
 import json
+import time
+import atexit
+import logging
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 import threading
 
 # Add project root to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from backend.app.models import Template, PrintFolder, GenerationStatus, Point, PointSet, MarketplaceCard
-from backend.app.config import BASE_DIR
+from backend.app.models import Template, PrintFolder, Point, PointSet, MarketplaceCard
+from backend.app.config import (
+    BASE_DIR, CARDS_STORAGE_BACKEND, STORAGE_WRITE_BEHIND, STORAGE_FLUSH_INTERVAL_MS, STORAGE_FLUSH_MAX_MUTATIONS,
+    STORAGE_FLUSH_RETRY_MAX_MS
+)
+from backend.app.card_store import CardDatabase
 
 STORAGE_FILE = BASE_DIR / "storage.json"
 PRESETS_FILE = BASE_DIR / "template_presets.json"
 CARDS_FILE = BASE_DIR / "marketplace_cards.json"
 SETTINGS_FILE = BASE_DIR / "marketplace_settings.json"
 
+logger = logging.getLogger(__name__)
+
+
+def _write_json_atomic(path: Path, data):
+    """Write JSON to a temp file and rename it over the target."""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(tmp_path, path)
+
 
 class Storage:
     def __init__(self):
@@ -24,8 +42,20 @@ class Storage:
         self.presets: Dict[str, List[dict]] = {}  # name -> points preset
         self.cards: Dict[str, MarketplaceCard] = {}  # Marketplace cards
         self.marketplace_settings: Dict[str, str] = {}  # API keys
-        self.generation_status = GenerationStatus()
         self._save_lock = threading.Lock()  # Thread-safe saves
+        self._card_db: Optional[CardDatabase] = None  # SQLite backend of cards (CARDS_STORAGE_BACKEND)
+        # Write-behind: что изменилось с последней записи
+        self._state_lock = threading.Lock()
+        self._dirty: set = set()  # 'storage', 'presets', 'cards', 'settings'
+        self._dirty_card_ids: Dict[str, None] = {}  # измененные/удаленные карточки в порядке изменения
+        self._pending_mutations = 0
+        # batch() держит его до конца блока: пачки разных потоков не пересекаются,
+        # а flush() не пишет половину открытой пачки
+        self._batch_lock = threading.RLock()
+        self._batch_depth = 0
+        self._flusher: Optional[threading.Thread] = None
+        self._flush_requested = threading.Event()
+        self._flush_due = threading.Event()
         self._load()
         self._load_presets()
         self._load_cards()
@@ -60,10 +90,8 @@ class Storage:
     def _load_original_dimensions(self, template: Template) -> Template:
         """Load original image dimensions for migration."""
         try:
-            from PIL import Image
-            from src.file_utils import load_image
-            img = load_image(Path(template.path))
-            w, h = img.size
+            from src.file_utils import get_image_size
+            w, h = get_image_size(Path(template.path))
             return template.model_copy(update={'original_width': w, 'original_height': h})
         except Exception:
             return template
@@ -83,13 +111,8 @@ class Storage:
         return template
     
     def _save(self):
-        """Save to file (thread-safe)."""
-        with self._save_lock:
-            data = {
-                'templates': [t.model_dump() for t in self.templates.values()],
-                'folders': [f.model_dump() for f in self.folders.values()]
-            }
-            STORAGE_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+        """Schedule saving templates and folders."""
+        self._mark_dirty('storage')
     
     # Templates
     def add_template(self, template: Template) -> Template:
@@ -205,9 +228,8 @@ class Storage:
                 self.presets = {}
     
     def _save_presets(self):
-        """Save presets to file (thread-safe)."""
-        with self._save_lock:
-            PRESETS_FILE.write_text(json.dumps(self.presets, ensure_ascii=False, indent=2), encoding='utf-8')
+        """Schedule saving presets."""
+        self._mark_dirty('presets')
     
     def _parse_preset(self, data) -> Optional[List[Point]]:
         """Parse preset data from either old or new format.
@@ -282,7 +304,14 @@ class Storage:
     # ==================== Marketplace Cards ====================
     
     def _load_cards(self):
-        """Load marketplace cards from file."""
+        """Load marketplace cards (SQLite backend migrates an existing JSON file until it succeeds)."""
+        if CARDS_STORAGE_BACKEND == 'sqlite':
+            self._card_db = CardDatabase()
+            if CARDS_FILE.exists():
+                self._migrate_cards_json()
+            self.cards = self._card_db.load_all()
+            return
+        
         if CARDS_FILE.exists():
             try:
                 data = json.loads(CARDS_FILE.read_text(encoding='utf-8'))
@@ -292,18 +321,39 @@ class Storage:
             except Exception:
                 self.cards = {}
     
-    def _save_cards(self):
-        """Save marketplace cards to file (thread-safe)."""
-        with self._save_lock:
-            data = {'cards': [c.model_dump() for c in self.cards.values()]}
-            CARDS_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+    def _migrate_cards_json(self):
+        """
+        Copy cards from the JSON file into the database and keep the file as a backup.
+        
+        On failure the file stays in place and the migration is retried on the next
+        start; cards written to the database meanwhile are not overwritten by it.
+        """
+        try:
+            data = json.loads(CARDS_FILE.read_text(encoding='utf-8'))
+            cards = [MarketplaceCard(**c) for c in data.get('cards', [])]
+            self._card_db.insert_missing(cards)
+        except Exception as e:
+            logger.error(f"Cards from {CARDS_FILE} were not migrated to the database (will retry on next start): {e}")
+            return
+        CARDS_FILE.rename(CARDS_FILE.with_name(CARDS_FILE.name + '.migrated'))
+    
+    def _save_cards(self, upserted: List[MarketplaceCard] = (), deleted: List[str] = ()):
+        """Schedule saving changed cards (changed rows for SQLite, the whole file for JSON)."""
+        self._mark_dirty('cards', [card.id for card in upserted] + list(deleted))
     
     def add_card(self, card: MarketplaceCard) -> MarketplaceCard:
         """Add a new marketplace card."""
         self.cards[card.id] = card
-        self._save_cards()
+        self._save_cards(upserted=[card])
         return card
     
+    def add_cards(self, cards: List[MarketplaceCard]) -> List[MarketplaceCard]:
+        """Add several marketplace cards with a single save."""
+        for card in cards:
+            self.cards[card.id] = card
+        self._save_cards(upserted=cards)
+        return cards
+    
     def get_card(self, card_id: str) -> Optional[MarketplaceCard]:
         """Get card by ID."""
         return self.cards.get(card_id)
@@ -312,6 +362,21 @@ class Storage:
         """Get all marketplace cards."""
         return list(self.cards.values())
     
+    def find_cards(
+        self,
+        marketplace: Optional[str] = None,
+        status: Optional[str] = None,
+        article: Optional[str] = None
+    ) -> List[MarketplaceCard]:
+        """Cards matching all given filters."""
+        # Из памяти, а не из базы: при отложенной записи база отстает от памяти
+        return [
+            c for c in self.cards.values()
+            if (not marketplace or c.marketplace == marketplace)
+            and (not status or c.status == status)
+            and (not article or c.article.lower() == article.lower())
+        ]
+    
     def update_card(self, card_id: str, updates: dict) -> Optional[MarketplaceCard]:
         """Update a marketplace card."""
         if card_id not in self.cards:
@@ -322,14 +387,29 @@ class Storage:
         updates['updated_at'] = datetime.now().isoformat()
         updated = card.model_copy(update=updates)
         self.cards[card_id] = updated
-        self._save_cards()
+        self._save_cards(upserted=[updated])
+        return updated
+    
+    def update_cards(self, updates: List[Tuple[str, dict]]) -> List[MarketplaceCard]:
+        """Apply (card_id, updates) pairs in order with a single save; unknown ids are ignored."""
+        from datetime import datetime
+        updated = []
+        for card_id, card_updates in updates:
+            card = self.cards.get(card_id)
+            if card is None:
+                continue
+            card_updates['updated_at'] = datetime.now().isoformat()
+            self.cards[card_id] = card.model_copy(update=card_updates)
+            updated.append(self.cards[card_id])
+        if updated:
+            self._save_cards(upserted=updated)
         return updated
     
     def delete_card(self, card_id: str) -> bool:
         """Delete a marketplace card."""
         if card_id in self.cards:
             del self.cards[card_id]
-            self._save_cards()
+            self._save_cards(deleted=[card_id])
             return True
         return False
     
@@ -344,12 +424,8 @@ class Storage:
                 self.marketplace_settings = {}
     
     def _save_marketplace_settings(self):
-        """Save marketplace settings to file (thread-safe)."""
-        with self._save_lock:
-            SETTINGS_FILE.write_text(
-                json.dumps(self.marketplace_settings, ensure_ascii=False, indent=2), 
-                encoding='utf-8'
-            )
+        """Schedule saving marketplace settings."""
+        self._mark_dirty('settings')
     
     def get_marketplace_settings(self) -> Dict[str, str]:
         """Get marketplace API settings."""
@@ -360,6 +436,133 @@ class Storage:
         self.marketplace_settings.update(updates)
         self._save_marketplace_settings()
         return self.marketplace_settings.copy()
+    
+    # ==================== Persistence ====================
+    
+    def _mark_dirty(self, section: str, card_ids: Iterable[str] = ()):
+        """Record a mutation; it is written by the flusher thread, at the end of batch() or right away."""
+        with self._state_lock:
+            self._dirty.add(section)
+            for card_id in card_ids:
+                self._dirty_card_ids[card_id] = None
+            self._pending_mutations += 1
+            if self._batch_depth:
+                return
+            write_now = not STORAGE_WRITE_BEHIND
+            if not write_now:
+                self._start_flusher()
+                if self._pending_mutations >= STORAGE_FLUSH_MAX_MUTATIONS:
+                    self._flush_due.set()
+                self._flush_requested.set()
+        if write_now:
+            self.flush()
+    
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="storage-flusher", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+    
+    def _flush_loop(self):
+        retry_delay = STORAGE_FLUSH_INTERVAL_MS / 1000
+        while True:
+            self._flush_requested.wait()
+            # Копим изменения до интервала или до лимита мутаций, затем пишем одним сохранением
+            self._flush_due.wait(STORAGE_FLUSH_INTERVAL_MS / 1000)
+            self._flush_requested.clear()
+            self._flush_due.clear()
+            if self._batch_depth:
+                continue  # запишет выход из batch()
+            try:
+                self.flush()
+                retry_delay = STORAGE_FLUSH_INTERVAL_MS / 1000
+            except Exception as e:
+                # flush() уже вернул изменения в очередь и запросил повтор - ждем перед ним
+                logger.error(f"Storage flush failed, retrying in {retry_delay:.1f}s: {e}")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, STORAGE_FLUSH_RETRY_MAX_MS / 1000)
+    
+    def flush(self):
+        """Write all pending changes now (each JSON file atomically, cards in one transaction)."""
+        with self._batch_lock, self._save_lock:
+            with self._state_lock:
+                sections, self._dirty = self._dirty, set()
+                card_ids, self._dirty_card_ids = self._dirty_card_ids, {}
+                self._pending_mutations = 0
+            try:
+                self._write_sections(sections, card_ids)
+            except Exception:
+                # Не потерять изменения: возвращаем их в очередь и просим фоновый поток повторить запись
+                with self._state_lock:
+                    self._dirty |= sections
+                    self._dirty_card_ids = {**card_ids, **self._dirty_card_ids}
+                    self._pending_mutations += len(sections)
+                    if STORAGE_WRITE_BEHIND:
+                        self._start_flusher()
+                        self._flush_requested.set()
+                raise
+    
+    def _write_sections(self, sections: set, card_ids: Dict[str, None]):
+        if 'storage' in sections:
+            _write_json_atomic(STORAGE_FILE, {
+                'templates': [t.model_dump() for t in list(self.templates.values())],
+                'folders': [f.model_dump() for f in list(self.folders.values())]
+            })
+        if 'presets' in sections:
+            _write_json_atomic(PRESETS_FILE, dict(self.presets))
+        if 'cards' in sections:
+            if self._card_db is not None:
+                cards = dict(self.cards)
+                self._card_db.write(
+                    upserted=[cards[card_id] for card_id in card_ids if card_id in cards],
+                    deleted=[card_id for card_id in card_ids if card_id not in cards]
+                )
+            else:
+                _write_json_atomic(CARDS_FILE, {'cards': [c.model_dump() for c in list(self.cards.values())]})
+        if 'settings' in sections:
+            _write_json_atomic(SETTINGS_FILE, dict(self.marketplace_settings))
+    
+    def _snapshot(self) -> dict:
+        # Модели не меняются на месте (model_copy), поэтому хватает копий словарей
+        return {
+            'templates': dict(self.templates),
+            'folders': dict(self.folders),
+            'presets': dict(self.presets),
+            'cards': dict(self.cards),
+            'marketplace_settings': dict(self.marketplace_settings),
+        }
+    
+    @contextmanager
+    def batch(self):
+        """
+        Transactional group of mutations, saved with one write when the outermost block exits.
+        
+        Batches of different threads run one after another. If the block raises,
+        in-memory state is restored to what it was on entry (so nothing of the
+        block reaches disk) and the exception propagates. Mutations made outside
+        batch() by other threads while the block runs are reverted by a rollback too.
+        """
+        with self._batch_lock:
+            outermost = self._batch_depth == 0
+            self._batch_depth += 1
+            snapshot = self._snapshot() if outermost else None
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if snapshot is not None:
+                    with self._state_lock:
+                        for name, value in snapshot.items():
+                            setattr(self, name, value)
+                    try:
+                        self.flush()
+                    except Exception as e:
+                        # Не скрываем исключение блока; flush() уже вернул изменения в очередь
+                        logger.error(f"Storage flush after batch rollback failed: {e}")
+                raise
+            self._batch_depth -= 1
+            if outermost:
+                self.flush()
 
 
 storage = Storage()
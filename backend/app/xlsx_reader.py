@@ -0,0 +1,110 @@
+"""
+Streaming reader for the first worksheet of an .xlsx file.
+
+Rows are parsed with iterparse and cleared as soon as they are yielded,
+so memory stays constant regardless of the number of rows (only the
+shared strings table is kept).
+"""
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+SHEET_PATH = 'xl/worksheets/sheet1.xml'
+SHARED_STRINGS_PATH = 'xl/sharedStrings.xml'
+
+_COLUMN_RE = re.compile(r'([A-Z]+)')
+
+
+def column_sort_key(col: str) -> Tuple[int, str]:
+    """Sort key for column letters: A..Z, AA..ZZ, ..."""
+    return (len(col), col)
+
+
+def read_shared_strings(z: zipfile.ZipFile) -> List[str]:
+    """Shared strings table, parsed incrementally."""
+    shared_strings = []
+    try:
+        with z.open(SHARED_STRINGS_PATH) as f:
+            context = ET.iterparse(f, events=('start', 'end'))
+            root = None
+            for event, elem in context:
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    continue
+                if elem.tag == NS + 'si':
+                    shared_strings.append(''.join(t.text or '' for t in elem.iter(NS + 't')))
+                    root.clear()
+    except KeyError:
+        # Нет таблицы строк - все значения в ячейках
+        pass
+    return shared_strings
+
+
+def load_shared_strings(file_path: str) -> List[str]:
+    """Shared strings table of an .xlsx file (to reuse across several passes over the sheet)."""
+    with zipfile.ZipFile(file_path, 'r') as z:
+        return read_shared_strings(z)
+
+
+def iter_sheet_rows(
+    file_path: str,
+    max_row: Optional[int] = None,
+    shared_strings: Optional[List[str]] = None
+) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """
+    Yield (row number, {column letter: value}) for the rows of the first sheet.
+
+    Args:
+        file_path: Path to the .xlsx file
+        max_row: Stop after this row number (reads only the beginning of the sheet)
+        shared_strings: Already loaded shared strings table (read from the file if None)
+    """
+    with zipfile.ZipFile(file_path, 'r') as z:
+        if shared_strings is None:
+            shared_strings = read_shared_strings(z)
+
+        with z.open(SHEET_PATH) as f:
+            sheet_data = None
+            for event, elem in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == NS + 'sheetData':
+                        sheet_data = elem
+                    continue
+                if elem.tag != NS + 'row':
+                    continue
+
+                row_num = int(elem.get('r', 0))
+                if max_row is not None and row_num > max_row:
+                    return
+
+                row_data = {}
+                for cell in elem.iter(NS + 'c'):
+                    col_match = _COLUMN_RE.match(cell.get('r', ''))
+                    if not col_match:
+                        continue
+                    cell_type = cell.get('t')
+
+                    if cell_type == 'inlineStr':
+                        value = ''.join(t.text or '' for t in cell.iter(NS + 't'))
+                    else:
+                        value_elem = cell.find(NS + 'v')
+                        value = (value_elem.text or '') if value_elem is not None else ''
+                        # If shared string, get actual value
+                        if cell_type == 's' and value:
+                            try:
+                                value = shared_strings[int(value)]
+                            except (ValueError, IndexError):
+                                pass
+
+                    row_data[col_match.group(1)] = value
+
+                # Освобождаем разобранные строки, чтобы дерево не росло
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    elem.clear()
+
+                yield row_num, row_data
@@ -0,0 +1,76 @@
+"""
+Alpha compositing benchmark: the old per-channel float32 loop vs PerspectiveTransformer.alpha_blend.
+
+Full-frame random BGRA over BGRA (a third fully transparent, a sixth opaque),
+best of 5 runs; peak temporaries are measured with tracemalloc.
+
+Usage: python benchmarks/bench_alpha_blend.py [SIZE ...]   (default 2000 4000)
+"""
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.perspective_transformer import PerspectiveTransformer
+
+RUNS = 5
+
+
+def float_loop(template: np.ndarray, product: np.ndarray) -> np.ndarray:
+    """Compositing as it was before alpha_blend (per channel, float32, truncating)."""
+    alpha = product[:, :, 3].astype(np.float32) / 255.0
+    for c in range(3):
+        template[:, :, c] = (
+            alpha * product[:, :, c].astype(np.float32) + (1 - alpha) * template[:, :, c].astype(np.float32)
+        ).astype(np.uint8)
+    return template
+
+
+def measure(blend, template: np.ndarray, product: np.ndarray):
+    """(best time in seconds, peak traced memory in bytes)."""
+    times = []
+    for _ in range(RUNS):
+        dst = template.copy()
+        start = time.perf_counter()
+        blend(dst, product)
+        times.append(time.perf_counter() - start)
+
+    dst = template.copy()
+    tracemalloc.start()
+    blend(dst, product)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1:]] or [2000, 4000]
+    rng = np.random.default_rng(0)
+    # Один поток, как в воркерах пула генерации
+    cv2.setNumThreads(1)
+
+    for n in sizes:
+        template = rng.integers(0, 256, (n, n, 4), dtype=np.uint8)
+        product = rng.integers(0, 256, (n, n, 4), dtype=np.uint8)
+        product[:n // 3, :, 3] = 0
+        product[n // 3:n // 2, :, 3] = 255
+
+        for name, blend in (('float loop', float_loop), ('alpha_blend', PerspectiveTransformer.alpha_blend)):
+            elapsed, peak = measure(blend, template, product)
+            print(f"{n}x{n} {name:12s} {elapsed * 1000:7.1f} ms  peak temp {peak / 2**20:6.1f} MiB")
+
+        diff = np.abs(
+            float_loop(template.copy(), product).astype(np.int16) -
+            PerspectiveTransformer.alpha_blend(template.copy(), product).astype(np.int16)
+        )
+        print(f"  max diff {diff.max()}, pixels differing {(diff.max(-1) > 0).mean() * 100:.2f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Recolor engines benchmark: PSDProcessor._apply_recolor with 'float' vs 'lut'.
+
+Times one recolor of a cached plan (average of 6 target colors) on a
+synthetic gradient layer and prints the largest per-channel difference
+between the engines.
+
+Usage: python benchmarks/bench_recolor_engine.py [HEIGHT WIDTH]   (default 3000 4000)
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.psd_processor import PSDProcessor
+
+COLORS = [(200, 40, 160), (20, 200, 60), (30, 60, 220)] * 2
+
+
+def gradient_layer(height: int, width: int) -> Image.Image:
+    """Opaque RGBA layer with hue and value gradients."""
+    arr = np.zeros((height, width, 4), np.uint8)
+    arr[..., 0] = np.linspace(0, 255, width)[None]
+    arr[..., 1] = 120
+    arr[..., 2] = np.linspace(255, 0, height)[:, None]
+    arr[..., 3] = 255
+    return Image.fromarray(arr)
+
+
+def main():
+    height, width = (int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) == 3 else (3000, 4000)
+    layer = gradient_layer(height, width)
+
+    results = {}
+    for engine in PSDProcessor.RECOLOR_ENGINES:
+        processor = PSDProcessor(recolor_engine=engine)
+        plan = processor._prepare_recolor(layer)
+        processor._apply_recolor(plan, COLORS[0])  # прогрев
+
+        start = time.perf_counter()
+        for color in COLORS:
+            result = processor._apply_recolor(plan, color)
+        elapsed = (time.perf_counter() - start) / len(COLORS)
+
+        results[engine] = np.asarray(result).astype(np.int16)
+        print(f"{height}x{width} {engine:5s} {elapsed * 1000:7.1f} ms/recolor")
+
+    engines = list(results)
+    print(f"max diff {np.abs(results[engines[0]] - results[engines[-1]]).max()}")
+
+
+if __name__ == "__main__":
+    main()
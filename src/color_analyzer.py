@@ -1,7 +1,6 @@
-from typing import Tuple, Optional
+from typing import List, Sequence, Tuple, Optional
 import numpy as np
 from PIL import Image
-from sklearn.cluster import KMeans
 import colorsys
 
 
@@ -23,11 +22,21 @@ class ColorAnalyzer:
     # Minimum pixels required for clustering
     MIN_PIXELS_FOR_CLUSTERING = 10
     
-    def __init__(self, n_clusters: int = 5):
+    # Dominant color engines: 'kmeans' (sklearn KMeans) or 'histogram' (3D histogram peak)
+    ENGINES = ('kmeans', 'histogram')
+    
+    # Histogram engine: bits per channel kept after quantization (16 levels per channel)
+    HISTOGRAM_BITS = 4
+    
+    def __init__(self, n_clusters: int = 5, engine: str = 'kmeans'):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown color engine: {engine}. Expected one of {self.ENGINES}")
         self.n_clusters = n_clusters
+        self.engine = engine
         self._max_analysis_size = 150
     
     def _resize_for_analysis(self, image: Image.Image, max_size: int = 150) -> Image.Image:
+        image = self._reduced_source(image, max_size)
         width, height = image.size
         
         if width <= max_size and height <= max_size:
@@ -39,64 +48,48 @@ class ColorAnalyzer:
         
         return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
     
-    def _rgb_to_hsv(self, rgb_pixels: np.ndarray) -> np.ndarray:
-        """Convert RGB pixels (0-255) to HSV (H: 0-360, S: 0-255, V: 0-255). Vectorized."""
-        rgb_normalized = rgb_pixels.astype(np.float32) / 255.0
-        
-        r, g, b = rgb_normalized[:, 0], rgb_normalized[:, 1], rgb_normalized[:, 2]
-        
-        maxc = np.maximum(np.maximum(r, g), b)
-        minc = np.minimum(np.minimum(r, g), b)
-        v = maxc
-        
-        deltac = maxc - minc
-        s = np.where(maxc != 0, deltac / maxc, 0)
-        
-        # Compute hue
-        h = np.zeros_like(maxc)
-        mask = deltac != 0
-        
-        rc = np.where(mask, (maxc - r) / deltac, 0)
-        gc = np.where(mask, (maxc - g) / deltac, 0)
-        bc = np.where(mask, (maxc - b) / deltac, 0)
-        
-        h = np.where(r == maxc, bc - gc, h)
-        h = np.where(g == maxc, 2.0 + rc - bc, h)
-        h = np.where(b == maxc, 4.0 + gc - rc, h)
-        h = (h / 6.0) % 1.0
-        
-        hsv_pixels = np.stack([h * 360, s * 255, v * 255], axis=1)
-        return hsv_pixels
-    
-    def _filter_pixels(self, rgb_pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    def _reduced_source(self, image: Image.Image, max_size: int) -> Image.Image:
         """
-        Filter out pixels based on HSV thresholds.
-        Returns filtered RGB pixels and their HSV values.
-        
-        Filters:
-        - V < 10 (near-black)
-        - V > 245 (near-white)
-        - S < 10 (near-gray)
+        For a JPEG that is not decoded yet, reopen it in draft mode (DCT scaling)
+        so full-size pixels are never materialized. The caller's image is not modified.
         """
-        hsv_pixels = self._rgb_to_hsv(rgb_pixels)
-        
-        # Create mask for valid pixels
-        s_channel = hsv_pixels[:, 1]
-        v_channel = hsv_pixels[:, 2]
-        
-        valid_mask = (
-            (v_channel >= self.VALUE_LOW_THRESHOLD) &
-            (v_channel <= self.VALUE_HIGH_THRESHOLD) &
-            (s_channel >= self.SATURATION_MIN_THRESHOLD)
-        )
+        filename = getattr(image, 'filename', None)
+        if image.format != 'JPEG' or not filename or not getattr(image, 'tile', None):
+            return image
+        # Уже уменьшенную через draft (load_image_reduced) картинку не переоткрываем;
+        # DCT уменьшает минимум вдвое и не ниже max_size - для меньших тоже без толку
+        if getattr(image, 'decoderconfig', None) or min(image.size) < 2 * max_size:
+            return image
+        try:
+            reduced = Image.open(filename)
+        except Exception:
+            return image
+        try:
+            reduced.draft('RGB', (max_size, max_size))
+            # load() декодирует и закрывает файл - открытый дескриптор в Windows блокирует принт
+            reduced.load()
+            return reduced
+        except Exception:
+            reduced.close()
+            return image
+    
+    def _saturation_value(self, rgb_pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """HSV saturation and value (0-255) of RGB pixels, without computing hue. Vectorized."""
+        r, g, b = rgb_pixels[:, 0], rgb_pixels[:, 1], rgb_pixels[:, 2]
+        maxc = np.maximum(np.maximum(r, g), b).astype(np.float32) / 255.0
+        minc = np.minimum(np.minimum(r, g), b).astype(np.float32) / 255.0
         
-        return rgb_pixels[valid_mask], hsv_pixels[valid_mask]
+        safe_max = np.where(maxc != 0, maxc, 1)
+        s = np.where(maxc != 0, (maxc - minc) / safe_max, 0)
+        return s * 255, maxc * 255
     
-    def _get_average_saturation(self, hsv_pixels: np.ndarray) -> float:
-        """Calculate average saturation from HSV pixels."""
-        if len(hsv_pixels) == 0:
-            return 0.0
-        return float(np.mean(hsv_pixels[:, 1]))
+    def _valid_pixel_mask(self, saturation: np.ndarray, value: np.ndarray) -> np.ndarray:
+        """Mask of pixels kept by the V < 10, V > 245 and S < 10 filters."""
+        return (
+            (value >= self.VALUE_LOW_THRESHOLD) &
+            (value <= self.VALUE_HIGH_THRESHOLD) &
+            (saturation >= self.SATURATION_MIN_THRESHOLD)
+        )
     
     def _get_color_saturation(self, rgb_color: Tuple[int, int, int]) -> float:
         """Get saturation value (0-255) for an RGB color."""
@@ -116,18 +109,13 @@ class ColorAnalyzer:
         - Returns neutral gray if average saturation < 15
         - Ensures result has saturation >= 20 when possible
         """
-        resized = self._resize_for_analysis(image, self._max_analysis_size)
-        
-        if resized.mode != 'RGB':
-            resized = resized.convert('RGB')
-        
-        pixels = np.array(resized)
-        pixels_flat = pixels.reshape(-1, 3)
+        pixels_flat = self._analysis_pixels(image)
         
         # Calculate average saturation of ORIGINAL image (before filtering)
         # This is used to determine if the input has low saturation overall
-        original_hsv = self._rgb_to_hsv(pixels_flat)
-        original_avg_saturation = self._get_average_saturation(original_hsv)
+        # (hue is not needed for filtering - only S and V are computed)
+        saturation, value = self._saturation_value(pixels_flat)
+        original_avg_saturation = float(np.mean(saturation))
         
         # If original image has very low average saturation, return neutral gray
         # (Requirement 5.3: low saturation input -> neutral fallback)
@@ -135,34 +123,74 @@ class ColorAnalyzer:
             return self.NEUTRAL_GRAY
         
         # Filter pixels based on HSV thresholds
-        filtered_pixels, filtered_hsv = self._filter_pixels(pixels_flat)
-        
-        # Check average saturation of filtered pixels for clustering decision
-        filtered_avg_saturation = self._get_average_saturation(filtered_hsv)
+        filtered_pixels = pixels_flat[self._valid_pixel_mask(saturation, value)]
         
         # Handle edge case: too few valid pixels after filtering
         if len(filtered_pixels) < self.MIN_PIXELS_FOR_CLUSTERING:
             # Fall back to neutral gray if not enough valid pixels
             return self.NEUTRAL_GRAY
         
-        # Perform K-means clustering on filtered pixels
-        n_unique_colors = len(np.unique(filtered_pixels, axis=0))
-        actual_clusters = min(self.n_clusters, n_unique_colors)
-        
-        if actual_clusters == 1:
-            color = filtered_pixels[0]
-            result = (int(color[0]), int(color[1]), int(color[2]))
+        if self.engine == 'histogram':
+            result = self._dominant_color_histogram(filtered_pixels)
         else:
-            kmeans = KMeans(n_clusters=actual_clusters, random_state=42, n_init=10)
-            kmeans.fit(filtered_pixels)
-            
-            labels, counts = np.unique(kmeans.labels_, return_counts=True)
-            dominant_cluster_idx = labels[np.argmax(counts)]
-            dominant_color = kmeans.cluster_centers_[dominant_cluster_idx]
-            
-            result = (int(round(dominant_color[0])), int(round(dominant_color[1])), int(round(dominant_color[2])))
+            result = self._dominant_color_kmeans(filtered_pixels)
+        
+        return self._validate_result_saturation(result, original_avg_saturation)
+    
+    def get_dominant_colors(self, images: Sequence[Image.Image]) -> List[Tuple[int, int, int]]:
+        """
+        Batch variant of get_dominant_color with the same filtering and saturation rules.
         
-        # Validate result saturation - boost if needed when input had decent saturation
+        With the 'histogram' engine all images are analyzed in one vectorized
+        pass (shared HSV conversion, one bincount for all histograms);
+        the 'kmeans' engine falls back to one call per image.
+        """
+        if self.engine != 'histogram':
+            return [self.get_dominant_color(image) for image in images]
+        if not images:
+            return []
+        
+        pixel_sets = [self._analysis_pixels(image) for image in images]
+        counts = np.array([len(p) for p in pixel_sets])
+        n_images = len(pixel_sets)
+        
+        pixels = np.concatenate(pixel_sets)
+        owner = np.repeat(np.arange(n_images), counts)
+        
+        saturation, value = self._saturation_value(pixels)
+        avg_saturations = np.bincount(owner, weights=saturation, minlength=n_images) / np.maximum(counts, 1)
+        
+        valid_mask = self._valid_pixel_mask(saturation, value)
+        filtered_owner = owner[valid_mask]
+        valid_counts = np.bincount(filtered_owner, minlength=n_images)
+        colors = self._histogram_peaks(pixels[valid_mask], filtered_owner, n_images)
+        
+        results = []
+        for i in range(n_images):
+            if avg_saturations[i] < self.LOW_AVG_SATURATION_THRESHOLD:
+                results.append(self.NEUTRAL_GRAY)
+            elif valid_counts[i] < self.MIN_PIXELS_FOR_CLUSTERING:
+                results.append(self.NEUTRAL_GRAY)
+            else:
+                result = tuple(int(round(c)) for c in colors[i])
+                results.append(self._validate_result_saturation(result, avg_saturations[i]))
+        return results
+    
+    def _analysis_pixels(self, image: Image.Image) -> np.ndarray:
+        """Resized RGB pixels of the image as an (N, 3) uint8 array."""
+        resized = self._resize_for_analysis(image, self._max_analysis_size)
+        
+        if resized.mode != 'RGB':
+            resized = resized.convert('RGB')
+        
+        return np.array(resized).reshape(-1, 3)
+    
+    def _validate_result_saturation(
+        self,
+        result: Tuple[int, int, int],
+        original_avg_saturation: float
+    ) -> Tuple[int, int, int]:
+        """Boost result saturation if needed when input had decent saturation."""
         result_saturation = self._get_color_saturation(result)
         if result_saturation < self.MIN_RESULT_SATURATION and original_avg_saturation >= 30:
             # Boost saturation to minimum threshold while preserving hue and value
@@ -171,6 +199,80 @@ class ColorAnalyzer:
         
         return result
     
+    def _dominant_color_kmeans(self, pixels: np.ndarray) -> Tuple[int, int, int]:
+        """Center of the largest K-means cluster of the filtered pixels."""
+        # sklearn импортируется лениво - он заметно замедляет старт приложения
+        from sklearn.cluster import KMeans
+        
+        n_unique_colors = len(np.unique(pixels, axis=0))
+        actual_clusters = min(self.n_clusters, n_unique_colors)
+        
+        if actual_clusters == 1:
+            color = pixels[0]
+            return (int(color[0]), int(color[1]), int(color[2]))
+        
+        kmeans = KMeans(n_clusters=actual_clusters, random_state=42, n_init=10)
+        kmeans.fit(pixels)
+        
+        labels, counts = np.unique(kmeans.labels_, return_counts=True)
+        dominant_cluster_idx = labels[np.argmax(counts)]
+        dominant_color = kmeans.cluster_centers_[dominant_cluster_idx]
+        
+        return (int(round(dominant_color[0])), int(round(dominant_color[1])), int(round(dominant_color[2])))
+    
+    def _dominant_color_histogram(self, pixels: np.ndarray) -> Tuple[int, int, int]:
+        """Peak of a coarse 3D color histogram, refined by the mean of nearby pixels."""
+        dominant_color = self._histogram_peaks(pixels, np.zeros(len(pixels), dtype=np.intp), 1)[0]
+        return (int(round(dominant_color[0])), int(round(dominant_color[1])), int(round(dominant_color[2])))
+    
+    def _histogram_peaks(self, pixels: np.ndarray, owner: np.ndarray, n_images: int) -> np.ndarray:
+        """
+        Histogram peak colors for pixels of several images at once.
+        
+        The histogram of each image is smoothed with a 3x3x3 box so the peak
+        reflects a color region rather than a single bin; the peak is refined
+        to the mean color of pixels within one bin of it.
+        
+        Args:
+            pixels: Filtered RGB pixels (N, 3) of all images
+            owner: Image index of every pixel (N,)
+            n_images: Number of images
+            
+        Returns:
+            Float array (n_images, 3) of dominant colors
+        """
+        bits = self.HISTOGRAM_BITS
+        bins = 1 << bits
+        quantized = (pixels >> (8 - bits)).astype(np.int32)
+        index = owner.astype(np.int32) << (3 * bits)
+        index |= quantized[:, 0] << (2 * bits)
+        index |= quantized[:, 1] << bits
+        index |= quantized[:, 2]
+        hist = np.bincount(index, minlength=n_images * bins ** 3).reshape(n_images, bins, bins, bins)
+        
+        # Separable 3x3x3 box filter over the color axes
+        smoothed = hist
+        for axis in range(1, 4):
+            padded = np.pad(smoothed, [(1, 1) if a == axis else (0, 0) for a in range(4)])
+            smoothed = (
+                np.take(padded, range(0, bins), axis=axis) +
+                np.take(padded, range(1, bins + 1), axis=axis) +
+                np.take(padded, range(2, bins + 2), axis=axis)
+            )
+        peak_index = np.argmax(smoothed.reshape(n_images, -1), axis=1)
+        peaks = np.stack(np.unravel_index(peak_index, (bins, bins, bins)), axis=1)
+        
+        # Refine: mean color of pixels in the peak neighbourhood
+        offsets = np.abs(quantized - peaks[owner])
+        near = (offsets[:, 0] <= 1) & (offsets[:, 1] <= 1) & (offsets[:, 2] <= 1)
+        near_owner = owner[near]
+        near_pixels = pixels[near]
+        near_counts = np.maximum(np.bincount(near_owner, minlength=n_images), 1)
+        return np.stack([
+            np.bincount(near_owner, weights=near_pixels[:, c], minlength=n_images) / near_counts
+            for c in range(3)
+        ], axis=1)
+    
     def _boost_saturation(self, rgb_color: Tuple[int, int, int], target_saturation: float) -> Tuple[int, int, int]:
         """Boost the saturation of an RGB color to the target level (0-255 scale)."""
         r, g, b = rgb_color[0] / 255.0, rgb_color[1] / 255.0, rgb_color[2] / 255.0
@@ -1,5 +1,10 @@
+import os
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from PIL import Image
 
 try:
@@ -11,6 +16,64 @@ except ImportError:
 SUPPORTED_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
 PSD_EXTENSIONS = {'.psd'}
 
+# Заголовок PSD/PSB: сигнатура, версия, 6 резервных байт, каналы, высота, ширина, глубина, цветовой режим
+_PSD_HEADER = struct.Struct('>4sH6sHIIHH')
+_PSD_DEPTHS = {1, 8, 16, 32}
+
+# Метаданные PSD из заголовка: путь:mtime:размер -> (width, height)
+_psd_info_cache: Dict[str, Tuple[int, int]] = {}
+
+
+def _stat_key(file_path: Path) -> str:
+    """Ключ кэша: путь + mtime + размер (изменённый файл не берётся из кэша)."""
+    stat = file_path.stat()
+    return f"{file_path}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def read_psd_size(file_path: Path) -> Optional[Tuple[int, int]]:
+    """
+    Читает размер PSD из 26-байтного заголовка, не разбирая слои.
+    
+    Returns:
+        (width, height) или None, если заголовок некорректен
+    """
+    file_path = Path(file_path)
+    try:
+        key = _stat_key(file_path)
+    except OSError:
+        return None
+    if key in _psd_info_cache:
+        return _psd_info_cache[key]
+    
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(_PSD_HEADER.size)
+    except OSError:
+        return None
+    if len(header) < _PSD_HEADER.size:
+        return None
+    
+    signature, version, _, channels, height, width, depth, _ = _PSD_HEADER.unpack(header)
+    # version 1 - PSD, 2 - PSB (большие документы)
+    if (signature != b'8BPS' or version not in (1, 2) or not 1 <= channels <= 56
+            or width == 0 or height == 0 or depth not in _PSD_DEPTHS):
+        return None
+    
+    _psd_info_cache[key] = (width, height)
+    return width, height
+
+
+def get_image_size(file_path: Path) -> Tuple[int, int]:
+    """Размер изображения без декодирования пикселей (для PSD - по заголовку)."""
+    file_path = Path(file_path)
+    if file_path.suffix.lower() in PSD_EXTENSIONS:
+        size = read_psd_size(file_path)
+        if size is None:
+            raise ValueError(f"Invalid PSD file: {file_path}")
+        return size
+    with Image.open(file_path) as img:
+        return img.size
+
 
 def is_valid_image(file_path: Path) -> bool:
     if not file_path.exists() or not file_path.is_file():
@@ -21,12 +84,8 @@ def is_valid_image(file_path: Path) -> bool:
     if suffix in PSD_EXTENSIONS:
         if not PSD_SUPPORTED:
             return False
-        try:
-            psd = PSDImage.open(file_path)
-            _ = psd.size
-            return True
-        except Exception:
-            return False
+        # Только заголовок - слои разбираются при загрузке
+        return read_psd_size(file_path) is not None
     
     if suffix not in SUPPORTED_EXTENSIONS:
         return False
@@ -48,11 +107,7 @@ def load_image(file_path: Path) -> Image.Image:
     if suffix in PSD_EXTENSIONS:
         if not PSD_SUPPORTED:
             raise ValueError("PSD support not available. Install psd-tools: pip install psd-tools")
-        try:
-            psd = PSDImage.open(file_path)
-            return psd.composite()
-        except Exception as e:
-            raise ValueError(f"Failed to open PSD file: {e}")
+        return _load_psd_composite(file_path)
     
     if suffix in SUPPORTED_EXTENSIONS:
         try:
@@ -63,31 +118,337 @@ def load_image(file_path: Path) -> Image.Image:
     raise ValueError(f"Unsupported file format: {suffix}")
 
 
-# Simple LRU cache for loaded images
-_image_cache = {}
-_CACHE_MAX_SIZE = 50
+def _load_psd_composite(file_path: Path) -> Image.Image:
+    """
+    psd.composite() с кэшем по пути, mtime и размеру файла.
+    
+    Композит хранится как read-only массив; возвращаемое изображение разделяет
+    с ним память, PIL копирует данные перед изменением на месте.
+    """
+    import numpy as np
+    
+    cache_key = _stat_key(file_path)
+    cached = _psd_composite_cache.get(cache_key)
+    if cached is None:
+        try:
+            composite = PSDImage.open(file_path).composite()
+        except Exception as e:
+            raise ValueError(f"Failed to open PSD file: {e}")
+        if composite.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            composite = composite.convert('RGBA')
+        cached = _psd_composite_cache.put(cache_key, np.asarray(composite))
+    return Image.fromarray(cached)
+
+
+def load_image_reduced(file_path: Path, max_size: int) -> Image.Image:
+    """
+    Загружает изображение в уменьшенном разрешении (не меньше max_size по каждой стороне,
+    если исходник позволяет) - для анализа цвета и миниатюр.
+    
+    JPEG декодируется сразу с масштабом 1/2-1/8 (Image.draft, DCT scaling),
+    для PSD используется встроенная миниатюра, если её хватает по размеру,
+    иначе сохранённое сведённое изображение вместо composite().
+    Остальные форматы загружаются как в load_image.
+    
+    Args:
+        file_path: Путь к изображению
+        max_size: Целевой размер по большей стороне
+    
+    Returns:
+        Изображение, которое вызывающий код ещё уменьшает до max_size
+    """
+    file_path = Path(file_path)
+    suffix = file_path.suffix.lower()
+    
+    if suffix in PSD_EXTENSIONS and PSD_SUPPORTED and file_path.exists():
+        try:
+            psd = PSDImage.open(file_path)
+            if psd.has_thumbnail():
+                thumb = psd.thumbnail()
+                if thumb is not None and max(thumb.size) >= max_size:
+                    return thumb
+            # Сохранённое в файле сведённое изображение - без рендера слоёв
+            merged = psd.topil()
+            if merged is not None:
+                return merged
+        except Exception:
+            pass
+        return load_image(file_path)
+    
+    img = load_image(file_path)
+    if img.format == 'JPEG':
+        # draft выбирает наибольший масштаб, при котором обе стороны >= запрошенных
+        img.draft('RGB', (max_size, max_size))
+    return img
+
+
+# LRU-кэш декодированных изображений для load_image_cv2, ограничен суммарным объёмом
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ImageCache:
+    """
+    Потокобезопасный LRU-кэш numpy-массивов с лимитом по байтам.
+    
+    Массивы хранятся только для чтения и отдаются без копирования -
+    вызывающий код копирует их сам, если собирается изменять.
+    """
+    
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: str):
+        with self._lock:
+            array = self._entries.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return array
+    
+    def put(self, key: str, array):
+        """Сохраняет массив (делает его read-only) и вытесняет самые старые записи."""
+        array.setflags(write=False)
+        size = array.nbytes
+        if size > self.max_bytes:
+            return array
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            while self._entries and self._bytes + size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+            self._entries[key] = array
+            self._bytes += size
+        return array
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_image_cache = ImageCache()
+
+# Кэш композитов PSD для load_image (отдельный лимит - композит нужен в PIL-виде)
+PSD_COMPOSITE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+_psd_composite_cache = ImageCache(PSD_COMPOSITE_CACHE_MAX_BYTES)
+
+
+# Хранилище декодированных пикселей: массив сохраняется один раз в .npy и затем
+# открывается через memmap - без повторного декодирования и без копий между процессами.
+# Выключено, пока каталог не задан через set_decoded_store.
+_decoded_store_dir: Optional[Path] = None
+# Лимит размера хранилища; проверяется при каждой записи
+_decoded_store_max_bytes: Optional[int] = None
+# Размер по последнему замеру каталога плюс свои записи после него
+_decoded_store_bytes: Optional[int] = None
+# Свои записи после последнего замера. Хранилище общее для воркеров пула, поэтому
+# каталог перемеряется, как только они превысят долю лимита: вместе N процессов
+# выходят за лимит не больше чем на N * DECODED_STORE_RESCAN_SHARE
+_decoded_store_unmeasured = 0
+DECODED_STORE_RESCAN_SHARE = 0.05
+_decoded_store_lock = threading.Lock()
+
+
+def set_decoded_store(directory: Optional[Path], max_bytes: Optional[int] = None):
+    """
+    Включает хранилище декодированных пикселей в каталоге (None - выключает).
+    
+    Args:
+        directory: Каталог хранилища
+        max_bytes: Лимит размера; при превышении после записи старые массивы удаляются
+    """
+    global _decoded_store_dir, _decoded_store_max_bytes, _decoded_store_bytes, _decoded_store_unmeasured
+    _decoded_store_dir = Path(directory) if directory is not None else None
+    _decoded_store_max_bytes = max_bytes
+    _decoded_store_bytes = None
+    _decoded_store_unmeasured = 0
+    if _decoded_store_dir is not None:
+        _decoded_store_dir.mkdir(parents=True, exist_ok=True)
+
+
+def _decoded_store_path(cache_key: str) -> Path:
+    digest = hashlib.sha1(cache_key.encode('utf-8')).hexdigest()
+    return _decoded_store_dir / digest[:2] / f"{digest}.npy"
+
+
+def _load_decoded(cache_key: str):
+    """Массив из хранилища (read-only memmap) или None."""
+    import numpy as np
+    
+    path = _decoded_store_path(cache_key)
+    try:
+        array = np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    # mtime служит временем последнего обращения для prune_decoded_store
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return array
+
+
+def _save_decoded(cache_key: str, array):
+    """Атомарно записывает массив в хранилище и держит его в пределах лимита (ошибки записи не критичны)."""
+    global _decoded_store_bytes, _decoded_store_unmeasured
+    import numpy as np
+    
+    path = _decoded_store_path(cache_key)
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        return
+    
+    if _decoded_store_max_bytes is None:
+        return
+    with _decoded_store_lock:
+        _decoded_store_unmeasured += size
+        if _decoded_store_bytes is not None:
+            _decoded_store_bytes += size
+        rescan = (
+            _decoded_store_bytes is None or
+            _decoded_store_unmeasured >= _decoded_store_max_bytes * DECODED_STORE_RESCAN_SHARE
+        )
+    if rescan:
+        # Замер учитывает записи других процессов
+        _measure_decoded_store()
+    if _decoded_store_bytes > _decoded_store_max_bytes:
+        # Чистим до 90% лимита, чтобы не сканировать каталог на каждой записи
+        prune_decoded_store(int(_decoded_store_max_bytes * 0.9))
+
+
+def _measure_decoded_store():
+    global _decoded_store_bytes, _decoded_store_unmeasured
+    total = _decoded_store_size()
+    with _decoded_store_lock:
+        _decoded_store_bytes = total
+        _decoded_store_unmeasured = 0
+
+
+def _decoded_store_entries():
+    """(mtime, size, path) всех массивов хранилища."""
+    entries = []
+    for path in _decoded_store_dir.glob("*/*.npy"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _decoded_store_size() -> int:
+    return sum(size for _, size, _ in _decoded_store_entries())
+
+
+def prune_decoded_store(max_bytes: int) -> int:
+    """
+    Удаляет давно не использованные массивы, пока хранилище больше max_bytes.
+    
+    Returns:
+        Количество удалённых файлов
+    """
+    global _decoded_store_bytes, _decoded_store_unmeasured
+    if _decoded_store_dir is None or not _decoded_store_dir.exists():
+        return 0
+    
+    entries = _decoded_store_entries()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            # В Windows файл, открытый через memmap, удалить нельзя - пропускаем его
+            continue
+        total -= size
+        removed += 1
+    with _decoded_store_lock:
+        _decoded_store_bytes = total
+        _decoded_store_unmeasured = 0
+    return removed
+
+
+def clear_decoded_store():
+    """Удаляет все массивы хранилища декодированных пикселей."""
+    if _decoded_store_dir is not None:
+        prune_decoded_store(0)
 
 
 def clear_image_cache():
     """Очистить кэш изображений."""
-    global _image_cache
     _image_cache.clear()
+    _psd_composite_cache.clear()
+    _psd_info_cache.clear()
+
+
+def get_image_cache_stats() -> Dict[str, int]:
+    """Счётчики кэша изображений: записи, байты, попадания, промахи, вытеснения."""
+    return _image_cache.stats()
 
 
 def load_image_cv2(file_path: Path, use_cache: bool = True):
+    """
+    Загружает изображение как numpy-массив BGR/BGRA.
+    
+    При use_cache=True результат берётся из кэша и возвращается только для чтения
+    (без копии) - перед изменением его нужно скопировать. Если включено хранилище
+    декодированных пикселей (set_decoded_store), промах кэша сначала ищется там.
+    """
     import numpy as np
     import cv2
     
     file_path = Path(file_path)
-    cache_key = str(file_path)
-    
-    # Check cache first
-    if use_cache and cache_key in _image_cache:
-        return _image_cache[cache_key].copy()
     
     if not file_path.exists():
         raise ValueError(f"File does not exist: {file_path}")
     
+    # Перезаписанный файл не должен браться из кэша
+    stat = file_path.stat()
+    cache_key = f"{file_path}:{stat.st_mtime_ns}:{stat.st_size}"
+    
+    # Check cache first
+    if use_cache:
+        cached = _image_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        if _decoded_store_dir is not None:
+            # memmap не кладём в кэш: страницы и так разделяются через page cache ОС
+            stored = _load_decoded(cache_key)
+            if stored is not None:
+                return stored
+    
     suffix = file_path.suffix.lower()
     
     if suffix in PSD_EXTENSIONS:
@@ -174,16 +535,50 @@ def load_image_cv2(file_path: Path, use_cache: bool = True):
     
     # Cache the result
     if use_cache:
-        if len(_image_cache) >= _CACHE_MAX_SIZE:
-            # Remove oldest entries
-            keys_to_remove = list(_image_cache.keys())[:_CACHE_MAX_SIZE // 2]
-            for k in keys_to_remove:
-                del _image_cache[k]
-        _image_cache[cache_key] = result.copy()
+        if _decoded_store_dir is not None:
+            _save_decoded(cache_key, result)
+        return _image_cache.put(cache_key, result)
     
     return result
 
 
+# Кэш хэшей содержимого (LRU): путь -> (mtime_ns, size, hash)
+_hash_cache: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+_hash_cache_lock = threading.Lock()
+HASH_CACHE_MAX_ENTRIES = 100_000
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_content_hash(file_path: Path) -> str:
+    """
+    SHA-256 содержимого файла.
+    
+    Результат запоминается по (mtime, size) - неизменённый файл повторно не читается.
+    """
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    cache_key = str(file_path)
+    
+    with _hash_cache_lock:
+        cached = _hash_cache.get(cache_key)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            _hash_cache.move_to_end(cache_key)
+            return cached[2]
+    
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    
+    content_hash = digest.hexdigest()
+    with _hash_cache_lock:
+        _hash_cache[cache_key] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        _hash_cache.move_to_end(cache_key)
+        while len(_hash_cache) > HASH_CACHE_MAX_ENTRIES:
+            _hash_cache.popitem(last=False)
+    return content_hash
+
+
 def get_image_files(folder_path: Path) -> List[Path]:
     if not folder_path.exists():
         raise ValueError(f"Folder does not exist: {folder_path}")
@@ -14,13 +14,18 @@ logger = logging.getLogger(__name__)
 
 
 class PerspectiveTransformer:
+    # Padding around the destination quad ROI: covers bilinear sampling and the 3x3 alpha blur
+    ROI_PADDING = 4
+
     def __init__(
         self, 
         template_path: Path, 
         corner_points: List[Tuple[int, int]], 
         corner_radius: int = 0, 
         blend_strength: float = 0.25,
-        point_sets: Optional[List[List[Tuple[int, int]]]] = None
+        point_sets: Optional[List[List[Tuple[int, int]]]] = None,
+        scale: float = 1.0,
+        template_image: Optional[np.ndarray] = None
     ):
         """
         Initialize PerspectiveTransformer with support for multiple point sets.
@@ -33,6 +38,11 @@ class PerspectiveTransformer:
             point_sets: Optional list of point sets for multi-area transformation.
                        Each point set is a list of 4 (x, y) tuples.
                        If provided, this takes precedence over corner_points.
+            scale: Render scale (< 1 for fast previews). The template, points and
+                   products are downscaled first and all work happens at that size;
+                   points are given and validated in full template coordinates.
+            template_image: Template pixels already rendered at `scale` (e.g. from a
+                   pre-built pyramid level); template_path is then not decoded.
         """
         self.template_path = Path(template_path)
         
@@ -40,7 +50,10 @@ class PerspectiveTransformer:
             raise FileNotFoundError(f"Template not found: {template_path}")
         
         try:
-            self._template = load_image_cv2(self.template_path)
+            if template_image is not None:
+                self._template = template_image
+            else:
+                self._template = load_image_cv2(self.template_path)
         except Exception as e:
             raise ValueError(f"Failed to load template image: {template_path} - {e}")
         
@@ -62,14 +75,75 @@ class PerspectiveTransformer:
             self.corner_points = corner_points
             self._point_sets = [corner_points]
         
+        self._scale = scale
+        if scale < 1.0:
+            self._scale_points(scale)
+            if template_image is None:
+                self._scale_template(scale)
+        
         self._dst_points = np.float32(self.corner_points)
         self._corner_radius = corner_radius
         self._blend_strength = blend_strength
 
+    def _scale_template(self, scale: float):
+        """Downscale the template to the render scale."""
+        width = max(1, round(self._template_width * scale))
+        height = max(1, round(self._template_height * scale))
+        self._template = cv2.resize(self._template, (width, height), interpolation=cv2.INTER_AREA)
+        self._template_height, self._template_width = height, width
+
+    def _scale_points(self, scale: float):
+        """Scale all point sets to the render scale."""
+        self._point_sets = [[(x * scale, y * scale) for x, y in ps] for ps in self._point_sets]
+        self.corner_points = self._point_sets[0]
+
     @staticmethod
     def compute_transform_matrix(src_points: np.ndarray, dst_points: np.ndarray) -> np.ndarray:
         return cv2.getPerspectiveTransform(src_points, dst_points)
 
+    @staticmethod
+    def alpha_blend(
+        dst: np.ndarray,
+        src: np.ndarray,
+        offset: Tuple[int, int] = (0, 0),
+        update_alpha: bool = False
+    ) -> np.ndarray:
+        """
+        Composite a BGRA image over dst in place: dst = (a * src + (255 - a) * dst) / 255.
+        
+        All channels are blended at once with saturating uint8 cv2 ops
+        (no float32 temporaries); dst alpha is preserved.
+        
+        Args:
+            dst: Destination BGRA image (modified in place)
+            src: Source BGRA image or ROI
+            offset: (x, y) position of src in dst
+            update_alpha: Set dst alpha to max(dst alpha, src alpha) instead of preserving it
+            
+        Returns:
+            dst
+        """
+        x, y = offset
+        h, w = src.shape[:2]
+        if h == 0 or w == 0:
+            return dst
+        region = dst[y:y + h, x:x + w]
+        
+        src_alpha = src[:, :, 3]
+        dst_alpha = region[:, :, 3].copy()
+        
+        alpha = cv2.merge((src_alpha, src_alpha, src_alpha, src_alpha))
+        foreground = cv2.multiply(src, alpha, scale=1 / 255)
+        cv2.bitwise_not(alpha, dst=alpha)
+        cv2.multiply(region, alpha, dst=region, scale=1 / 255)
+        cv2.add(region, foreground, dst=region)
+        
+        if update_alpha:
+            np.maximum(dst_alpha, src_alpha, out=dst_alpha)
+        region[:, :, 3] = dst_alpha
+        
+        return dst
+
     def _create_rounded_mask(self, width: int, height: int, radius: int) -> np.ndarray:
         mask = np.zeros((height, width), dtype=np.uint8)
         
@@ -90,7 +164,8 @@ class PerspectiveTransformer:
         mask = cv2.GaussianBlur(mask, (3, 3), 0)
         return mask
     
-    def _warp_product(self, product: np.ndarray) -> np.ndarray:
+    def _prepare_product(self, product: np.ndarray) -> np.ndarray:
+        """Convert product to BGRA and apply rounded corners to its alpha."""
         h, w = product.shape[:2]
         
         if len(product.shape) == 2:
@@ -110,11 +185,53 @@ class PerspectiveTransformer:
             mask_float = mask.astype(np.float32) / 255.0
             product[:, :, 3] = (alpha * mask_float).astype(np.uint8)
         
+        return product
+
+    def _destination_roi(self, dst_points: np.ndarray) -> Tuple[int, int, int, int]:
+        """
+        Bounding box (x0, y0, x1, y1) of the destination quad, padded and clipped to the template.
+        """
+        pad = self.ROI_PADDING
+        x0 = max(0, int(np.floor(dst_points[:, 0].min())) - pad)
+        y0 = max(0, int(np.floor(dst_points[:, 1].min())) - pad)
+        x1 = min(self._template_width, int(np.ceil(dst_points[:, 0].max())) + 1 + pad)
+        y1 = min(self._template_height, int(np.ceil(dst_points[:, 1].max())) + 1 + pad)
+        return x0, y0, max(x0, x1), max(y0, y1)
+
+    def _warp_product_roi(self, product: np.ndarray, dst_points: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        Warp a product image into the bounding box of the destination points only.
+        
+        Args:
+            product: Product image
+            dst_points: Destination points as np.float32 array of shape (4, 2)
+            
+        Returns:
+            Tuple of (warped ROI in BGRA format, (x, y) offset of the ROI in the template)
+        """
+        if self._scale < 1.0:
+            # Уменьшаем коврик в том же масштабе, что и шаблон
+            ph, pw = product.shape[:2]
+            product = cv2.resize(
+                product, (max(1, round(pw * self._scale)), max(1, round(ph * self._scale))),
+                interpolation=cv2.INTER_AREA
+            )
+        h, w = product.shape[:2]
+        product = self._prepare_product(product)
+        
         src_points = np.float32([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]])
-        matrix = self.compute_transform_matrix(src_points, self._dst_points)
+        matrix = self.compute_transform_matrix(src_points, dst_points)
+        
+        # Сдвигаем гомографию так, чтобы левый верхний угол ROI стал началом координат
+        x0, y0, x1, y1 = self._destination_roi(dst_points)
+        if x1 <= x0 or y1 <= y0:
+            # Четырёхугольник целиком вне шаблона (точки не проверяются на границы) -
+            # пустой ROI; warpPerspective с нулевым dsize вернул бы массив размера исходника
+            return np.zeros((0, 0, 4), dtype=np.uint8), (0, 0)
+        translation = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
         
         warped = cv2.warpPerspective(
-            product, matrix, (self._template_width, self._template_height),
+            product, translation @ matrix, (x1 - x0, y1 - y0),
             flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0)
         )
         
@@ -123,7 +240,18 @@ class PerspectiveTransformer:
         if self._corner_radius > 0:
             warped[:, :, 3] = cv2.GaussianBlur(alpha, (3, 3), 0.5)
         
-        return warped
+        return warped, (x0, y0)
+
+    def _place_roi(self, roi: np.ndarray, offset: Tuple[int, int]) -> np.ndarray:
+        """Place a warped ROI on a transparent template-sized canvas."""
+        x, y = offset
+        h, w = roi.shape[:2]
+        canvas = np.zeros((self._template_height, self._template_width, 4), dtype=np.uint8)
+        canvas[y:y + h, x:x + w] = roi
+        return canvas
+
+    def _warp_product(self, product: np.ndarray) -> np.ndarray:
+        return self._warp_product_to_points(product, self._dst_points)
 
     def _apply_color_blend(self, product: np.ndarray, template: np.ndarray, blend_strength: float = 0.15) -> np.ndarray:
         if blend_strength <= 0:
@@ -150,7 +278,25 @@ class PerspectiveTransformer:
         ).astype(np.uint8)
         return result
 
-    def _composite_with_alpha(self, template: np.ndarray, product: np.ndarray, blend_strength: float = 0.15) -> np.ndarray:
+    def _composite_with_alpha(
+        self,
+        template: np.ndarray,
+        product: np.ndarray,
+        blend_strength: float = 0.15,
+        offset: Tuple[int, int] = (0, 0)
+    ) -> np.ndarray:
+        """
+        Composite product over template.
+        
+        Args:
+            template: Template image (BGR or BGRA)
+            product: Product image, either full-size or an ROI
+            blend_strength: Strength of color blending with template
+            offset: (x, y) position of product in the template
+            
+        Returns:
+            Composited image in BGRA format
+        """
         if template.shape[2] == 3:
             template = cv2.cvtColor(template, cv2.COLOR_BGR2BGRA)
         else:
@@ -162,12 +308,9 @@ class PerspectiveTransformer:
             product_bgra = product
         
         product_bgra = self._apply_color_blend(product_bgra, template, blend_strength)
-        alpha = product_bgra[:, :, 3].astype(np.float32) / 255.0
-        
-        for c in range(3):
-            template[:, :, c] = (alpha * product_bgra[:, :, c].astype(np.float32) + (1 - alpha) * template[:, :, c].astype(np.float32)).astype(np.uint8)
         
-        return template
+        # Смешиваем только область продукта
+        return self.alpha_blend(template, product_bgra, offset)
 
     def _warp_product_to_points(self, product: np.ndarray, dst_points: np.ndarray) -> np.ndarray:
         """
@@ -180,39 +323,8 @@ class PerspectiveTransformer:
         Returns:
             Warped product image in BGRA format
         """
-        h, w = product.shape[:2]
-        
-        if len(product.shape) == 2:
-            product = cv2.cvtColor(product, cv2.COLOR_GRAY2BGRA)
-        elif product.shape[2] == 3:
-            product = cv2.cvtColor(product, cv2.COLOR_BGR2BGRA)
-        else:
-            product = product.copy()
-        
-        if self._corner_radius > 0:
-            min_dim = min(w, h)
-            scaled_radius = int((self._corner_radius / 2000.0) * min_dim)
-            scaled_radius = max(scaled_radius, 3)
-            
-            mask = self._create_rounded_mask(w, h, scaled_radius)
-            alpha = product[:, :, 3].astype(np.float32)
-            mask_float = mask.astype(np.float32) / 255.0
-            product[:, :, 3] = (alpha * mask_float).astype(np.uint8)
-        
-        src_points = np.float32([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]])
-        matrix = self.compute_transform_matrix(src_points, dst_points)
-        
-        warped = cv2.warpPerspective(
-            product, matrix, (self._template_width, self._template_height),
-            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0)
-        )
-        
-        # Simple edge smoothing
-        alpha = warped[:, :, 3]
-        if self._corner_radius > 0:
-            warped[:, :, 3] = cv2.GaussianBlur(alpha, (3, 3), 0.5)
-        
-        return warped
+        roi, offset = self._warp_product_roi(product, dst_points)
+        return self._place_roi(roi, offset)
 
     def transform_multiple(self, product_paths: List[Optional[Path]]) -> Tuple[np.ndarray, List[Tuple[str, str]]]:
         """
@@ -287,19 +399,14 @@ class PerspectiveTransformer:
                 
                 # Warp product to this point set's destination
                 dst_points = np.float32(point_set)
-                warped = self._warp_product_to_points(product, dst_points)
+                warped, (x, y) = self._warp_product_roi(product, dst_points)
                 
                 # Apply color blend
                 if self._blend_strength > 0:
                     warped = self._apply_color_blend(warped, result, self._blend_strength)
                 
-                # Composite onto result
-                alpha = warped[:, :, 3].astype(np.float32) / 255.0
-                for c in range(3):
-                    result[:, :, c] = (
-                        alpha * warped[:, :, c].astype(np.float32) + 
-                        (1 - alpha) * result[:, :, c].astype(np.float32)
-                    ).astype(np.uint8)
+                # Composite onto result (ROI only)
+                self.alpha_blend(result, warped, (x, y))
                     
             except Exception as e:
                 # Log error and continue with remaining point sets (Requirement 6.4)
@@ -330,13 +437,13 @@ class PerspectiveTransformer:
         elif product.shape[2] == 3:
             product = cv2.cvtColor(product, cv2.COLOR_BGR2BGRA)
         
-        warped = self._warp_product(product)
+        warped, offset = self._warp_product_roi(product, self._dst_points)
         
-        # Применяем color blend если нужно
+        # Применяем color blend если нужно (только к ROI)
         if apply_blend and self._blend_strength > 0:
             warped = self._apply_color_blend(warped, self._template, self._blend_strength)
         
-        return warped
+        return self._place_roi(warped, offset)
 
     def transform_product(self, product_path: Path) -> np.ndarray:
         product_path = Path(product_path)
@@ -354,8 +461,8 @@ class PerspectiveTransformer:
         elif product.shape[2] == 3:
             product = cv2.cvtColor(product, cv2.COLOR_BGR2BGRA)
         
-        warped = self._warp_product(product)
-        return self._composite_with_alpha(self._template, warped, self._blend_strength)
+        warped, offset = self._warp_product_roi(product, self._dst_points)
+        return self._composite_with_alpha(self._template, warped, self._blend_strength, offset)
 
     def get_preview(self, product_path: Path, max_size: int = 500) -> Image.Image:
         result = self.transform_product(product_path)
@@ -5,7 +5,7 @@
 """
 from pathlib import Path
 from typing import Tuple, Optional, Dict, List
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from PIL import Image
 import numpy as np
 import colorsys
@@ -16,15 +16,32 @@ from src.skin_detector import SkinDetector
 from src.soft_mask_generator import SoftMaskGenerator
 
 
+@dataclass
+class RecolorPlan:
+    """
+    Независимая от целевого цвета часть перекрашивания слоя.
+    
+    Между карточками меняется только target_color, поэтому маски, HSV
+    и доминантный hue считаются один раз на слой шаблона.
+    """
+    pixels: np.ndarray   # Исходные пиксели RGB/RGBA (uint8)
+    hsv: np.ndarray      # HSV в формате OpenCV (uint8)
+    mask: np.ndarray     # Финальная маска перекрашивания 0-255 (с feathering и альфой)
+    dominant_hue: float  # Доминантный hue цветных пикселей (0-180)
+    has_color: bool      # Есть ли что перекрашивать
+
+
 @dataclass
 class LayerRenderResult:
     """Результат рендеринга одного слоя."""
     layer_name: str
     success: bool
-    image: Optional[Image.Image]
+    image: Optional[Image.Image]  # Фрагмент холста (tile), а не полный холст
     error: Optional[str]
-    method_used: str  # 'composite', 'topil', 'recursive', 'pixel_data', 'none'
+    method_used: str  # 'composite', 'topil', 'recursive', 'pixel_data', 'flattened', 'none'
     is_photo: bool = False
+    recolor_plan: Optional[RecolorPlan] = None  # Кэш масок для перекрашивания
+    offset: Tuple[int, int] = (0, 0)  # Позиция левого верхнего угла фрагмента на холсте
 
 
 @dataclass
@@ -35,6 +52,27 @@ class PSDRenderResult:
     fallback_used: bool
     final_image: Optional[Image.Image] = None
 
+
+@dataclass
+class PreparedPSDTemplate:
+    """
+    Подготовленный PSD шаблон.
+    
+    Слои рендерятся один раз на шаблон и переиспользуются для всех карточек
+    пакета - на каждую карточку остаются только перекрашивание и композиция.
+    """
+    template_path: Path
+    psd: object
+    width: int
+    height: int
+    product_layer: Optional[object]
+    before_product: List[LayerRenderResult]
+    after_product: List[LayerRenderResult]
+    failed_layers: List[LayerRenderResult]
+    render_mode: str  # 'layer_by_layer', 'hybrid', 'composite_fallback'
+    composite: Optional[Image.Image] = None  # psd.composite() для hybrid/fallback режимов
+    composite_recolor_plan: Optional[RecolorPlan] = None  # Кэш масок композита
+
 # Настройка логирования для модуля
 logger = logging.getLogger(__name__)
 
@@ -70,6 +108,10 @@ class PSDProcessor:
     COLOR_MASK_THRESHOLD = 128        # Порог для маски цветных пикселей
     HUE_RANGE = 180                   # Диапазон hue в OpenCV HSV
     
+    # Отступ вокруг фрагмента слоя (tile). Должен перекрывать радиус всех размытий
+    # масок перекрашивания, чтобы результат на фрагменте совпадал с полным холстом
+    TILE_PADDING = 16
+    
     # Порог для определения режима рендеринга
     # Если отрендерилось меньше этой доли слоёв - используем hybrid/fallback
     PARTIAL_RENDER_THRESHOLD = 0.5  # 50% слоёв
@@ -78,12 +120,36 @@ class PSDProcessor:
     _psd_cache: Dict[str, 'PSDImage'] = {}
     _PSD_CACHE_MAX_SIZE = 10
     
-    def __init__(self):
+    # Максимум подготовленных шаблонов (по числу шаблонов в приложении)
+    _PREPARED_CACHE_MAX_SIZE = 10
+    
+    # Движки перекрашивания:
+    # - 'float': hue shift и смешивание во float32 (эталонный)
+    # - 'lut': hue shift через таблицу cv2.LUT и смешивание в uint8 (отличие <= 1 уровня)
+    RECOLOR_ENGINES = ('float', 'lut')
+    
+    def __init__(self, flatten_layers: bool = False, recolor_engine: str = 'float'):
+        """
+        Args:
+            flatten_layers: Склеивать подряд идущие не-фото слои в одну плоскость
+                при подготовке шаблона. Перекрашивание тогда выполняется один раз
+                на плоскость, а не на слой (доминантный hue считается по плоскости,
+                поэтому результат может немного отличаться от послойного).
+            recolor_engine: Движок перекрашивания - 'float' или 'lut'
+        """
         if not PSD_AVAILABLE:
             raise ImportError("psd-tools не установлен")
         
+        if recolor_engine not in self.RECOLOR_ENGINES:
+            raise ValueError(f"Unknown recolor engine: {recolor_engine}")
+        
+        self._flatten_layers = flatten_layers
+        self._recolor_engine = recolor_engine
+        
         # Instance-level cache (не shared между экземплярами)
         self._cache: Dict[str, Tuple] = {}
+        # Подготовленные шаблоны: ключ - путь + mtime + размер файла
+        self._prepared_cache: Dict[str, PreparedPSDTemplate] = {}
         
         # Инициализируем детекторы
         self._skin_detector = SkinDetector(feather_radius=5)
@@ -95,10 +161,19 @@ class PSDProcessor:
             feather_radius=5
         )
     
+    @staticmethod
+    def _template_cache_key(template_path: Path) -> str:
+        """Ключ кэша шаблона: путь + mtime + размер (изменённый файл не берётся из кэша)."""
+        try:
+            stat = Path(template_path).stat()
+            return f"{template_path}:{stat.st_mtime_ns}:{stat.st_size}"
+        except OSError:
+            return str(template_path)
+    
     @classmethod
     def _get_cached_psd(cls, template_path: Path) -> 'PSDImage':
         """Get PSD from cache or load it."""
-        key = str(template_path)
+        key = cls._template_cache_key(template_path)
         if key not in cls._psd_cache:
             if len(cls._psd_cache) >= cls._PSD_CACHE_MAX_SIZE:
                 # Remove oldest entry
@@ -113,6 +188,151 @@ class PSDProcessor:
         # Статический метод для вызова без экземпляра
         pass  # Кэш теперь instance-level, этот метод для совместимости
     
+    def clear_prepared_templates(self):
+        """Очищает кэш подготовленных шаблонов."""
+        self._prepared_cache.clear()
+    
+    def prepare_template(self, template_path: Path, scale: float = 1.0) -> Optional[PreparedPSDTemplate]:
+        """
+        Возвращает подготовленный шаблон из кэша или рендерит его.
+        
+        Рендеринг слоёв, размещение на холсте и детекция фото-слоёв
+        не зависят от принта и цвета, поэтому выполняются один раз на шаблон.
+        
+        Args:
+            template_path: Путь к PSD шаблону
+            scale: Масштаб (< 1 - уменьшенная копия слоёв для быстрого предпросмотра)
+            
+        Returns:
+            Подготовленный шаблон; None, если шаблон нельзя уменьшить (режим не layer_by_layer)
+        """
+        key = self._template_cache_key(template_path)
+        if scale < 1.0:
+            key = f"{key}@{scale:.4f}"
+        if key in self._prepared_cache:
+            # LRU: переносим в конец как недавно использованный
+            prepared = self._prepared_cache[key] = self._prepared_cache.pop(key)
+            return prepared
+        
+        if scale < 1.0:
+            prepared = self._scale_prepared_template(self.prepare_template(template_path), scale)
+        else:
+            prepared = self._build_prepared_template(Path(template_path))
+        
+        if len(self._prepared_cache) >= self._PREPARED_CACHE_MAX_SIZE:
+            oldest_key = next(iter(self._prepared_cache))
+            del self._prepared_cache[oldest_key]
+        self._prepared_cache[key] = prepared
+        return prepared
+    
+    def _build_prepared_template(self, template_path: Path) -> PreparedPSDTemplate:
+        """
+        Рендерит все слои шаблона и определяет режим рендеринга.
+        
+        Args:
+            template_path: Путь к PSD шаблону
+            
+        Returns:
+            Подготовленный шаблон
+        """
+        psd = self._get_cached_psd(template_path)
+        width, height = psd.width, psd.height
+        
+        # Находим слой коврика
+        product_layer = self._find_product_layer(psd)
+        
+        # Собираем результаты рендеринга всех слоёв
+        before_product, after_product, failed_layers = self._collect_layer_render_results(
+            psd, width, height, product_layer
+        )
+        
+        # Определяем режим рендеринга
+        render_mode = self._determine_render_mode(before_product, after_product, failed_layers)
+        
+        # Склеиваем не-фото слои в плоскости (после выбора режима - он зависит от числа слоёв)
+        if self._flatten_layers:
+            before_product = self._flatten_layer_results(before_product)
+            after_product = self._flatten_layer_results(after_product)
+        
+        # Для hybrid/fallback режимов композит тоже не зависит от карточки
+        composite = None
+        if render_mode != 'layer_by_layer':
+            try:
+                composite = psd.composite()
+                if composite.mode != 'RGBA':
+                    composite = composite.convert('RGBA')
+            except Exception as e:
+                logger.error(f"Failed to get composite for '{template_path.name}': {type(e).__name__}: {e}")
+        
+        logger.info(
+            f"Prepared template '{template_path.name}': mode={render_mode}, "
+            f"layers before={len(before_product)}, after={len(after_product)}, failed={len(failed_layers)}"
+        )
+        
+        return PreparedPSDTemplate(
+            template_path=template_path,
+            psd=psd,
+            width=width,
+            height=height,
+            product_layer=product_layer,
+            before_product=before_product,
+            after_product=after_product,
+            failed_layers=failed_layers,
+            render_mode=render_mode,
+            composite=composite
+        )
+    
+    def _scale_prepared_template(
+        self,
+        prepared: PreparedPSDTemplate,
+        scale: float
+    ) -> Optional[PreparedPSDTemplate]:
+        """
+        Уменьшенная копия подготовленного шаблона: фрагменты слоёв и их позиции
+        масштабируются один раз, перекрашивание затем идёт на малом размере.
+        
+        Маски перекрашивания пересчитываются на уменьшенных слоях, поэтому
+        результат близок к уменьшенному полному рендеру, но не совпадает побитно.
+        
+        Args:
+            prepared: Подготовленный шаблон в полном размере
+            scale: Масштаб (0 < scale < 1)
+            
+        Returns:
+            Уменьшенный шаблон или None для hybrid/composite_fallback - эти режимы
+            размещают коврик по границам слоёв PSD в полном размере
+        """
+        if prepared.render_mode != 'layer_by_layer':
+            return None
+        
+        def scale_layers(layers: List[LayerRenderResult]) -> List[LayerRenderResult]:
+            scaled = []
+            for layer_result in layers:
+                if layer_result.image is None:
+                    scaled.append(layer_result)
+                    continue
+                x, y = layer_result.offset
+                w, h = layer_result.image.size
+                x0, y0 = round(x * scale), round(y * scale)
+                size = (max(1, round((x + w) * scale) - x0), max(1, round((y + h) * scale) - y0))
+                scaled.append(replace(
+                    layer_result,
+                    image=layer_result.image.resize(size, Image.Resampling.LANCZOS),
+                    offset=(x0, y0),
+                    recolor_plan=None
+                ))
+            return scaled
+        
+        return replace(
+            prepared,
+            width=max(1, round(prepared.width * scale)),
+            height=max(1, round(prepared.height * scale)),
+            before_product=scale_layers(prepared.before_product),
+            after_product=scale_layers(prepared.after_product),
+            composite=None,
+            composite_recolor_plan=None
+        )
+    
     def _collect_layer_render_results(
         self,
         psd,
@@ -154,8 +374,9 @@ class PSDProcessor:
                 product_found = True
                 continue
             
-            # Рендерим слой
-            layer_img = self._render_layer(layer, width, height)
+            # Рендерим слой (фрагмент + позиция на холсте)
+            tile = self._render_layer(layer, width, height)
+            layer_img, offset = tile if tile is not None else (None, (0, 0))
             
             # Определяем метод рендеринга (для диагностики)
             method_used = 'none'
@@ -173,7 +394,8 @@ class PSDProcessor:
                 image=layer_img,
                 error=None if layer_img is not None else "Render failed",
                 method_used=method_used,
-                is_photo=is_photo
+                is_photo=is_photo,
+                offset=offset
             )
             
             if layer_img is None:
@@ -186,6 +408,49 @@ class PSDProcessor:
         
         return before_product, after_product, failed_layers
     
+    def _flatten_layer_results(self, layers: List[LayerRenderResult]) -> List[LayerRenderResult]:
+        """
+        Склеивает подряд идущие не-фото слои в одну плоскость.
+        
+        Фото-слои не перекрашиваются, поэтому разрывают плоскость и остаются
+        отдельными - порядок наложения слоёв сохраняется.
+        
+        Args:
+            layers: Отрендеренные слои в порядке наложения
+            
+        Returns:
+            Список плоскостей и фото-слоёв
+        """
+        flattened: List[LayerRenderResult] = []
+        run: List[LayerRenderResult] = []
+        
+        for layer_result in layers + [None]:
+            if layer_result is not None and not layer_result.is_photo:
+                run.append(layer_result)
+                continue
+            
+            # Конец серии не-фото слоёв - склеиваем её в плоскость
+            if len(run) == 1:
+                flattened.append(run[0])
+            elif run:
+                plane, offset = self._merge_tiles([(lr.image, lr.offset) for lr in run])
+                flattened.append(LayerRenderResult(
+                    layer_name=' + '.join(lr.layer_name for lr in run),
+                    success=True,
+                    image=plane,
+                    error=None,
+                    method_used='flattened',
+                    is_photo=False,
+                    offset=offset
+                ))
+                logger.debug(f"Flattened {len(run)} layers into one plane")
+            run = []
+            
+            if layer_result is not None:
+                flattened.append(layer_result)
+        
+        return flattened
+    
     def _determine_render_mode(
         self,
         before_product: List[LayerRenderResult],
@@ -242,7 +507,8 @@ class PSDProcessor:
         self,
         template_path: Path,
         warped_product: np.ndarray,
-        target_color: Tuple[int, int, int] = None
+        target_color: Tuple[int, int, int] = None,
+        scale: float = 1.0
     ) -> Image.Image:
         """
         Обрабатывает PSD: перекрашивает фон, вставляет коврик (если есть слой коврика).
@@ -255,12 +521,21 @@ class PSDProcessor:
         - layer_by_layer: когда все/большинство слоёв рендерятся успешно
         - hybrid: когда часть слоёв не рендерится - комбинирует с composite
         - composite_fallback: когда ни один слой не рендерится
-        """
-        psd = self._get_cached_psd(template_path)
-        width, height = psd.width, psd.height
         
-        # Находим слой коврика
-        product_layer = self._find_product_layer(psd)
+        Слои шаблона рендерятся один раз и кэшируются (см. prepare_template).
+        
+        При scale < 1 (быстрый предпросмотр) рендер идёт по уменьшенным слоям,
+        warped_product ожидается в том же масштабе.
+        """
+        prepared = self.prepare_template(template_path, scale)
+        if prepared is None:
+            # Шаблон не масштабируется - рендерим в полном размере и уменьшаем результат
+            full = self.prepare_template(template_path)
+            height, width = warped_product.shape[:2]
+            warped_full = cv2.resize(warped_product, (full.width, full.height), interpolation=cv2.INTER_LINEAR)
+            result = self.process_with_warped_product(template_path, warped_full, target_color)
+            return result.resize((width, height), Image.Resampling.LANCZOS)
+        width, height = prepared.width, prepared.height
         
         # Проверяем есть ли реальный warped_product (не пустой)
         has_warped = warped_product is not None and np.any(warped_product[:, :, 3] > 0) if warped_product is not None and len(warped_product.shape) == 3 and warped_product.shape[2] >= 4 else False
@@ -275,26 +550,27 @@ class PSDProcessor:
             # Пустое прозрачное изображение
             warped_pil = Image.new('RGBA', (width, height), (0, 0, 0, 0))
         
-        # Собираем результаты рендеринга всех слоёв
-        before_product, after_product, failed_layers = self._collect_layer_render_results(
-            psd, width, height, product_layer
-        )
-        
-        # Определяем режим рендеринга
-        render_mode = self._determine_render_mode(before_product, after_product, failed_layers)
+        # Маски перекрашивания композита тоже считаются один раз на шаблон
+        if (target_color and prepared.composite is not None
+                and prepared.composite_recolor_plan is None):
+            prepared.composite_recolor_plan = self._prepare_recolor_with_face_protection(prepared.composite)
         
-        # Обрабатываем в зависимости от режима
-        if render_mode == 'composite_fallback':
-            return self._process_with_composite_fallback(psd, warped_pil, target_color, product_layer)
-        elif render_mode == 'hybrid':
+        # Обрабатываем в зависимости от режима (слои уже отрендерены в prepare_template)
+        if prepared.render_mode == 'composite_fallback':
+            return self._process_with_composite_fallback(
+                prepared.psd, warped_pil, target_color, prepared.product_layer,
+                prepared.composite, prepared.composite_recolor_plan
+            )
+        elif prepared.render_mode == 'hybrid':
             return self._process_with_hybrid_fallback(
-                psd, before_product, after_product, failed_layers,
-                warped_pil, target_color, width, height
+                prepared.psd, prepared.before_product, prepared.after_product, prepared.failed_layers,
+                warped_pil, target_color, width, height,
+                prepared.composite, prepared.composite_recolor_plan
             )
         else:
             # layer_by_layer - стандартный режим
             return self._process_layer_by_layer(
-                before_product, after_product, warped_pil, target_color, width, height
+                prepared.before_product, prepared.after_product, warped_pil, target_color, width, height
             )
     
     def _process_layer_by_layer(
@@ -331,8 +607,9 @@ class PSDProcessor:
             layer_img = layer_result.image
             # Перекрашиваем если нужно (кроме фото)
             if target_color and not layer_result.is_photo:
-                layer_img = self._recolor(layer_img, target_color)
-            layers_before = Image.alpha_composite(layers_before, layer_img)
+                layer_img = self._recolor_layer(layer_result, target_color)
+            # Композиция затрагивает только прямоугольник фрагмента
+            layers_before.alpha_composite(layer_img, dest=layer_result.offset)
         
         # Композитим слои после коврика
         for layer_result in after_product:
@@ -341,8 +618,8 @@ class PSDProcessor:
             layer_img = layer_result.image
             # Перекрашиваем если нужно (кроме фото)
             if target_color and not layer_result.is_photo:
-                layer_img = self._recolor(layer_img, target_color)
-            layers_after = Image.alpha_composite(layers_after, layer_img)
+                layer_img = self._recolor_layer(layer_result, target_color)
+            layers_after.alpha_composite(layer_img, dest=layer_result.offset)
         
         # Собираем: фон + слои до + коврик + слои после
         result = Image.alpha_composite(result, layers_before)
@@ -356,7 +633,9 @@ class PSDProcessor:
         psd,
         warped_pil: Image.Image,
         target_color: Optional[Tuple[int, int, int]],
-        product_layer=None
+        product_layer=None,
+        composite: Optional[Image.Image] = None,
+        composite_plan: Optional[RecolorPlan] = None
     ) -> Image.Image:
         """
         Fallback режим - использует psd.composite() когда слои не рендерятся.
@@ -369,6 +648,8 @@ class PSDProcessor:
             warped_pil: Изображение коврика
             target_color: Целевой цвет для перекрашивания
             product_layer: Слой коврика (опционально, для определения позиции)
+            composite: Готовый psd.composite() из подготовленного шаблона (опционально)
+            composite_plan: Кэшированные маски перекрашивания композита (опционально)
             
         Returns:
             Финальное изображение
@@ -376,13 +657,17 @@ class PSDProcessor:
         width, height = psd.width, psd.height
         
         try:
-            composite = psd.composite()
-            if composite.mode != 'RGBA':
-                composite = composite.convert('RGBA')
+            if composite is None:
+                composite = psd.composite()
+                if composite.mode != 'RGBA':
+                    composite = composite.convert('RGBA')
             
             if target_color:
                 # Применяем защиту лиц перед перекрашиванием композита
-                composite = self._recolor_with_face_protection(composite, target_color)
+                if composite_plan is not None:
+                    composite = self._apply_recolor(composite_plan, target_color)
+                else:
+                    composite = self._recolor_with_face_protection(composite, target_color)
             
             # Находим позицию слоя коврика для корректного размещения
             product_bounds = self._get_product_layer_bounds(psd, product_layer)
@@ -513,7 +798,9 @@ class PSDProcessor:
         warped_pil: Image.Image,
         target_color: Optional[Tuple[int, int, int]],
         width: int,
-        height: int
+        height: int,
+        composite: Optional[Image.Image] = None,
+        composite_plan: Optional[RecolorPlan] = None
     ) -> Image.Image:
         """
         Гибридный режим - комбинирует успешно отрендеренные слои с composite.
@@ -534,6 +821,8 @@ class PSDProcessor:
             target_color: Целевой цвет для перекрашивания
             width: Ширина холста
             height: Высота холста
+            composite: Готовый psd.composite() из подготовленного шаблона (опционально)
+            composite_plan: Кэшированные маски перекрашивания композита (опционально)
             
         Returns:
             Финальное изображение
@@ -544,9 +833,10 @@ class PSDProcessor:
         
         # 1. Получаем composite как базу
         try:
-            composite = psd.composite()
-            if composite.mode != 'RGBA':
-                composite = composite.convert('RGBA')
+            if composite is None:
+                composite = psd.composite()
+                if composite.mode != 'RGBA':
+                    composite = composite.convert('RGBA')
         except Exception as e:
             logger.error(f"Failed to get composite in hybrid mode: {e}")
             # Fallback на layer_by_layer если composite не работает
@@ -555,7 +845,9 @@ class PSDProcessor:
             )
         
         # 2. Применяем recoloring с skin protection к composite
-        if target_color:
+        if target_color and composite_plan is not None:
+            composite_recolored = self._apply_recolor(composite_plan, target_color)
+        elif target_color:
             composite_recolored = self._recolor_with_face_protection(composite, target_color)
         else:
             composite_recolored = composite
@@ -572,10 +864,10 @@ class PSDProcessor:
             layer_img = layer_result.image
             # Перекрашиваем если нужно (кроме фото)
             if target_color and not layer_result.is_photo:
-                layer_img = self._recolor(layer_img, target_color)
-            layers_before = Image.alpha_composite(layers_before, layer_img)
+                layer_img = self._recolor_layer(layer_result, target_color)
+            layers_before.alpha_composite(layer_img, dest=layer_result.offset)
             # Добавляем в coverage маску
-            rendered_coverage = Image.alpha_composite(rendered_coverage, layer_result.image)
+            rendered_coverage.alpha_composite(layer_result.image, dest=layer_result.offset)
         
         # 4. Комбинируем: composite (база) + отрендеренные слои поверх
         # Используем альфа-канал отрендеренных слоёв для определения что брать откуда
@@ -593,8 +885,8 @@ class PSDProcessor:
             layer_img = layer_result.image
             # Перекрашиваем если нужно (кроме фото)
             if target_color and not layer_result.is_photo:
-                layer_img = self._recolor(layer_img, target_color)
-            result = Image.alpha_composite(result, layer_img)
+                layer_img = self._recolor_layer(layer_result, target_color)
+            result.alpha_composite(layer_img, dest=layer_result.offset)
         
         logger.info("Used hybrid mode successfully")
         return result
@@ -654,9 +946,14 @@ class PSDProcessor:
         
         return Image.fromarray(result_arr)
     
-    def _render_layer(self, layer, width: int, height: int) -> Optional[Image.Image]:
+    def _render_layer(
+        self,
+        layer,
+        width: int,
+        height: int
+    ) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
         """
-        Рендерит слой в полноразмерное изображение с fallback стратегиями.
+        Рендерит слой во фрагмент холста (tile) с fallback стратегиями.
         
         Стратегии рендеринга (в порядке приоритета):
         1. layer.composite() - стандартный метод
@@ -670,7 +967,7 @@ class PSDProcessor:
             height: Высота целевого изображения
             
         Returns:
-            Отрендеренное изображение слоя или None при ошибке
+            Tuple (фрагмент, (x, y) позиция на холсте) или None при ошибке
         """
         layer_name = getattr(layer, 'name', 'Unknown')
         
@@ -691,7 +988,7 @@ class PSDProcessor:
             if img.mode != 'RGBA':
                 img = img.convert('RGBA')
             
-            # Размещаем на полном холсте
+            # Обрезаем по холсту и добавляем отступ
             return self._place_on_canvas(img, layer, width, height)
             
         except Exception as e:
@@ -815,9 +1112,13 @@ class PSDProcessor:
         layer, 
         width: int, 
         height: int
-    ) -> Optional[Image.Image]:
+    ) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
         """
-        Размещает изображение слоя на полноразмерном холсте.
+        Размещает изображение слоя во фрагменте холста.
+        
+        Вместо полноразмерного холста возвращает прямоугольник слоя с прозрачным
+        отступом TILE_PADDING (в пределах холста) - перекрашивание, детекция
+        кожи и композиция работают только с этим прямоугольником.
         
         Args:
             img: Изображение слоя
@@ -826,11 +1127,10 @@ class PSDProcessor:
             height: Высота холста
             
         Returns:
-            Изображение на полном холсте или None
+            Tuple (фрагмент, (x, y) позиция на холсте) или None
         """
         layer_name = getattr(layer, 'name', 'Unknown')
         
-        full = Image.new('RGBA', (width, height), (0, 0, 0, 0))
         x, y = layer.left, layer.top
         
         # Обрезка если выходит за границы
@@ -847,15 +1147,45 @@ class PSDProcessor:
                 logger.debug(f"Layer '{layer_name}' is completely outside canvas bounds")
                 return None
         
-        full.paste(img, (x, y), img)
-        return full
+        # Фрагмент с отступом, не выходящий за холст
+        tile_l = max(0, x - self.TILE_PADDING)
+        tile_t = max(0, y - self.TILE_PADDING)
+        tile_r = min(width, x + img.width + self.TILE_PADDING)
+        tile_b = min(height, y + img.height + self.TILE_PADDING)
+        
+        tile = Image.new('RGBA', (tile_r - tile_l, tile_b - tile_t), (0, 0, 0, 0))
+        tile.paste(img, (x - tile_l, y - tile_t), img)
+        return tile, (tile_l, tile_t)
+    
+    def _merge_tiles(
+        self,
+        tiles: List[Tuple[Image.Image, Tuple[int, int]]]
+    ) -> Tuple[Image.Image, Tuple[int, int]]:
+        """
+        Накладывает фрагменты по порядку во фрагмент, покрывающий их все.
+        
+        Args:
+            tiles: Список (фрагмент, (x, y) позиция на холсте)
+            
+        Returns:
+            Tuple (объединённый фрагмент, (x, y) позиция на холсте)
+        """
+        left = min(x for _, (x, _) in tiles)
+        top = min(y for _, (_, y) in tiles)
+        right = max(x + img.width for img, (x, _) in tiles)
+        bottom = max(y + img.height for img, (_, y) in tiles)
+        
+        merged = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+        for img, (x, y) in tiles:
+            merged.alpha_composite(img, dest=(x - left, y - top))
+        return merged, (left, top)
     
     def _render_group_layer(
         self, 
         group, 
         width: int, 
         height: int
-    ) -> Optional[Image.Image]:
+    ) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
         """
         Рекурсивно рендерит группу слоёв с поддержкой clipping masks.
         
@@ -865,10 +1195,9 @@ class PSDProcessor:
             height: Высота холста
             
         Returns:
-            Скомпозированное изображение группы или None
+            Tuple (фрагмент группы, (x, y) позиция на холсте) или None
         """
         group_name = getattr(group, 'name', 'Unknown')
-        group_img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
         
         # Собираем все видимые sublayers
         sublayers = [s for s in group if s.visible]
@@ -877,16 +1206,16 @@ class PSDProcessor:
             logger.debug(f"Group '{group_name}' has no visible sublayers")
             return None
         
-        rendered_count = 0
+        rendered_tiles: List[Tuple[Image.Image, Tuple[int, int]]] = []
         clipping_base = None  # Базовый слой для clipping mask
         
         for i, sublayer in enumerate(sublayers):
             sublayer_name = getattr(sublayer, 'name', 'Unknown')
             
             # Рендерим sublayer
-            sub_img = self._render_layer(sublayer, width, height)
+            sub_tile = self._render_layer(sublayer, width, height)
             
-            if sub_img is None:
+            if sub_tile is None:
                 logger.debug(f"Sublayer '{sublayer_name}' in group '{group_name}' returned None")
                 clipping_base = None  # Сбрасываем clipping base
                 continue
@@ -896,22 +1225,22 @@ class PSDProcessor:
             
             if is_clipping and clipping_base is not None:
                 # Применяем clipping mask - используем альфу базового слоя
-                sub_img = self._apply_clipping_mask(sub_img, clipping_base)
+                sub_img, sub_offset = sub_tile
+                sub_tile = (self._apply_clipping_mask(sub_img, clipping_base, sub_offset), sub_offset)
                 logger.debug(f"Applied clipping mask for '{sublayer_name}' to base layer")
             else:
                 # Обычный слой - становится потенциальной базой для clipping
-                clipping_base = sub_img
+                clipping_base = sub_tile
             
-            # Композитим на результат группы
-            group_img = Image.alpha_composite(group_img, sub_img)
-            rendered_count += 1
+            rendered_tiles.append(sub_tile)
         
-        if rendered_count == 0:
+        if not rendered_tiles:
             logger.debug(f"Group '{group_name}' - no sublayers rendered successfully")
             return None
         
-        logger.debug(f"Group '{group_name}' rendered {rendered_count}/{len(sublayers)} sublayers")
-        return group_img
+        logger.debug(f"Group '{group_name}' rendered {len(rendered_tiles)}/{len(sublayers)} sublayers")
+        # Композитим sublayers во фрагмент, покрывающий их все
+        return self._merge_tiles(rendered_tiles)
     
     def _is_clipping_layer(self, layer) -> bool:
         """
@@ -938,32 +1267,44 @@ class PSDProcessor:
     def _apply_clipping_mask(
         self, 
         layer_img: Image.Image, 
-        base_img: Image.Image
+        base_tile: Tuple[Image.Image, Tuple[int, int]],
+        layer_offset: Tuple[int, int] = (0, 0)
     ) -> Image.Image:
         """
         Применяет clipping mask - обрезает слой по альфе базового слоя.
         
         Args:
-            layer_img: Изображение слоя (clipping layer)
-            base_img: Изображение базового слоя
+            layer_img: Фрагмент слоя (clipping layer)
+            base_tile: Tuple (фрагмент базового слоя, (x, y) позиция на холсте)
+            layer_offset: Позиция фрагмента слоя на холсте
             
         Returns:
-            Обрезанное изображение
+            Обрезанный фрагмент
         """
+        base_img, (base_x, base_y) = base_tile
         if layer_img.mode != 'RGBA':
             layer_img = layer_img.convert('RGBA')
         if base_img.mode != 'RGBA':
             base_img = base_img.convert('RGBA')
         
-        # Получаем альфа-канал базового слоя
-        base_arr = np.array(base_img)
         layer_arr = np.array(layer_img)
-        
-        if base_arr.shape[2] < 4 or layer_arr.shape[2] < 4:
+        if layer_arr.shape[2] < 4:
             return layer_img
         
+        # Альфа базового слоя в координатах фрагмента слоя (вне базы - прозрачно)
+        layer_x, layer_y = layer_offset
+        base_alpha_arr = np.zeros(layer_arr.shape[:2], dtype=np.uint8)
+        left = max(layer_x, base_x)
+        top = max(layer_y, base_y)
+        right = min(layer_x + layer_img.width, base_x + base_img.width)
+        bottom = min(layer_y + layer_img.height, base_y + base_img.height)
+        if right > left and bottom > top:
+            base_alpha_arr[top - layer_y:bottom - layer_y, left - layer_x:right - layer_x] = np.array(
+                base_img.getchannel('A').crop((left - base_x, top - base_y, right - base_x, bottom - base_y))
+            )
+        
         # Применяем альфу базового слоя к слою
-        base_alpha = base_arr[:, :, 3].astype(np.float32) / 255.0
+        base_alpha = base_alpha_arr.astype(np.float32) / 255.0
         layer_alpha = layer_arr[:, :, 3].astype(np.float32) / 255.0
         
         # Новая альфа = min(layer_alpha, base_alpha)
@@ -1075,67 +1416,192 @@ class PSDProcessor:
         Returns:
             Перекрашенное изображение с плавными переходами
         """
-        import cv2
+        plan = self._prepare_recolor(image)
+        if plan is None:
+            return image
+        return self._apply_recolor(plan, target_color)
+    
+    def _recolor_layer(
+        self,
+        layer_result: LayerRenderResult,
+        target_color: Tuple[int, int, int]
+    ) -> Image.Image:
+        """
+        Перекрашивает отрендеренный слой, кэшируя маски и HSV в LayerRenderResult.
         
+        Слои подготовленного шаблона переиспользуются между карточками,
+        поэтому независимая от цвета часть считается один раз на слой.
+        
+        Args:
+            layer_result: Результат рендеринга слоя
+            target_color: Целевой цвет RGB
+            
+        Returns:
+            Перекрашенное изображение слоя
+        """
+        if layer_result.recolor_plan is None:
+            layer_result.recolor_plan = self._prepare_recolor(layer_result.image)
+        if layer_result.recolor_plan is None:
+            return layer_result.image
+        return self._apply_recolor(layer_result.recolor_plan, target_color)
+    
+    def _prepare_recolor(self, image: Image.Image) -> Optional[RecolorPlan]:
+        """
+        Вычисляет независимую от целевого цвета часть перекрашивания слоя:
+        HSV, soft color mask, защиту кожи, feathering и доминантный hue.
+        
+        Args:
+            image: Исходное изображение (PIL Image)
+        
+        Returns:
+            RecolorPlan или None если изображение не цветное
+        """
         img_arr = np.array(image)
         if len(img_arr.shape) < 3 or img_arr.shape[2] < 3:
-            return image
+            return None
         
-        rgb = img_arr[:, :, :3].copy()
+        rgb = img_arr[:, :, :3]
         alpha = img_arr[:, :, 3] if img_arr.shape[2] == 4 else None
         
-        # Конвертируем в HSV
-        hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV).astype(np.float32)
-        
-        # Целевой hue (OpenCV использует 0-180 для H)
-        target_h, _, _ = rgb_to_hsv(*target_color)
-        target_hue = target_h * 180
+        # Конвертируем в HSV (uint8 - без потерь относительно float32 копии)
+        hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
         
         # 1. Создаём soft color mask (какие пиксели перекрашивать)
-        color_mask = self._mask_generator.create_color_mask(hsv.astype(np.uint8))
+        color_mask = self._mask_generator.create_color_mask(hsv)
         
         # 2. Создаём skin protection mask (какие пиксели защищать)
         skin_mask = self._skin_detector.detect_skin_mask(rgb, feather_radius=5)
         
-        # 3. Комбинируем маски: color_mask * (1 - skin_mask/255)
+        # 3-4. Комбинируем маски и применяем feathering
+        mask = self._combine_recolor_masks(color_mask, skin_mask, alpha)
+        
+        # 5. Вычисляем доминантный hue из цветных пикселей для расчёта сдвига
+        dominant_hue = self._get_dominant_hue(hsv.astype(np.float32), color_mask)
+        
+        return RecolorPlan(
+            pixels=img_arr,
+            hsv=hsv,
+            mask=mask,
+            dominant_hue=dominant_hue,
+            has_color=bool(np.any(mask))
+        )
+    
+    def _combine_recolor_masks(
+        self,
+        color_mask: np.ndarray,
+        skin_mask: np.ndarray,
+        alpha: Optional[np.ndarray]
+    ) -> np.ndarray:
+        """
+        Комбинирует маски: color_mask * (1 - skin_mask/255), затем feathering.
+        
+        Args:
+            color_mask: Soft mask цветных пикселей (0-255)
+            skin_mask: Маска защиты кожи (0-255)
+            alpha: Альфа-канал слоя (учитываются только видимые пиксели)
+            
+        Returns:
+            Финальная маска перекрашивания (0-255)
+        """
         color_mask_float = color_mask.astype(np.float32) / 255.0
         skin_mask_float = skin_mask.astype(np.float32) / 255.0
         final_mask = color_mask_float * (1.0 - skin_mask_float)
         
-        # 4. Применяем feathering к финальной маске
         final_mask_uint8 = (final_mask * 255).astype(np.uint8)
         final_mask_feathered = self._mask_generator.apply_feathering(final_mask_uint8, radius=5)
-        final_mask_float = final_mask_feathered.astype(np.float32) / 255.0
         
         # Если есть альфа - учитываем только видимые пиксели
         if alpha is not None:
-            alpha_mask = (alpha > 20).astype(np.float32)
-            final_mask_float = final_mask_float * alpha_mask
+            final_mask_feathered[alpha <= self.ALPHA_VISIBILITY_THRESHOLD] = 0
         
-        # 5. Вычисляем доминантный hue из цветных пикселей для расчёта сдвига
-        dominant_hue = self._get_dominant_hue(hsv, color_mask)
+        return final_mask_feathered
+    
+    def _apply_recolor(self, plan: RecolorPlan, target_color: Tuple[int, int, int]) -> Image.Image:
+        """
+        Применяет hue shift к подготовленному слою и смешивает с оригиналом по маске.
+        
+        Args:
+            plan: Подготовленные данные перекрашивания
+            target_color: Целевой цвет RGB
+            
+        Returns:
+            Перекрашенное изображение
+        """
+        # Нечего перекрашивать - оригинал не меняется
+        if not plan.has_color:
+            return Image.fromarray(plan.pixels)
+        
+        # Целевой hue (OpenCV использует 0-180 для H)
+        target_h, _, _ = rgb_to_hsv(*target_color)
+        target_hue = target_h * 180
         
         # 6. Вычисляем hue shift (сдвиг) вместо замены
-        hue_shift = target_hue - dominant_hue
+        hue_shift = target_hue - plan.dominant_hue
+        
+        if self._recolor_engine == 'lut':
+            rgb_result = self._apply_hue_shift_lut(plan, hue_shift)
+        else:
+            rgb_result = self._apply_hue_shift_float(plan, hue_shift)
+        
+        if plan.pixels.shape[2] == 4:
+            return Image.fromarray(np.dstack([rgb_result, plan.pixels[:, :, 3]]))
+        return Image.fromarray(rgb_result)
+    
+    def _apply_hue_shift_float(self, plan: RecolorPlan, hue_shift: float) -> np.ndarray:
+        """
+        Hue shift и смешивание с оригиналом во float32.
+        
+        Args:
+            plan: Подготовленные данные перекрашивания
+            hue_shift: Сдвиг hue (в единицах OpenCV, 0-180)
+            
+        Returns:
+            Перекрашенные RGB пиксели
+        """
+        rgb = plan.pixels[:, :, :3]
         
-        # 7. Применяем hue shift к оригинальным значениям
-        hsv_recolored = hsv.copy()
-        new_hue = (hsv[:, :, 0] + hue_shift) % 180  # Циклический сдвиг в диапазоне 0-180
-        hsv_recolored[:, :, 0] = new_hue
+        # 7. Применяем hue shift к оригинальным значениям (S и V не меняются)
+        hsv_recolored = plan.hsv.copy()
+        new_hue = (plan.hsv[:, :, 0].astype(np.float32) + hue_shift) % 180  # Циклический сдвиг в диапазоне 0-180
+        hsv_recolored[:, :, 0] = np.clip(new_hue, 0, 255).astype(np.uint8)
         
         # 8. Blend с оригиналом по маске (плавное смешивание) - в RGB пространстве!
-        # Конвертируем обе версии в RGB для корректного смешивания
-        hsv_recolored_uint8 = np.clip(hsv_recolored, 0, 255).astype(np.uint8)
-        rgb_recolored = cv2.cvtColor(hsv_recolored_uint8, cv2.COLOR_HSV2RGB)
+        rgb_recolored = cv2.cvtColor(hsv_recolored, cv2.COLOR_HSV2RGB)
         
         # Смешиваем в RGB пространстве для избежания артефактов на границах hue
-        mask_3d = final_mask_float[:, :, np.newaxis]
+        mask_3d = (plan.mask.astype(np.float32) / 255.0)[:, :, np.newaxis]
         rgb_blended = rgb_recolored.astype(np.float32) * mask_3d + rgb.astype(np.float32) * (1.0 - mask_3d)
-        rgb_result = np.clip(rgb_blended, 0, 255).astype(np.uint8)
+        return np.clip(rgb_blended, 0, 255).astype(np.uint8)
+    
+    def _apply_hue_shift_lut(self, plan: RecolorPlan, hue_shift: float) -> np.ndarray:
+        """
+        Hue shift через таблицу и смешивание с оригиналом в uint8.
         
-        if alpha is not None:
-            return Image.fromarray(np.dstack([rgb_result, alpha]))
-        return Image.fromarray(rgb_result)
+        Для фиксированного сдвига новый hue зависит только от старого, поэтому
+        сдвиг считается один раз для 256 значений и применяется одним cv2.LUT
+        ко всему HSV (S и V проходят через тождественную таблицу).
+        
+        Args:
+            plan: Подготовленные данные перекрашивания
+            hue_shift: Сдвиг hue (в единицах OpenCV, 0-180)
+            
+        Returns:
+            Перекрашенные RGB пиксели
+        """
+        rgb = plan.pixels[:, :, :3]
+        
+        # Та же арифметика что и во float движке, но для 256 значений вместо всех пикселей
+        hue_table = np.clip((np.arange(256, dtype=np.float32) + hue_shift) % self.HUE_RANGE, 0, 255).astype(np.uint8)
+        identity = np.arange(256, dtype=np.uint8)
+        lut = np.dstack([hue_table, identity, identity])  # 1x256x3
+        
+        rgb_recolored = cv2.cvtColor(cv2.LUT(plan.hsv, lut), cv2.COLOR_HSV2RGB)
+        
+        # rgb_recolored * mask/255 + rgb * (255 - mask)/255
+        mask_3ch = cv2.merge([plan.mask, plan.mask, plan.mask])
+        recolored_part = cv2.multiply(rgb_recolored, mask_3ch, scale=1.0 / 255.0)
+        original_part = cv2.multiply(rgb, cv2.bitwise_not(mask_3ch), scale=1.0 / 255.0)
+        return cv2.add(recolored_part, original_part)
     
     def _get_dominant_hue(self, hsv: np.ndarray, color_mask: np.ndarray) -> float:
         """
@@ -1193,13 +1659,26 @@ class PSDProcessor:
         Returns:
             Перекрашенное изображение с защищёнными областями лиц
         """
-        import cv2
+        plan = self._prepare_recolor_with_face_protection(image)
+        if plan is None:
+            return image
+        return self._apply_recolor(plan, target_color)
+    
+    def _prepare_recolor_with_face_protection(self, image: Image.Image) -> Optional[RecolorPlan]:
+        """
+        Вычисляет независимую от цвета часть перекрашивания композита с защитой лиц.
         
+        Args:
+            image: Композитное изображение PSD (PIL Image)
+            
+        Returns:
+            RecolorPlan или None если изображение не цветное
+        """
         img_arr = np.array(image)
         if len(img_arr.shape) < 3 or img_arr.shape[2] < 3:
-            return image
+            return None
         
-        rgb = img_arr[:, :, :3].copy()
+        rgb = img_arr[:, :, :3]
         alpha = img_arr[:, :, 3] if img_arr.shape[2] == 4 else None
         
         # Создаём маску защиты кожи для всего композита
@@ -1209,56 +1688,28 @@ class PSDProcessor:
         logger.debug(f"Composite fallback: detected {skin_percentage:.1%} skin content")
         
         # Если много кожи - усиливаем защиту
-        if skin_percentage > 0.1:  # >10% кожи
+        if skin_percentage > self.HIGH_SKIN_PERCENTAGE:
             kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-            skin_mask = cv2.dilate(skin_mask, kernel, iterations=2)
+            skin_mask = cv2.dilate(skin_mask, kernel, iterations=self.DILATE_ITERATIONS)
             skin_mask = self._mask_generator.apply_feathering(skin_mask, radius=7)
         
-        # Конвертируем в HSV
-        hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV).astype(np.float32)
-        
-        # Целевой hue
-        target_h, _, _ = rgb_to_hsv(*target_color)
-        target_hue = target_h * 180
+        # Конвертируем в HSV и создаём soft color mask
+        hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
+        color_mask = self._mask_generator.create_color_mask(hsv)
         
-        # Создаём soft color mask
-        color_mask = self._mask_generator.create_color_mask(hsv.astype(np.uint8))
+        # Комбинируем маски с защитой кожи и применяем feathering
+        mask = self._combine_recolor_masks(color_mask, skin_mask, alpha)
         
-        # Комбинируем маски с защитой кожи
-        color_mask_float = color_mask.astype(np.float32) / 255.0
-        skin_mask_float = skin_mask.astype(np.float32) / 255.0
-        final_mask = color_mask_float * (1.0 - skin_mask_float)
+        # Доминантный hue для HUE SHIFT
+        dominant_hue = self._get_dominant_hue(hsv.astype(np.float32), color_mask)
         
-        # Применяем feathering
-        final_mask_uint8 = (final_mask * 255).astype(np.uint8)
-        final_mask_feathered = self._mask_generator.apply_feathering(final_mask_uint8, radius=5)
-        final_mask_float = final_mask_feathered.astype(np.float32) / 255.0
-        
-        # Учитываем альфа-канал
-        if alpha is not None:
-            alpha_mask = (alpha > 20).astype(np.float32)
-            final_mask_float = final_mask_float * alpha_mask
-        
-        # Вычисляем доминантный hue и делаем HUE SHIFT
-        dominant_hue = self._get_dominant_hue(hsv, color_mask)
-        hue_shift = target_hue - dominant_hue
-        
-        # Применяем hue shift
-        hsv_recolored = hsv.copy()
-        new_hue = (hsv[:, :, 0] + hue_shift) % 180
-        hsv_recolored[:, :, 0] = new_hue
-        
-        # Blend в RGB пространстве
-        hsv_recolored_uint8 = np.clip(hsv_recolored, 0, 255).astype(np.uint8)
-        rgb_recolored = cv2.cvtColor(hsv_recolored_uint8, cv2.COLOR_HSV2RGB)
-        
-        mask_3d = final_mask_float[:, :, np.newaxis]
-        rgb_blended = rgb_recolored.astype(np.float32) * mask_3d + rgb.astype(np.float32) * (1.0 - mask_3d)
-        rgb_result = np.clip(rgb_blended, 0, 255).astype(np.uint8)
-        
-        if alpha is not None:
-            return Image.fromarray(np.dstack([rgb_result, alpha]))
-        return Image.fromarray(rgb_result)
+        return RecolorPlan(
+            pixels=img_arr,
+            hsv=hsv,
+            mask=mask,
+            dominant_hue=dominant_hue,
+            has_color=bool(np.any(mask))
+        )
     
     def _find_product_layer(self, psd):
         """
@@ -0,0 +1,18 @@
+import sys
+import atexit
+import shutil
+import tempfile
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.app import config
+
+# Модули бэкенда создают глобальные хранилища при импорте (storage.json, marketplace_cards.db,
+# generation_queue.db в BASE_DIR) - подменяем BASE_DIR до их импорта, чтобы тесты
+# не трогали рабочие данные и не мигрировали marketplace_cards.json разработчика
+_data_dir = Path(tempfile.mkdtemp(prefix='test-data-'))
+config.BASE_DIR = _data_dir
+# Регистрируется раньше сброса Storage при выходе, поэтому выполняется после него
+atexit.register(shutil.rmtree, _data_dir, ignore_errors=True)
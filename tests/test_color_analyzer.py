@@ -0,0 +1,55 @@
+"""The histogram colour engine agrees with the KMeans engine on synthetic prints."""
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.color_analyzer import ColorAnalyzer
+
+# CIE76 ΔE: ~2.3 - порог заметности, до 5 - тот же цвет «на глаз»
+MAX_DELTA_E = 5.0
+
+
+def delta_e(color_a, color_b) -> float:
+    """CIE76 distance between two sRGB colours."""
+    lab = cv2.cvtColor(np.array([[color_a, color_b]], dtype=np.float32) / 255, cv2.COLOR_RGB2Lab)[0]
+    return float(np.linalg.norm(lab[0] - lab[1]))
+
+
+def solid_print() -> np.ndarray:
+    return np.full((120, 120, 3), (200, 60, 40), dtype=np.uint8)
+
+
+def two_colour_print() -> np.ndarray:
+    # 70% синего слева, 30% жёлтого справа
+    image = np.empty((120, 120, 3), dtype=np.uint8)
+    image[:, :84] = (40, 90, 180)
+    image[:, 84:] = (230, 200, 40)
+    return image
+
+
+def noisy_gradient_print() -> np.ndarray:
+    t = np.linspace(0, 1, 160)[None, :, None]
+    row = (1 - t) * np.array([30, 140, 60]) + t * np.array([60, 170, 90])
+    noise = np.random.default_rng(0).normal(0, 8, (120, 160, 3))
+    return np.clip(np.repeat(row, 120, axis=0) + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('make_print', [solid_print, two_colour_print, noisy_gradient_print])
+def test_histogram_matches_kmeans(make_print):
+    image = Image.fromarray(make_print())
+    kmeans = ColorAnalyzer(engine='kmeans').get_dominant_color(image)
+    histogram = ColorAnalyzer(engine='histogram').get_dominant_color(image)
+    assert delta_e(histogram, kmeans) <= MAX_DELTA_E, (histogram, kmeans)
+
+
+def test_flat_prints_give_exact_colour():
+    analyzer = ColorAnalyzer(engine='histogram')
+    assert analyzer.get_dominant_color(Image.fromarray(solid_print())) == (200, 60, 40)
+    assert analyzer.get_dominant_color(Image.fromarray(two_colour_print())) == (40, 90, 180)
+
+
+def test_batch_matches_single_image():
+    analyzer = ColorAnalyzer(engine='histogram')
+    images = [Image.fromarray(make()) for make in (solid_print, two_colour_print, noisy_gradient_print)]
+    assert analyzer.get_dominant_colors(images) == [analyzer.get_dominant_color(image) for image in images]
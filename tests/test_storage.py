@@ -0,0 +1,141 @@
+"""Storage with write-behind persistence: reads see mutations at once, batches roll back, failed writes retry."""
+import json
+import time
+
+import pytest
+
+from backend.app import storage as storage_module
+from backend.app.card_store import CardDatabase
+from backend.app.models import MarketplaceCard
+
+
+def make_card(card_id: str, article: str, status: str = 'draft') -> MarketplaceCard:
+    return MarketplaceCard(
+        id=card_id, marketplace='wildberries', status=status, name=f'Товар {article}',
+        article=article, price=100, created_at='2026-01-01', updated_at='2026-01-01'
+    )
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    for name in ('STORAGE_FILE', 'PRESETS_FILE', 'CARDS_FILE', 'SETTINGS_FILE'):
+        monkeypatch.setattr(storage_module, name, tmp_path / getattr(storage_module, name).name)
+    monkeypatch.setattr(storage_module, 'CARDS_STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setattr(storage_module, 'CardDatabase', lambda: CardDatabase(tmp_path / 'cards.db'))
+    instance = storage_module.Storage()
+    yield instance
+    instance.flush()
+
+
+def stored_ids(store) -> list:
+    return [row[0] for row in store._card_db._conn.execute("SELECT id FROM cards ORDER BY rowid")]
+
+
+def test_find_cards_sees_mutations_before_flush(store):
+    store.add_card(make_card('c1', 'A1'))
+    assert [c.id for c in store.find_cards(article='a1')] == ['c1']
+
+    store.update_card('c1', {'status': 'published'})
+    assert store.find_cards(status='draft') == []
+    assert [c.id for c in store.find_cards(status='published')] == ['c1']
+
+    with store.batch():
+        store.add_card(make_card('c2', 'A2'))
+        assert [c.id for c in store.find_cards(article='A2')] == ['c2']
+        assert stored_ids(store) == []  # nothing is written while the batch is open
+
+    assert stored_ids(store) == ['c1', 'c2']
+
+
+def test_batch_rolls_back_on_exception(store):
+    store.add_card(make_card('c1', 'A1'))
+    store.flush()
+
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.add_card(make_card('c2', 'A2'))
+            store.delete_card('c1')
+            raise RuntimeError("import failed")
+
+    assert [c.id for c in store.get_all_cards()] == ['c1']
+    store.flush()
+    assert stored_ids(store) == ['c1']
+
+
+def test_concurrent_batches_do_not_share_rollback(store):
+    import threading
+
+    inside = threading.Event()
+    release = threading.Event()
+
+    def failing_batch():
+        with pytest.raises(RuntimeError):
+            with store.batch():
+                store.add_card(make_card('bad', 'B1'))
+                inside.set()
+                release.wait(5)
+                raise RuntimeError("import failed")
+
+    worker = threading.Thread(target=failing_batch)
+    worker.start()
+    inside.wait(5)
+
+    # Пачка другого потока ждёт окончания первой, а не становится вложенной
+    done = threading.Event()
+
+    def good_batch():
+        with store.batch():
+            store.add_card(make_card('good', 'G1'))
+        done.set()
+
+    other = threading.Thread(target=good_batch)
+    other.start()
+    assert not done.wait(0.2)
+    release.set()
+    worker.join(5)
+    other.join(5)
+
+    assert [c.id for c in store.get_all_cards()] == ['good']
+    assert stored_ids(store) == ['good']
+
+
+def test_failed_flush_is_retried(store, monkeypatch):
+    write = store._card_db.write
+    calls = []
+
+    def flaky_write(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return write(*args, **kwargs)
+
+    monkeypatch.setattr(store._card_db, 'write', flaky_write)
+    store.add_card(make_card('c1', 'A1'))
+
+    # Без новых изменений фоновый поток должен сам повторить запись после паузы
+    deadline = time.time() + 5
+    while stored_ids(store) != ['c1'] and time.time() < deadline:
+        time.sleep(0.05)
+    assert stored_ids(store) == ['c1']
+    assert len(calls) >= 2
+
+
+def test_failed_json_migration_is_retried(store, caplog):
+    cards_file = storage_module.CARDS_FILE
+    cards_file.write_text('{"cards": [', encoding='utf-8')  # обрезанный файл
+    migrating = storage_module.Storage()
+    assert 'not migrated' in caplog.text
+    assert cards_file.exists()
+
+    # Карточка, созданная до успешной миграции, не теряет её
+    migrating.add_card(make_card('new', 'N1'))
+    migrating.flush()
+    cards_file.write_text(json.dumps({'cards': [
+        make_card('old', 'O1').model_dump(mode='json'),
+        make_card('new', 'STALE').model_dump(mode='json'),
+    ]}), encoding='utf-8')
+
+    restarted = storage_module.Storage()
+    assert not cards_file.exists()
+    assert restarted.get_card('old') is not None
+    assert restarted.get_card('new').article == 'N1'